@@ -0,0 +1,42 @@
+#! /usr/bin/env python
+"""Replay a SPEAD capture file onto the network over UDP, at its recorded timing (optionally sped up
+or slowed down) or at a fixed rate, and report the rate achieved."""
+import optparse
+import logging
+import sys
+import spead64_48 as spead
+
+o = optparse.OptionParser(usage='%prog [options] CAPTURE', description=__doc__)
+o.add_option('-i', '--ip', default='127.0.0.1', help='Destination IP address (default %default)')
+o.add_option('-p', '--port', type='int', default=8888, help='Destination UDP port (default %default)')
+o.add_option('-s', '--speed', type='float', default=1.0,
+             help='Play the recorded timing this many times faster (default %default)')
+o.add_option('-g', '--gbps', type='float', default=None,
+             help='Send at this fixed rate in Gb/s instead of the recorded timing')
+o.add_option('-f', '--flat-out', action='store_true', help='Send as fast as possible')
+o.add_option('-j', '--allow-junk', action='store_true', help='Skip over junk between packets in the capture')
+o.add_option('-v', '--verbose', action='store_true', help='Log progress')
+opts, args = o.parse_args(sys.argv[1:])
+if len(args) != 1:
+    o.error('expected one capture file')
+logging.basicConfig(level=logging.INFO if opts.verbose else logging.WARNING)
+
+capture = spead.TransportMmap(args[0], allow_junk=opts.allow_junk)
+tport = spead.TransportUDPtx(opts.ip, opts.port)
+rate = opts.gbps * 1e9 if opts.gbps is not None else None
+speed = None if opts.flat_out else opts.speed
+try:
+    stats = spead.replay(capture, tport, speed=speed, rate=rate)
+except ValueError, e:
+    o.error(str(e))
+finally:
+    capture.close()
+
+print 'Sent %d packets (%d bytes) in %.3f s' % (stats['packets'], stats['bytes'], stats['elapsed'])
+if stats['achieved_rate'] is not None:
+    print 'Achieved %.6f Gb/s' % (stats['achieved_rate'] / 1e9),
+    if stats['requested_rate'] is not None:
+        print '(requested %.6f Gb/s, %.1f%%)' % (stats['requested_rate'] / 1e9,
+                                                  100.0 * stats['achieved_rate'] / stats['requested_rate'])
+    else:
+        print
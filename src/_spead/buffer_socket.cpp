@@ -39,7 +39,7 @@ void ring_buffer_wipe(RingBuffer *rb) {
 		RingItem *this_item = &head_item[i];
 		pthread_mutex_destroy(&this_item->write_mutex);
 		pthread_mutex_destroy(&this_item->read_mutex);
-        if (this_item->pkt != NULL) free(this_item->pkt);
+        if (this_item->pkt != NULL) spead_packet_free(this_item->pkt);
 	}
 	free(head_item);
     rb->list_ptr = NULL;
@@ -54,7 +54,7 @@ void ring_buffer_wipe(RingBuffer *rb) {
 int default_callback(SpeadPacket *pkt, void *userdata) {
     printf("    Readout packet: heap_cnt=%d, n_items=%d, payload_len=%d\n, payload_off=%d\n", 
             pkt->heap_cnt, pkt->n_items, pkt->payload_len, pkt->payload_off);
-    free(pkt);
+    spead_packet_free(pkt);
     return 0;
 }
 
@@ -66,6 +66,12 @@ void buffer_socket_init(BufferSocket *bs, size_t item_count) {
     DBGPRINTF("buffer_socket_init: Setting bs->run_threads to 0\n");
     bs->run_threads = 0;
     bs->userdata = NULL;
+    bs->pkts_received = 0;
+    bs->pkts_invalid = 0;
+    bs->ring_full = 0;
+    bs->pkts_dropped = -1;
+    bs->terms_received = 0;
+    bs->n_streams = 1;
 }
 
 void buffer_socket_wipe(BufferSocket *bs) {
@@ -90,6 +96,7 @@ int buffer_socket_start(BufferSocket *bs, int port, int buffer_size) {
     }
     bs->port = port;
     bs->buffer_size = buffer_size;
+    bs->terms_received = 0;
     DBGPRINTF("buffer_socket_start: Setting bs->run_threads to 1\n");
     bs->run_threads = 1;
     pthread_create(&bs->net_thread, NULL, buffer_socket_net_thread, bs);
@@ -139,10 +146,12 @@ void *buffer_socket_data_thread(void *arg) {
                 fprintf(stderr, "buffer_socket_data_thread: Callback returned nonzero.\n");
                 bs->run_threads = 0;
             } 
-            if (gotterm) bs->run_threads = 0;
+            // With several senders, carry on until each has ended its stream
+            if (gotterm && ++bs->terms_received >= bs->n_streams && bs->n_streams > 0) bs->run_threads = 0;
         } else {
             DBGPRINTF("buffer_socket_data_thread: Got invalid packet in slot %d\n", this_slot - bs->ringbuf->list_ptr);
-            free(this_slot->pkt);
+            bs->pkts_invalid++;
+            spead_packet_free(this_slot->pkt);
         }
             
         // At this point this_slot->pkt is an invalid reference
@@ -167,6 +176,14 @@ void *buffer_socket_net_thread(void *arg) {
     int is_ready;
     fd_set readset;
     struct timeval tv;
+    struct msghdr msg;
+    struct iovec iov;
+    struct cmsghdr *cmsg;
+    struct sockaddr_in src;
+    char cmsgbuf[CMSG_SPACE(sizeof(uint32_t)) + CMSG_SPACE(sizeof(struct timespec))];
+    int64_t drops_base;
+    int ovfl = 0;
+    socklen_t ovfl_len = sizeof(ovfl);
 
     // If sock open fails, end all threads
     if (sock == -1) {
@@ -174,6 +191,11 @@ void *buffer_socket_net_thread(void *arg) {
         bs->run_threads = 0;
         return NULL;
     }
+    // The kernel's drop counter starts afresh with each socket, so carry over earlier drops
+    drops_base = bs->pkts_dropped > 0 ? bs->pkts_dropped : 0;
+#ifdef SO_RXQ_OVFL
+    if (getsockopt(sock, SOL_SOCKET, SO_RXQ_OVFL, &ovfl, &ovfl_len) == 0 && ovfl) bs->pkts_dropped = drops_base;
+#endif
 
     while (bs->run_threads) {
         // Poll socket until we have some data to write
@@ -190,20 +212,56 @@ void *buffer_socket_net_thread(void *arg) {
         }
         // Wait for next buffer slot to open up for writing
         DBGPRINTF("buffer_socket_net_thread: Waiting for write_mutex on slot %d\n", bs->ringbuf->write_ptr - bs->ringbuf->list_ptr);
-        pthread_mutex_lock(&bs->ringbuf->write_ptr->write_mutex);
+        if (pthread_mutex_trylock(&bs->ringbuf->write_ptr->write_mutex) != 0) {
+            // Ring is full: the consumer is behind, and the kernel may start dropping packets
+            bs->ring_full++;
+            pthread_mutex_lock(&bs->ringbuf->write_ptr->write_mutex);
+        }
         this_slot = bs->ringbuf->write_ptr;
         //if (pthread_mutex_trylock(&this_slot->write_mutex) != 0) continue;
         DBGPRINTF("buffer_socket_net_thread: Got write_mutex for slot %d\n", this_slot - bs->ringbuf->list_ptr);
         
         // For UDP, recvfrom returns exactly one packet
-        pkt = (SpeadPacket *) malloc(sizeof(SpeadPacket));
+        pkt = spead_packet_alloc();
         if (pkt == NULL) {
             fprintf(stderr, "buffer_socket_net_thread: Unable to allocate memory for packet\n");
             bs->run_threads = 0;
             return NULL;
         }
-        spead_packet_init(pkt);
-        num_bytes = recvfrom(sock, pkt->data, SPEAD_MAX_PACKET_LEN, 0, NULL, NULL);
+        // Use recvmsg rather than recvfrom, to pick up the kernel's drop counter where available
+        iov.iov_base = pkt->data;
+        iov.iov_len = SPEAD_MAX_PACKET_LEN;
+        memset(&msg, 0, sizeof(msg));
+        msg.msg_name = &src;
+        msg.msg_namelen = sizeof(src);
+        msg.msg_iov = &iov;
+        msg.msg_iovlen = 1;
+        msg.msg_control = cmsgbuf;
+        msg.msg_controllen = sizeof(cmsgbuf);
+        num_bytes = recvmsg(sock, &msg, 0);
+        if (num_bytes >= 0) {
+            bs->pkts_received++;
+            if (msg.msg_namelen >= sizeof(src) && src.sin_family == AF_INET) {
+                pkt->src_ip = ntohl(src.sin_addr.s_addr);
+                pkt->src_port = ntohs(src.sin_port);
+            }
+            for (cmsg = CMSG_FIRSTHDR(&msg); cmsg != NULL; cmsg = CMSG_NXTHDR(&msg, cmsg)) {
+                if (cmsg->cmsg_level != SOL_SOCKET) continue;
+#ifdef SO_RXQ_OVFL
+                if (cmsg->cmsg_type == SO_RXQ_OVFL)
+                    bs->pkts_dropped = drops_base + *(uint32_t *) CMSG_DATA(cmsg);
+#endif
+#ifdef SO_TIMESTAMPNS
+                if (cmsg->cmsg_type == SCM_TIMESTAMPNS) {
+                    struct timespec ts;
+                    memcpy(&ts, CMSG_DATA(cmsg), sizeof(ts));
+                    pkt->rx_time_ns = (int64_t) ts.tv_sec * 1000000000LL + ts.tv_nsec;
+                }
+#endif
+            }
+            // Without kernel timestamps, fall back on when the datagram was read
+            if (pkt->rx_time_ns == 0) pkt->rx_time_ns = spead_now_ns();
+        }
         DBGPRINTF("buffer_socket_net_thread: Received %d bytes\n", num_bytes);
         DBGPRINTF("buffer_socket_net_thread: Releasing read_mutex for slot %d\n", this_slot - bs->ringbuf->list_ptr);
         this_slot->pkt = pkt;
@@ -232,6 +290,16 @@ socket_t buffer_socket_setup_socket(short port, int buffer_size) {
     // prevent "address already in use" errors
     const int on = 1;
     if (setsockopt(sock, SOL_SOCKET, SO_REUSEADDR, (void *)&on, sizeof(on)) == -1) return -1;
+#ifdef SO_RXQ_OVFL
+    // Have the kernel report (as ancillary data) how many datagrams it dropped on this socket
+    if (setsockopt(sock, SOL_SOCKET, SO_RXQ_OVFL, (void *)&on, sizeof(on)) == -1)
+        fprintf(stderr, "warning unable to enable SO_RXQ_OVFL: %s\n", strerror(errno));
+#endif
+#ifdef SO_TIMESTAMPNS
+    // Have the kernel stamp each datagram with when it arrived
+    if (setsockopt(sock, SOL_SOCKET, SO_TIMESTAMPNS, (void *)&on, sizeof(on)) == -1)
+        fprintf(stderr, "warning unable to enable SO_TIMESTAMPNS: %s\n", strerror(errno));
+#endif
     if (buffer_size > 0) {
      result = setsockopt(sock, SOL_SOCKET, SO_RCVBUF, &buffer_size, sizeof(buffer_size));
      if(result < 0) {
@@ -8,6 +8,7 @@
 #include <string.h>
 #include <pthread.h>
 #include <netinet/in.h>
+#include <sys/socket.h>
 #include "spead_packet.h"
 
 /*___  _             ____         __  __           
@@ -54,6 +55,14 @@ typedef struct {
     int port;
     int buffer_size;
     void *userdata;
+    // Statistics
+    int64_t pkts_received;  // Datagrams read from the socket
+    int64_t pkts_invalid;   // Datagrams discarded for not being SPEAD packets
+    int64_t ring_full;      // Times the net thread had to wait for a free ring slot
+    int64_t pkts_dropped;   // Datagrams the kernel dropped for lack of socket buffer space
+                            // (via SO_RXQ_OVFL; -1 where that is not supported)
+    int64_t terms_received; // STREAM_CTRL TERM packets received
+    int n_streams;          // Stop once this many TERMs have arrived (0 for never)
 } BufferSocket;
 
 int default_callback(SpeadPacket *pkt, void *userdata);
@@ -10,12 +10,14 @@
 #include "python_api_macros.h"
 #include "structmember.h"
 #include "buffer_socket.h"
+#include "spead_recorder.h"
 
 // Python object that holds a BufferSocket
 typedef struct {
     PyObject_HEAD
     BufferSocket bs;
     PyObject *pycallback;
+    SpeadRecorder *rec;     // Non-NULL while packets are being recorded to disk
 } BsockObject;
 
 extern PyTypeObject BsockType;
@@ -3,11 +3,14 @@
 
 #include "spead_packet.h"
 
+#define SPEAD_PYHEAP_FREELIST_MAX 64   // Most deleted SpeadHeap objects kept for reuse
+
 // Python object that holds a SpeadHeap
 typedef struct {
     PyObject_HEAD
     SpeadHeap heap;
     PyObject *list_of_pypkts;
+    int busy;       // Nonzero while heap is being finalized with the GIL released
 } SpeadHeapObj;
 
 extern PyTypeObject SpeadHeapType;
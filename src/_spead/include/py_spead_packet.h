@@ -3,10 +3,13 @@
 
 #include "spead_packet.h"
 
+#define SPEAD_PYPKT_FREELIST_MAX 1024  // Most deleted SpeadPacket objects kept for reuse
+
 // Python object that holds a SpeadPacket
 typedef struct {
     PyObject_HEAD
     SpeadPacket *pkt;
+    int busy;       // Nonzero while pkt is in use with the GIL released
 } SpeadPktObj;
 
 extern PyTypeObject SpeadPktType;
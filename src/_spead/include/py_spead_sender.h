@@ -0,0 +1,17 @@
+#ifndef PY_SPEAD_SENDER_H
+#define PY_SPEAD_SENDER_H
+
+#include <Python.h>
+#include "python_api_macros.h"
+#include "structmember.h"
+#include "spead_sender.h"
+
+// Python object that holds a SpeadSender
+typedef struct {
+    PyObject_HEAD
+    SpeadSender snd;
+} SenderObject;
+
+extern PyTypeObject SenderType;
+
+#endif
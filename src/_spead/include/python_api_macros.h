@@ -30,4 +30,21 @@
         PyErr_Format(PyExc_ValueError, "expected a complex"); \
         return NULL; }
 
+// Release the GIL around native work on at least SPEAD_NOGIL_MIN_BYTES bytes; below that the
+// hand-off costs more than the work it lets run in parallel
+#define SPEAD_NOGIL_MIN_BYTES 4096
+#define SPEAD_BEGIN_NOGIL(nbytes) { \
+    PyThreadState *_save = NULL; \
+    if ((nbytes) >= SPEAD_NOGIL_MIN_BYTES) _save = PyEval_SaveThread();
+#define SPEAD_END_NOGIL \
+    if (_save != NULL) PyEval_RestoreThread(_save); }
+#define CHK_NOT_BUSY(o, name) \
+    if ((o)->busy) { \
+        PyErr_Format(PyExc_RuntimeError, "%s is in use by another thread", name); \
+        return NULL; }
+#define CHK_NOT_BUSY_INT(o, name) \
+    if ((o)->busy) { \
+        PyErr_Format(PyExc_RuntimeError, "%s is in use by another thread", name); \
+        return -1; }
+
 #endif
@@ -36,6 +36,7 @@
 
 #define SPEAD_MAX_PACKET_LEN       9200
 #define SPEAD_MAX_FMT_LEN          1024
+#define SPEAD_PKT_POOL_MAX         1024    // Most free packet buffers kept for reuse
 
 // Reserved Item IDs
 #define SPEAD_HEAP_CNT_ID           0x01
@@ -96,17 +97,35 @@ struct spead_packet {
     int is_stream_ctrl_term;
     int64_t payload_len;
     int64_t payload_off;
+    int64_t rx_time_ns;  // When the datagram was received (ns since the epoch), or 0 if unknown
+    uint32_t src_ip;     // Who sent the datagram: IPv4 address and UDP port (host byte order), or 0
+    int src_port;
     char data[SPEAD_MAX_PACKET_LEN];
     char *payload;  // Will point to spot in data where payload starts
     struct spead_packet *next; // For chaining packets together a heap
 };
 typedef struct spead_packet SpeadPacket;
 
+SpeadPacket *spead_packet_alloc(void);
+void spead_packet_free(SpeadPacket *pkt);
+void spead_packet_pool_stats(int64_t *in_use, int64_t *pooled);
+int64_t spead_now_ns(void);
 void spead_packet_init(SpeadPacket *pkt);
 void spead_packet_copy(SpeadPacket *pkt1, SpeadPacket *pkt2);
 int64_t spead_packet_unpack_header(SpeadPacket *pkt);
 int64_t spead_packet_unpack_items(SpeadPacket *pkt);
 
+// Where spead_scan_packet found a packet, and the fields needed to index it
+typedef struct {
+    int64_t offset;
+    int64_t len;
+    int64_t heap_cnt;
+    int64_t payload_off;
+    int is_stream_ctrl_term;
+} SpeadScanInfo;
+
+int64_t spead_scan_packet(const char *data, int64_t size, int64_t offset, int allow_junk, SpeadScanInfo *info);
+
 /*___                       _ ___ _                 
 / ___| _ __   ___  __ _  __| |_ _| |_ ___ _ __ ___  
 \___ \| '_ \ / _ \/ _` |/ _` || || __/ _ \ '_ ` _ \ 
@@ -119,6 +138,7 @@ struct spead_item {
     int id;
     char *val;
     int64_t len;
+    int64_t off;    // Offset of a direct-address value in the heap payload (-1 for immediate values)
     struct spead_item *next;
 };
 typedef struct spead_item SpeadItem;
@@ -144,6 +164,28 @@ typedef struct {
     SpeadPacket *last_pkt;
     SpeadItem *head_item;
     SpeadItem *last_item;
+    // When (ns since the epoch, or 0 if unknown) the heap's packets were received and when it
+    // was finalized and handed on; for tracing where the time goes before a heap is used
+    int64_t first_pkt_ns;
+    int64_t last_pkt_ns;
+    int64_t finalize_start_ns;
+    int64_t finalize_end_ns;
+    int64_t handoff_ns;
+    // Who sent the heap's first packet (see SpeadPacket)
+    uint32_t src_ip;
+    int src_port;
+    // Ids of the items to finalize, sorted (see spead_heap_set_filter), or NULL for all of them.
+    // The filter outlives spead_heap_wipe.
+    int *filter_ids;
+    int n_filter_ids;
+    // Payload ranges of the wanted items as (start, end) pairs, worked out when first needed
+    // (n_wanted is SPEAD_ERR until then)
+    int64_t *wanted;
+    int n_wanted;
+    // Payload ranges of the packets dropped by spead_heap_drop_packet as sorted (start, end) pairs
+    int64_t *dropped;
+    int n_dropped;
+    int size_dropped;
 } SpeadHeap;
 
 void spead_heap_init(SpeadHeap *heap) ;
@@ -151,5 +193,22 @@ void spead_heap_wipe(SpeadHeap *heap) ;
 int spead_heap_add_packet(SpeadHeap *heap, SpeadPacket *pkt) ;
 int spead_heap_got_all_packets(SpeadHeap *heap) ;
 int spead_heap_finalize(SpeadHeap *heap) ;
+void spead_heap_item_received(SpeadHeap *heap, SpeadItem *item, unsigned char *bitmap) ;
+
+// Where an item's value lies in a heap that may still be arriving (see spead_heap_item_spans)
+typedef struct {
+    int id;
+    int64_t off;    // Offset of a direct-address value in the heap payload (-1 for immediate values)
+    int64_t len;    // Length of the value (-1 if not yet known)
+    int64_t imm;    // An immediate value
+} SpeadItemSpan;
+
+int spead_heap_item_spans(SpeadHeap *heap, SpeadItemSpan **spans) ;
+int spead_heap_set_filter(SpeadHeap *heap, const int *ids, int n) ;
+int spead_heap_wants(SpeadHeap *heap, int id) ;
+int spead_heap_can_drop(SpeadHeap *heap, SpeadPacket *pkt) ;
+int spead_heap_drop_packet(SpeadHeap *heap, SpeadPacket *pkt) ;
+int spead_heap_has_range(SpeadHeap *heap, int64_t off, int64_t len) ;
+void spead_heap_copy_range(SpeadHeap *heap, int64_t off, int64_t len, char *dst) ;
 
 #endif
@@ -0,0 +1,58 @@
+#ifndef SPEAD_RECORDER_H
+#define SPEAD_RECORDER_H
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <stdint.h>
+#include <limits.h>
+#include "spead_packet.h"
+
+/*___                       _ ____                        _
+/ ___| _ __   ___  __ _  __| |  _ \ ___  ___ ___  _ __ __| | ___ _ __
+\___ \| '_ \ / _ \/ _` |/ _` | |_) / _ \/ __/ _ \| '__/ _` |/ _ \ '__|
+ ___) | |_) |  __/ (_| | (_| |  _ <  __/ (_| (_) | | | (_| |  __/ |
+|____/| .__/ \___|\__,_|\__,_|_| \_\___|\___\___/|_|  \__,_|\___|_|
+      |_|                                                             */
+
+// Writes are gathered in an aligned buffer of this size (a multiple of SPEAD_RECORDER_ALIGN)
+#define SPEAD_RECORDER_BUFLEN       (4 << 20)
+#define SPEAD_RECORDER_ALIGN        4096
+#define SPEAD_RECORDER_NAMELEN      (PATH_MAX + 32)
+
+// Files are named <prefix>.<file_num>.spead, each with a <file>.idx sidecar in the format read by
+// spead64_48.TransportMmap: a header (8-byte magic, file size, scan flags) followed by one
+// (heap_cnt, offset, length, payload_off, flags, timestamp) record of big-endian int64s per
+// packet, timestamp being the time in ns since the epoch that the packet was handed to the recorder.
+// The file size in the header is only filled in once the file is closed.
+#define SPEAD_RECORDER_IDX_MAGIC    "SPEADIX1"
+#define SPEAD_RECORDER_IDX_TERM     0x1
+typedef struct {
+    char prefix[PATH_MAX];
+    char filename[SPEAD_RECORDER_NAMELEN];
+    int64_t max_file_bytes;     // Rotate once a file would exceed this (0 = never)
+    double max_file_secs;       // Rotate once a file is this old (0 = never)
+    int use_direct;             // Open files with O_DIRECT where supported
+    int fd;
+    FILE *idx;
+    int file_num;
+    int64_t file_bytes;         // Bytes in current file, including those still buffered
+    double file_start;
+    char *buf;
+    size_t buf_used;
+    // Statistics
+    int64_t pkts_written;
+    int64_t bytes_written;
+    int64_t files_written;
+    int64_t write_errors;
+    double write_secs;
+    double max_write_secs;
+} SpeadRecorder;
+
+int spead_recorder_init(SpeadRecorder *rec, const char *prefix, int64_t max_file_bytes,
+        double max_file_secs, int use_direct);
+void spead_recorder_wipe(SpeadRecorder *rec);
+int spead_recorder_write(SpeadRecorder *rec, SpeadPacket *pkt);
+int spead_recorder_flush(SpeadRecorder *rec);
+int spead_recorder_callback(SpeadPacket *pkt, void *userdata);
+
+#endif
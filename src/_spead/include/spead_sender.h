@@ -0,0 +1,69 @@
+#ifndef SPEAD_SENDER_H
+#define SPEAD_SENDER_H
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <stdint.h>
+#include <pthread.h>
+#include <netinet/in.h>
+#include <sys/socket.h>
+#include "spead_packet.h"
+
+/*___                       _ ____                 _
+/ ___| _ __   ___  __ _  __| / ___|  ___ _ __   __| | ___ _ __
+\___ \| '_ \ / _ \/ _` |/ _` \___ \ / _ \ '_ \ / _` |/ _ \ '__|
+ ___) | |_) |  __/ (_| | (_| |___) |  __/ | | | (_| |  __/ |
+|____/| .__/ \___|\__,_|\__,_|____/ \___|_| |_|\__,_|\___|_|
+      |_|                                                      */
+
+// What spead_sender_put does with a heap that arrives while the queue is full
+#define SPEAD_SENDER_BLOCK          0   // Wait (up to a timeout) for the sender thread to make room
+#define SPEAD_SENDER_DROP_NEWEST    1   // Discard the new heap
+#define SPEAD_SENDER_DROP_OLDEST    2   // Discard the oldest heap still queued
+
+// A heap's packets, back to back in data, waiting to be sent
+struct spead_sender_heap {
+    int n_pkts;
+    int64_t *pkt_lens;
+    char *data;
+    int64_t nbytes;
+    double queued;              // When the heap was put on the queue
+    struct spead_sender_heap *next;
+};
+typedef struct spead_sender_heap SpeadSenderHeap;
+
+typedef struct {
+    int sock;
+    struct sockaddr_in dest;
+    double rate;                // Maximum transmission rate in bits per second (0 = unlimited)
+    int max_heaps;              // Most heaps queued at once
+    int policy;
+    pthread_t thread;
+    pthread_mutex_t lock;
+    pthread_cond_t not_empty;   // Signalled when a heap is queued, or the thread should stop
+    pthread_cond_t changed;     // Signalled when a heap leaves the queue or has been sent
+    int run_thread;
+    int busy;                   // The thread is sending a heap taken off the queue
+    SpeadSenderHeap *head, *tail;
+    int depth;
+    double last_time;           // Rate pacing: when the last packet was due to go out
+    // Statistics
+    int max_depth;
+    int64_t heaps_queued;
+    int64_t heaps_sent;
+    int64_t heaps_dropped;
+    int64_t pkts_sent;
+    int64_t bytes_sent;
+    int64_t send_errors;
+    double latency_last;        // Seconds from a heap being queued to its last packet being sent
+    double latency_max;
+    double latency_total;
+} SpeadSender;
+
+int spead_sender_init(SpeadSender *snd, const char *ip, int port, double rate, int max_heaps, int policy);
+void spead_sender_wipe(SpeadSender *snd);
+SpeadSenderHeap *spead_sender_heap_alloc(int n_pkts, int64_t nbytes);
+int spead_sender_put(SpeadSender *snd, SpeadSenderHeap *heap, double timeout);
+int spead_sender_flush(SpeadSender *snd, double timeout);
+
+#endif
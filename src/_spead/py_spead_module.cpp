@@ -7,30 +7,65 @@
 |____/| .__/ \___|\__,_|\__,_|_|   \__,_|\___|_|\_\___|\__|
       |_|                                                  */
 
+// Deleted SpeadPackets (without their packet buffers, which go back to the packet pool) are
+// kept here for reuse, so that receiving a packet does not allocate a Python object.
+// Only touched with the GIL held.
+static SpeadPktObj *pypkt_freelist[SPEAD_PYPKT_FREELIST_MAX];
+static int pypkt_freelist_len = 0;
+static long pypkt_live = 0;     // SpeadPackets created and not yet deleted, for alloc_stats()
+
 // Deallocate memory when Python object is deleted
 static void SpeadPktObj_dealloc(SpeadPktObj* self) {
+    pypkt_live--;
     if (self->pkt != NULL) {
-        free(self->pkt);
+        spead_packet_free(self->pkt);
+        self->pkt = NULL;
+    }
+    if (Py_TYPE(self) == &SpeadPktType && pypkt_freelist_len < SPEAD_PYPKT_FREELIST_MAX) {
+        pypkt_freelist[pypkt_freelist_len++] = self;
+        return;
     }
     self->ob_type->tp_free((PyObject*)self);
 }
 
+// Get a SpeadPacket object with no packet buffer, from the freelist if possible
+static SpeadPktObj *SpeadPktObj_alloc(void) {
+    SpeadPktObj *self;
+    if (pypkt_freelist_len > 0) {
+        self = pypkt_freelist[--pypkt_freelist_len];
+        PyObject_INIT(self, &SpeadPktType);
+    } else {
+        self = PyObject_NEW(SpeadPktObj, &SpeadPktType);
+        if (self == NULL) return NULL;
+    }
+    pypkt_live++;
+    self->pkt = NULL;
+    self->busy = 0;
+    return self;
+}
+
 // Allocate memory for Python object 
 static PyObject *SpeadPktObj_new(PyTypeObject *type,
         PyObject *args, PyObject *kwds) {
     SpeadPktObj *self;
+    if (type == &SpeadPktType) return (PyObject *) SpeadPktObj_alloc();
     self = (SpeadPktObj *) type->tp_alloc(type, 0);
+    if (self != NULL) pypkt_live++;
     return (PyObject *) self;
 }
 
 // Initialize object (__init__)
 static int SpeadPktObj_init(SpeadPktObj *self) {
-    self->pkt = (SpeadPacket *) malloc(sizeof(SpeadPacket));
+    CHK_NOT_BUSY_INT(self, "SpeadPacket");
+    if (self->pkt != NULL) {
+        spead_packet_init(self->pkt);
+        return 0;
+    }
+    self->pkt = spead_packet_alloc();
     if (self->pkt == NULL) {
         PyErr_Format(PyExc_MemoryError, "Could not allocate memory for SPEAD packet");
         return -1;
     }
-    spead_packet_init(self->pkt);
     return 0;
 }
 
@@ -39,6 +74,7 @@ PyObject *SpeadPktObj_unpack_header(SpeadPktObj *self, PyObject *args) {
     char *data;
     Py_ssize_t i, size;
     if (!PyArg_ParseTuple(args, "s#", &data, &size)) return NULL;
+    CHK_NOT_BUSY(self, "SpeadPacket");
     if (size < SPEAD_ITEMLEN) {
         PyErr_Format(PyExc_ValueError, "len(data) = %d (needed at least %d)", size, SPEAD_ITEMLEN);
         return NULL;
@@ -59,6 +95,7 @@ PyObject *SpeadPktObj_unpack_items(SpeadPktObj *self, PyObject *args) {
     char *data;
     Py_ssize_t i, size, item_bytes;
     if (!PyArg_ParseTuple(args, "s#", &data, &size)) return NULL;
+    CHK_NOT_BUSY(self, "SpeadPacket");
     item_bytes = self->pkt->n_items * SPEAD_ITEMLEN;
     if (size < item_bytes) {
         PyErr_Format(PyExc_ValueError, "len(data) = %d (needed at least %d)", size, item_bytes);
@@ -78,53 +115,78 @@ PyObject *SpeadPktObj_unpack_items(SpeadPktObj *self, PyObject *args) {
     return Py_BuildValue("n", size);
 }
 
+// Copy a whole packet from data into pkt and unpack it.  Touches no Python objects, so it may run
+// without the GIL.  On failure, returns SPEAD_ERR and sets *err to a SPEAD_UNPACK_* code, and
+// *needed to the number of bytes that were required.
+#define SPEAD_UNPACK_SHORT      1
+#define SPEAD_UNPACK_NOT_SPEAD  2
+#define SPEAD_UNPACK_TOO_BIG    3
+static int64_t spead_packet_unpack_data(SpeadPacket *pkt, char *data, Py_ssize_t size, int *err, int64_t *needed) {
+    int64_t item_bytes;
+    *needed = SPEAD_ITEMLEN;
+    if (size < SPEAD_ITEMLEN) { *err = SPEAD_UNPACK_SHORT; return SPEAD_ERR; }
+    memcpy(pkt->data, data, SPEAD_ITEMLEN);
+    if (spead_packet_unpack_header(pkt) == SPEAD_ERR) { *err = SPEAD_UNPACK_NOT_SPEAD; return SPEAD_ERR; }
+    item_bytes = pkt->n_items * SPEAD_ITEMLEN;
+    *needed = item_bytes + SPEAD_ITEMLEN;
+    if (size < *needed) { *err = SPEAD_UNPACK_SHORT; return SPEAD_ERR; }
+    if (*needed > SPEAD_MAX_PACKET_LEN) { *err = SPEAD_UNPACK_TOO_BIG; return SPEAD_ERR; }
+    memcpy(pkt->data + SPEAD_ITEMLEN, data + SPEAD_ITEMLEN, item_bytes);
+    spead_packet_unpack_items(pkt);
+    *needed = SPEAD_ITEMLEN + item_bytes + pkt->payload_len;
+    if (*needed > SPEAD_MAX_PACKET_LEN) { *err = SPEAD_UNPACK_TOO_BIG; return SPEAD_ERR; }
+    if (size < *needed) { *err = SPEAD_UNPACK_SHORT; return SPEAD_ERR; }
+    memcpy(pkt->payload, data + item_bytes + SPEAD_ITEMLEN, pkt->payload_len);
+    return *needed;
+}
+
 // Unpack all from a string
 PyObject *SpeadPktObj_unpack(SpeadPktObj *self, PyObject *args) {
     char *data;
-    Py_ssize_t i, size, item_bytes;
+    Py_ssize_t size;
+    int64_t rv, needed;
+    int err=0;
     if (!PyArg_ParseTuple(args, "s#", &data, &size)) return NULL;
-    if (size < SPEAD_ITEMLEN) {
-        PyErr_Format(PyExc_ValueError, "len(data) = %d (needed at least %d)", size, SPEAD_ITEMLEN);
-        return NULL;
-    }
-    for (i=0; i < SPEAD_ITEMLEN; i++) {
-        self->pkt->data[i] = data[i];
-    }
-    if (spead_packet_unpack_header(self->pkt) == SPEAD_ERR) {
-        PyErr_Format(PyExc_ValueError, "data does not represent a SPEAD packet");
-        return NULL;
-    }
-    item_bytes = self->pkt->n_items * SPEAD_ITEMLEN;
-    if (size < item_bytes + SPEAD_ITEMLEN) {
-        PyErr_Format(PyExc_ValueError, "len(data) = %d (needed at least %d)", size, item_bytes + SPEAD_ITEMLEN);
-        return NULL;
-    }
-    for (i=0; i < item_bytes; i++) {
-        self->pkt->data[i + SPEAD_ITEMLEN] = data[i + SPEAD_ITEMLEN];
-    }
-    spead_packet_unpack_items(self->pkt);
-    if (SPEAD_ITEMLEN + item_bytes + self->pkt->payload_len > SPEAD_MAX_PACKET_LEN) {
-        PyErr_Format(PyExc_ValueError, "packet size (%d) exceeds max of %d bytes", size, SPEAD_MAX_PACKET_LEN);
-        return NULL;
-    } else if (size < item_bytes + SPEAD_ITEMLEN + self->pkt->payload_len) {
-        PyErr_Format(PyExc_ValueError, "len(data) = %d (needed at least %d)", size, item_bytes + SPEAD_ITEMLEN);
+    CHK_NOT_BUSY(self, "SpeadPacket");
+    self->busy++;
+    SPEAD_BEGIN_NOGIL(size)
+    rv = spead_packet_unpack_data(self->pkt, data, size, &err, &needed);
+    SPEAD_END_NOGIL
+    self->busy--;
+    if (rv == SPEAD_ERR) {
+        switch (err) {
+            case SPEAD_UNPACK_NOT_SPEAD:
+                PyErr_Format(PyExc_ValueError, "data does not represent a SPEAD packet"); break;
+            case SPEAD_UNPACK_TOO_BIG:
+                PyErr_Format(PyExc_ValueError, "packet size (%lld) exceeds max of %d bytes",
+                    (long long) needed, SPEAD_MAX_PACKET_LEN); break;
+            default:
+                PyErr_Format(PyExc_ValueError, "len(data) = %d (needed at least %lld)", (int) size,
+                    (long long) needed); break;
+        }
         return NULL;
     }
-    for (i=0; i < self->pkt->payload_len; i++) {
-        self->pkt->payload[i] = data[i + item_bytes + SPEAD_ITEMLEN];
-    }
-    return Py_BuildValue(BUILDLONG, SPEAD_ITEMLEN + item_bytes + self->pkt->payload_len);
+    return Py_BuildValue(BUILDLONG, rv);
 }
 
 // Pack all to a string
 PyObject *SpeadPktObj_pack(SpeadPktObj *self) {
     Py_ssize_t size;
+    PyObject *rv;
+    CHK_NOT_BUSY(self, "SpeadPacket");
     size = SPEAD_ITEMLEN * (self->pkt->n_items + 1) + self->pkt->payload_len;
     if (size <= 0 || size > SPEAD_MAX_PACKET_LEN) {
         PyErr_Format(PyExc_ValueError, "This packet is uninitialized or malformed.  Cannot currently pack");
         return NULL;
     }
-    return Py_BuildValue("s#", self->pkt->data, size);
+    rv = PyString_FromStringAndSize(NULL, size);
+    if (rv == NULL) return NULL;
+    self->busy++;
+    SPEAD_BEGIN_NOGIL(size)
+    memcpy(PyString_AS_STRING(rv), self->pkt->data, size);
+    SPEAD_END_NOGIL
+    self->busy--;
+    return rv;
 }
 
 PyObject *SpeadPktObj_get_heapcnt(SpeadPktObj *self, void *closure) {
@@ -152,6 +214,24 @@ PyObject *SpeadPktObj_get_payloadoff(SpeadPktObj *self, void *closure) {
     return Py_BuildValue(BUILDLONG, self->pkt->payload_off);
 }
 
+PyObject *SpeadPktObj_get_rxtimens(SpeadPktObj *self, void *closure) {
+    return Py_BuildValue(BUILDLONG, self->pkt->rx_time_ns);
+}
+
+// Return (ip, port) for a sender address, or None if it is unknown
+static PyObject *build_src_addr(uint32_t ip, int port) {
+    if (ip == 0 && port == 0) {
+        Py_INCREF(Py_None);
+        return Py_None;
+    }
+    return Py_BuildValue("(Ni)", PyString_FromFormat("%u.%u.%u.%u", (unsigned) (ip >> 24) & 0xFF,
+        (unsigned) (ip >> 16) & 0xFF, (unsigned) (ip >> 8) & 0xFF, (unsigned) ip & 0xFF), port);
+}
+
+PyObject *SpeadPktObj_get_srcaddr(SpeadPktObj *self, void *closure) {
+    return build_src_addr(self->pkt->src_ip, self->pkt->src_port);
+}
+
 // Get packet payload
 PyObject *SpeadPktObj_get_payload(SpeadPktObj *self, void *closure) {
     if (self->pkt->payload_len == 0 || self->pkt->payload == NULL) {
@@ -167,6 +247,10 @@ int SpeadPktObj_set_payload(SpeadPktObj *self, PyObject *value, void *closure) {
         PyErr_Format(PyExc_ValueError, "payload must be a string");
         return -1;
     }
+    if (self->busy) {
+        PyErr_Format(PyExc_RuntimeError, "SpeadPacket is in use by another thread");
+        return -1;
+    }
     PyString_AsStringAndSize(value, &data, &size);
     if (self->pkt->payload == NULL) {
         PyErr_Format(PyExc_RuntimeError, "SpeadPacket header not initialized");
@@ -201,6 +285,10 @@ int SpeadPktObj_set_items(SpeadPktObj *self, PyObject *items, void *closure) {
     PyObject *iter1, *iter2, *item1, *item2;
     int n_items=0, i;
     int64_t data[3];
+    if (self->busy) {
+        PyErr_Format(PyExc_RuntimeError, "SpeadPacket is in use by another thread");
+        return -1;
+    }
     iter1 = PyObject_GetIter(items);
     if (iter1 == NULL) return -1;
     while (item1 = PyIter_Next(iter1)) {
@@ -265,6 +353,8 @@ static PyGetSetDef SpeadPktObj_getseters[] = {
     {"is_stream_ctrl_term", (getter)SpeadPktObj_get_isstreamctrlterm, NULL, "is_stream_ctrl_term", NULL},
     {"payload_len", (getter)SpeadPktObj_get_payloadlen, NULL, "payload_len", NULL},
     {"payload_off", (getter)SpeadPktObj_get_payloadoff, NULL, "payload_off", NULL},
+    {"rx_time_ns", (getter)SpeadPktObj_get_rxtimens, NULL, "When the packet was received by a BufferSocket (ns since the epoch, from SO_TIMESTAMPNS where available), or 0", NULL},
+    {"src_addr", (getter)SpeadPktObj_get_srcaddr, NULL, "The (ip, port) that sent the packet to a BufferSocket, or None", NULL},
     {"payload", (getter)SpeadPktObj_get_payload, (setter)SpeadPktObj_set_payload, "payload", NULL},
     {"items", (getter)SpeadPktObj_get_items, (setter)SpeadPktObj_set_items, "items", NULL},
     {NULL}  /* Sentinel */
@@ -319,13 +409,40 @@ PyTypeObject SpeadPktType = {
 |____/| .__/ \___|\__,_|\__,_|_| |_|\___|\__,_| .__/ 
       |_|                                     |_|    */
 
-// Deallocate memory when Python object is deleted
-static void SpeadHeapObj_dealloc(SpeadHeapObj* self) {
+// Deleted SpeadHeaps (emptied, but keeping their list_of_pypkts) are kept here for reuse.
+// Only touched with the GIL held.
+static SpeadHeapObj *pyheap_freelist[SPEAD_PYHEAP_FREELIST_MAX];
+static int pyheap_freelist_len = 0;
+static long pyheap_live = 0;    // SpeadHeaps created and not yet deleted, for alloc_stats()
+
+// Empty a heap, releasing its items and its references to its packets
+static void SpeadHeapObj_clear(SpeadHeapObj *self) {
+    SpeadPacket *pkt, *next_pkt;
     // self->heap is sharing references to pkts with pypkts in self->list_of_pypkts
     // we have to first unlink the packets so only Python deallocates packets
-    self->heap.head_pkt = NULL;  
-    Py_DECREF(self->list_of_pypkts);
+    pkt = self->heap.head_pkt;
+    while (pkt != NULL) {
+        next_pkt = pkt->next;
+        pkt->next = NULL;  // A packet still referenced elsewhere may be added to another heap
+        pkt = next_pkt;
+    }
+    self->heap.head_pkt = NULL;
     spead_heap_wipe(&self->heap);
+    if (self->list_of_pypkts != NULL)
+        PyList_SetSlice(self->list_of_pypkts, 0, PyList_GET_SIZE(self->list_of_pypkts), NULL);
+}
+
+// Deallocate memory when Python object is deleted
+static void SpeadHeapObj_dealloc(SpeadHeapObj* self) {
+    pyheap_live--;
+    SpeadHeapObj_clear(self);
+    spead_heap_set_filter(&self->heap, NULL, -1);
+    if (Py_TYPE(self) == &SpeadHeapType && self->list_of_pypkts != NULL &&
+            pyheap_freelist_len < SPEAD_PYHEAP_FREELIST_MAX) {
+        pyheap_freelist[pyheap_freelist_len++] = self;
+        return;
+    }
+    Py_XDECREF(self->list_of_pypkts);
     self->ob_type->tp_free((PyObject*)self);
 }
 
@@ -333,23 +450,60 @@ static void SpeadHeapObj_dealloc(SpeadHeapObj* self) {
 static PyObject *SpeadHeapObj_new(PyTypeObject *type,
         PyObject *args, PyObject *kwds) {
     SpeadHeapObj *self;
+    if (type == &SpeadHeapType && pyheap_freelist_len > 0) {
+        self = pyheap_freelist[--pyheap_freelist_len];
+        PyObject_INIT(self, &SpeadHeapType);
+        self->busy = 0;
+        pyheap_live++;
+        return (PyObject *) self;
+    }
     self = (SpeadHeapObj *) type->tp_alloc(type, 0);
+    if (self != NULL) pyheap_live++;
     return (PyObject *) self;
 }
 
 // Initialize object (__init__)
 static int SpeadHeapObj_init(SpeadHeapObj *self) {
+    CHK_NOT_BUSY_INT(self, "SpeadHeap");
+    if (self->list_of_pypkts != NULL) {
+        SpeadHeapObj_clear(self);
+        return 0;
+    }
     spead_heap_init(&self->heap);
     // This holds pypkts in spead_heap to prevent them from being GC'd
     self->list_of_pypkts = PyList_New(0);
+    if (self->list_of_pypkts == NULL) return -1;
     return 0;
 }
 
+// Empty the heap for reuse
+PyObject *SpeadHeapObj_reset(SpeadHeapObj *self) {
+    CHK_NOT_BUSY(self, "SpeadHeap");
+    SpeadHeapObj_clear(self);
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+// Note when the heap was handed on to its consumer
+PyObject *SpeadHeapObj_stamp_handoff(SpeadHeapObj *self) {
+    self->heap.handoff_ns = spead_now_ns();
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
 // Add a packet to the heap
 PyObject *SpeadHeapObj_add_packet(SpeadHeapObj *self, PyObject *args) {
     SpeadPktObj *pkto;
     int rv;
     if (!PyArg_ParseTuple(args, "O!", &SpeadPktType, &pkto)) return NULL;
+    CHK_NOT_BUSY(self, "SpeadHeap");
+    CHK_NOT_BUSY(pkto, "SpeadPacket");
+    // A packet holding only items that the filter leaves out is not kept
+    if (spead_heap_can_drop(&self->heap, pkto->pkt)) {
+        rv = spead_heap_drop_packet(&self->heap, pkto->pkt);
+        if (rv == SPEAD_ERR) return PyErr_NoMemory();
+        return Py_BuildValue("i", rv);
+    }
     rv = spead_heap_add_packet(&self->heap, pkto->pkt);
     if (rv == SPEAD_ERR) {
         PyErr_Format(PyExc_ValueError, "SpeadPacket not part of heap, or it is incorrectly initialized");
@@ -360,9 +514,22 @@ PyObject *SpeadHeapObj_add_packet(SpeadHeapObj *self, PyObject *args) {
     return Py_BuildValue("i", rv);
 }
 
-// Add a packet to the heap
+// Finalize heap, without holding the GIL while item values are copied out of the packets.
+// The heap and its packets are marked busy meanwhile, so other threads cannot modify them.
 PyObject *SpeadHeapObj_finalize(SpeadHeapObj *self) {
-    if (spead_heap_finalize(&self->heap) == SPEAD_ERR) {
+    Py_ssize_t i, n;
+    int rv;
+    CHK_NOT_BUSY(self, "SpeadHeap");
+    n = PyList_GET_SIZE(self->list_of_pypkts);
+    for (i=0; i < n; i++) CHK_NOT_BUSY((SpeadPktObj *) PyList_GET_ITEM(self->list_of_pypkts, i), "SpeadPacket");
+    self->busy = 1;
+    for (i=0; i < n; i++) ((SpeadPktObj *) PyList_GET_ITEM(self->list_of_pypkts, i))->busy++;
+    Py_BEGIN_ALLOW_THREADS
+    rv = spead_heap_finalize(&self->heap);
+    Py_END_ALLOW_THREADS
+    for (i=0; i < n; i++) ((SpeadPktObj *) PyList_GET_ITEM(self->list_of_pypkts, i))->busy--;
+    self->busy = 0;
+    if (rv == SPEAD_ERR) {
         PyErr_Format(PyExc_MemoryError, "Memory allocation failed in SpeadHeap.finalize()");
         return NULL;
     }
@@ -371,10 +538,13 @@ PyObject *SpeadHeapObj_finalize(SpeadHeapObj *self) {
 }
 
 // Get the final items from a heap
-PyObject *SpeadHeapObj_get_items(SpeadHeapObj *self) {
-    int result;
+PyObject *SpeadHeapObj_get_items(SpeadHeapObj *self, PyObject *args, PyObject *kwds) {
+    int result, include_invalid=0;
     SpeadItem *item;
     PyObject *rv, *key, *value;
+    static char *kwlist[] = {"include_invalid", NULL};
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "|i", kwlist, &include_invalid)) return NULL;
+    CHK_NOT_BUSY(self, "SpeadHeap");
     if (self->heap.head_item == NULL) {
         PyErr_Format(PyExc_RuntimeError, "SpeadHeap was not finalized before SpeadHeap.get_items() was called");
         return NULL;
@@ -392,7 +562,8 @@ PyObject *SpeadHeapObj_get_items(SpeadHeapObj *self) {
     Py_DECREF(value);
     item = self->heap.head_item;
     while (item != NULL) {
-        if (item->is_valid) {
+        // Invalid values are zero where packets are missing; those cut short (len < 0) have none
+        if (item->is_valid || (include_invalid && item->len >= 0)) {
             // Build key:value pair
             key = PyInt_FromLong(item->id);
             if (item->len == 0) {
@@ -421,17 +592,170 @@ PyObject *SpeadHeapObj_get_items(SpeadHeapObj *self) {
     return rv;
 }
 
+// List the ids of the items that were not completely received
+PyObject *SpeadHeapObj_get_invalid_ids(SpeadHeapObj *self) {
+    SpeadItem *item;
+    PyObject *rv, *id;
+    CHK_NOT_BUSY(self, "SpeadHeap");
+    rv = PyList_New(0);
+    if (rv == NULL) return NULL;
+    for (item = self->heap.head_item; item != NULL; item = item->next) {
+        if (item->is_valid) continue;
+        id = PyInt_FromLong(item->id);
+        if (id == NULL || PyList_Append(rv, id) == -1) {
+            Py_XDECREF(id);
+            Py_DECREF(rv);
+            return NULL;
+        }
+        Py_DECREF(id);
+    }
+    return rv;
+}
+
+// Return a bitmap of the bytes of an item's value that were received
+PyObject *SpeadHeapObj_get_received(SpeadHeapObj *self, PyObject *args) {
+    SpeadItem *item;
+    PyObject *rv;
+    long id;
+    if (!PyArg_ParseTuple(args, "l", &id)) return NULL;
+    CHK_NOT_BUSY(self, "SpeadHeap");
+    for (item = self->heap.head_item; item != NULL; item = item->next) {
+        if (item->id == id) break;
+    }
+    if (item == NULL || item->len < 0) {
+        PyErr_Format(PyExc_KeyError, "no value for item %ld in this heap (is it finalized?)", id);
+        return NULL;
+    }
+    rv = PyString_FromStringAndSize(NULL, (item->len + 7) / 8);
+    if (rv == NULL) return NULL;
+    spead_heap_item_received(&self->heap, item, (unsigned char *) PyString_AS_STRING(rv));
+    return rv;
+}
+
+// Return the values of the items of a heap still being assembled that have been completely received
+PyObject *SpeadHeapObj_get_ready_items(SpeadHeapObj *self, PyObject *args) {
+    SpeadItemSpan *spans;
+    PyObject *done=NULL, *rv, *key, *value, *tup;
+    int i, n, o, seen;
+    char *val;
+    if (!PyArg_ParseTuple(args, "|O", &done)) return NULL;
+    CHK_NOT_BUSY(self, "SpeadHeap");
+    n = spead_heap_item_spans(&self->heap, &spans);
+    if (n == SPEAD_ERR) return PyErr_NoMemory();
+    rv = PyList_New(0);
+    if (rv == NULL) goto fail;
+    for (i=0; i < n; i++) {
+        if (spans[i].len < 0 || !spead_heap_wants(&self->heap, spans[i].id)) continue;
+        if (spans[i].off >= 0 && !spead_heap_has_range(&self->heap, spans[i].off, spans[i].len)) continue;
+        // Direct items are known by their offset, immediate ones by -1 - id
+        key = PyLong_FromLongLong(spans[i].off >= 0 ? spans[i].off : -1 - (int64_t) spans[i].id);
+        if (key == NULL) goto fail;
+        if (done != NULL && done != Py_None) {
+            seen = PySequence_Contains(done, key);
+            if (seen == -1) {
+                Py_DECREF(key);
+                goto fail;
+            }
+            if (seen) {
+                Py_DECREF(key);
+                continue;
+            }
+        }
+        value = PyString_FromStringAndSize(NULL, spans[i].len);
+        if (value == NULL) {
+            Py_DECREF(key);
+            goto fail;
+        }
+        val = PyString_AS_STRING(value);
+        if (spans[i].off >= 0) {
+            spead_heap_copy_range(&self->heap, spans[i].off, spans[i].len, val);
+        } else {
+            // Immediate values are re-converted to big-endian strings, as in finalize()
+            for (o=0; o < SPEAD_ADDRLEN; o++) val[o] = 0xFF & (spans[i].imm >> (8 * (SPEAD_ADDRLEN - o - 1)));
+        }
+        tup = Py_BuildValue("(NiN)", key, spans[i].id, value);
+        if (tup == NULL || PyList_Append(rv, tup) == -1) {
+            Py_XDECREF(tup);
+            goto fail;
+        }
+        Py_DECREF(tup);
+    }
+    free(spans);
+    return rv;
+fail:
+    free(spans);
+    Py_XDECREF(rv);
+    return NULL;
+}
+
+// Set (or with None, clear) the ids of the items to assemble
+PyObject *SpeadHeapObj_set_item_filter(SpeadHeapObj *self, PyObject *args) {
+    PyObject *ids=Py_None, *seq;
+    Py_ssize_t i, n;
+    int *filter_ids, rv;
+    if (!PyArg_ParseTuple(args, "|O", &ids)) return NULL;
+    CHK_NOT_BUSY(self, "SpeadHeap");
+    if (ids == Py_None) {
+        spead_heap_set_filter(&self->heap, NULL, -1);
+        Py_INCREF(Py_None);
+        return Py_None;
+    }
+    seq = PySequence_Fast(ids, "SpeadHeap.set_item_filter() takes a sequence of item ids");
+    if (seq == NULL) return NULL;
+    n = PySequence_Fast_GET_SIZE(seq);
+    filter_ids = (int *) malloc((n > 0 ? n : 1) * sizeof(int));
+    if (filter_ids == NULL) {
+        Py_DECREF(seq);
+        return PyErr_NoMemory();
+    }
+    for (i=0; i < n; i++) {
+        filter_ids[i] = (int) PyInt_AsLong(PySequence_Fast_GET_ITEM(seq, i));
+        if (filter_ids[i] == -1 && PyErr_Occurred()) {
+            free(filter_ids);
+            Py_DECREF(seq);
+            return NULL;
+        }
+    }
+    Py_DECREF(seq);
+    rv = spead_heap_set_filter(&self->heap, filter_ids, (int) n);
+    free(filter_ids);
+    if (rv == SPEAD_ERR) return PyErr_NoMemory();
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
 // Bind methods to object
 static PyMethodDef SpeadHeapObj_methods[] = {
     {"add_packet", (PyCFunction)SpeadHeapObj_add_packet, METH_VARARGS,
         "add_packet(SpeadPacket)\nAdd SpeadPacket to this heap.  A fresh SpeadHeap will accept packets with any HEAP_CNT, but thereafter will only accept ones with the same HEAP_CNT.  Raise ValueError on failure.  Returns 1 if heap is known to be complete."},
+    {"reset", (PyCFunction)SpeadHeapObj_reset, METH_NOARGS,
+        "reset()\nEmpty this heap so that it accepts packets with any HEAP_CNT again, dropping its references to its packets (which return to the packet pool once nothing else refers to them)."},
     {"finalize", (PyCFunction)SpeadHeapObj_finalize, METH_NOARGS,
         "finalize()\nTry to finalize the values of all items in this heap.  Check SpeadHeap.is_valid to see if all values were able to be finalized."},
-    {"get_items", (PyCFunction)SpeadHeapObj_get_items, METH_NOARGS,
-        "get_items()\nReturn a dictionary of id:value pairs for all valid items in a finalized heap."},
+    {"get_items", (PyCFunction)SpeadHeapObj_get_items, METH_VARARGS | METH_KEYWORDS,
+        "get_items(include_invalid=False)\nReturn a dictionary of id:value pairs for all valid items in a finalized heap.  With include_invalid, also return items that were only partly received, with zeros in place of the missing bytes (see get_invalid_ids and get_received)."},
+    {"get_invalid_ids", (PyCFunction)SpeadHeapObj_get_invalid_ids, METH_NOARGS,
+        "get_invalid_ids()\nReturn a list of the ids of the items in a finalized heap whose values were not completely received."},
+    {"get_received", (PyCFunction)SpeadHeapObj_get_received, METH_VARARGS,
+        "get_received(id)\nReturn a bitmap (a binary string, most significant bit first as for numpy.unpackbits) with bit i set if byte i of the value of item id was received.  Raise KeyError if the finalized heap has no value for id."},
+    {"get_ready_items", (PyCFunction)SpeadHeapObj_get_ready_items, METH_VARARGS,
+        "get_ready_items(done=None)\nFor a heap that is still being assembled, return a list of (key, id, value) for the items whose values have been completely received so far, where key identifies the item within the heap.  Items whose keys are in done are left out, so that each can be handled once as packets arrive.  Relies on the item pointers all being in the packet at payload offset 0, as iter_genpackets() sends them."},
+    {"set_item_filter", (PyCFunction)SpeadHeapObj_set_item_filter, METH_VARARGS,
+        "set_item_filter(ids=None)\nOnly assemble the items with these ids (and DESCRIPTORs, which are always kept), or all items with None.  Other items are never copied out of the packets, and packets holding nothing else are not kept by add_packet() (see dropped_packets), once the packet at payload offset 0 (with the item pointers) has arrived.  The filter stays in place through reset()."},
+    {"stamp_handoff", (PyCFunction)SpeadHeapObj_stamp_handoff, METH_NOARGS,
+        "stamp_handoff()\nSet handoff_ns to now, marking when the heap was handed on to its consumer (iterheaps() does this)."},
     {NULL}  // Sentinel
 };
 
+PyObject *SpeadHeapObj_get_srcaddr(SpeadHeapObj *self, void *closure) {
+    return build_src_addr(self->heap.src_ip, self->heap.src_port);
+}
+
+static PyGetSetDef SpeadHeapObj_getseters[] = {
+    {"src_addr", (getter)SpeadHeapObj_get_srcaddr, NULL, "The (ip, port) that sent the heap's first packet to a BufferSocket, or None", NULL},
+    {NULL}  /* Sentinel */
+};
+
 static PyMemberDef SpeadHeapObj_members[] = {
     {"heap_cnt", T_INT64, offsetof(SpeadHeapObj, heap) +
         offsetof(SpeadHeap, heap_cnt), 0, "heap_cnt"},
@@ -441,6 +765,18 @@ static PyMemberDef SpeadHeapObj_members[] = {
         offsetof(SpeadHeap, is_valid), 0, "is_valid"},
     {"has_all_packets", T_INT, offsetof(SpeadHeapObj, heap) +
         offsetof(SpeadHeap, has_all_packets), 0, "has_all_packets"},
+    {"first_pkt_ns", T_INT64, offsetof(SpeadHeapObj, heap) +
+        offsetof(SpeadHeap, first_pkt_ns), READONLY, "When the first of the heap's packets was received (ns since the epoch, or 0)"},
+    {"last_pkt_ns", T_INT64, offsetof(SpeadHeapObj, heap) +
+        offsetof(SpeadHeap, last_pkt_ns), READONLY, "When the last of the heap's packets was received (ns since the epoch, or 0)"},
+    {"finalize_start_ns", T_INT64, offsetof(SpeadHeapObj, heap) +
+        offsetof(SpeadHeap, finalize_start_ns), READONLY, "When finalize() started (ns since the epoch, or 0)"},
+    {"finalize_end_ns", T_INT64, offsetof(SpeadHeapObj, heap) +
+        offsetof(SpeadHeap, finalize_end_ns), READONLY, "When finalize() ended (ns since the epoch, or 0)"},
+    {"dropped_packets", T_INT, offsetof(SpeadHeapObj, heap) +
+        offsetof(SpeadHeap, n_dropped), READONLY, "How many packets holding only filtered-out items were not kept (see set_item_filter)"},
+    {"handoff_ns", T_INT64, offsetof(SpeadHeapObj, heap) +
+        offsetof(SpeadHeap, handoff_ns), READONLY, "When stamp_handoff() was called (ns since the epoch, or 0)"},
     {NULL}  /* Sentinel */
 };
 
@@ -475,7 +811,7 @@ PyTypeObject SpeadHeapType = {
     0,                     /* tp_iternext */
     SpeadHeapObj_methods,     /* tp_methods */
     SpeadHeapObj_members,     /* tp_members */
-    0,                         /* tp_getset */
+    SpeadHeapObj_getseters,    /* tp_getset */
     0,                         /* tp_base */
     0,                         /* tp_dict */
     0,                         /* tp_descr_get */
@@ -495,6 +831,10 @@ PyTypeObject SpeadHeapType = {
 // Deallocate memory when Python object is deleted
 static void BsockObject_dealloc(BsockObject* self) {
     buffer_socket_wipe(&self->bs);
+    if (self->rec != NULL) {
+        spead_recorder_wipe(self->rec);
+        free(self->rec);
+    }
     if (self->pycallback) Py_DECREF(self->pycallback);
     self->ob_type->tp_free((PyObject*)self);
 }
@@ -515,6 +855,7 @@ static int BsockObject_init(BsockObject *self, PyObject *args, PyObject *kwds) {
         return -1;
     buffer_socket_init(&self->bs, pkt_count);
     self->pycallback = NULL;
+    self->rec = NULL;
     return 0;
 }
 
@@ -548,10 +889,15 @@ int wrap_bs_pycallback(SpeadPacket *pkt, void *userdata) {
     gstate = PyGILState_Ensure();
     //printf("wrap_bs_pycallback: got GIL\n");
     bso = (BsockObject *) userdata;  // Recast userdata as reference to a bs
-    // Wrap pkt into a SpeadPacket python object
-    pkto = PyObject_NEW(SpeadPktObj, &SpeadPktType); // This does not call SpeadPktObj_init!
+    // Wrap pkt into a SpeadPacket python object, reusing a deleted one if possible
+    pkto = SpeadPktObj_alloc(); // This does not call SpeadPktObj_init!
+    if (pkto == NULL) {
+        spead_packet_free(pkt);
+        PyGILState_Release(gstate);
+        return 1;
+    }
     // Deviously swap in reference to this pkt instead of initializing
-    // Python will take care of freeing pkt when pkto dies.
+    // Python will take care of returning pkt to the packet pool when pkto dies.
     pkto->pkt = pkt;
     arglist = Py_BuildValue("(O)", (PyObject *)pkto);
     // Call the python callback with the wrapped-up SpeadPacket
@@ -578,6 +924,10 @@ static PyObject * BsockObject_set_callback(BsockObject *self, PyObject *args){
         PyErr_SetString(PyExc_TypeError, "parameter must be callable");
         return NULL;
     }
+    if (self->rec != NULL) {
+        PyErr_Format(PyExc_RuntimeError, "BufferSocket is recording; call stop_recording() first");
+        return NULL;
+    }
     Py_INCREF(cbk);
     if (self->pycallback != NULL) Py_DECREF(self->pycallback);
     self->bs.userdata = (void *)self;
@@ -589,6 +939,10 @@ static PyObject * BsockObject_set_callback(BsockObject *self, PyObject *args){
 
 // Routine for removing a python callback for data output
 static PyObject * BsockObject_unset_callback(BsockObject *self) {
+    if (self->rec != NULL) {
+        PyErr_Format(PyExc_RuntimeError, "BufferSocket is recording; call stop_recording() first");
+        return NULL;
+    }
     buffer_socket_set_callback(&self->bs, &default_callback);
     if (self->pycallback != NULL) Py_DECREF(self->pycallback);
     self->pycallback = NULL;
@@ -602,6 +956,98 @@ static PyObject * BsockObject_is_running(BsockObject *self) {
     return Py_BuildValue("i", self->bs.run_threads);
 }
 
+// Set how many senders must end their streams before the BufferSocket stops
+static PyObject * BsockObject_set_streams(BsockObject *self, PyObject *args) {
+    int n_streams;
+    if (!PyArg_ParseTuple(args, "i", &n_streams)) return NULL;
+    if (n_streams < 0) {
+        PyErr_Format(PyExc_ValueError, "n_streams must not be negative");
+        return NULL;
+    }
+    self->bs.n_streams = n_streams;
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+// Route packets from the ring buffer straight to disk, without entering Python
+static PyObject * BsockObject_start_recording(BsockObject *self, PyObject *args, PyObject *kwds) {
+    char *prefix;
+    PY_LONG_LONG max_file_bytes=0;
+    double max_file_secs=0;
+    int direct=0, rv;
+    static char *kwlist[] = {"prefix", "max_file_bytes", "max_file_secs", "direct", NULL};
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "s|Ldi", kwlist, &prefix, &max_file_bytes, &max_file_secs, &direct))
+        return NULL;
+    if (self->bs.run_threads) {
+        PyErr_Format(PyExc_RuntimeError, "BufferSocket must be stopped before recording can start");
+        return NULL;
+    }
+    if (self->rec != NULL) {
+        PyErr_Format(PyExc_RuntimeError, "BufferSocket is already recording");
+        return NULL;
+    }
+    self->rec = (SpeadRecorder *) malloc(sizeof(SpeadRecorder));
+    CHK_NULL(self->rec);
+    Py_BEGIN_ALLOW_THREADS
+    rv = spead_recorder_init(self->rec, prefix, max_file_bytes, max_file_secs, direct);
+    Py_END_ALLOW_THREADS
+    if (rv == SPEAD_ERR) {
+        free(self->rec);
+        self->rec = NULL;
+        return PyErr_SetFromErrnoWithFilename(PyExc_IOError, prefix);
+    }
+    if (self->pycallback != NULL) Py_DECREF(self->pycallback);
+    self->pycallback = NULL;
+    self->bs.userdata = (void *)self->rec;
+    buffer_socket_set_callback(&self->bs, &spead_recorder_callback);
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+static PyObject * BsockObject_stop_recording(BsockObject *self) {
+    if (self->rec == NULL) {
+        PyErr_Format(PyExc_RuntimeError, "BufferSocket is not recording");
+        return NULL;
+    }
+    // Release Python Global Interpreter Lock while threads are joined and files flushed
+    Py_BEGIN_ALLOW_THREADS
+    buffer_socket_stop(&self->bs);
+    spead_recorder_wipe(self->rec);
+    Py_END_ALLOW_THREADS
+    free(self->rec);
+    self->rec = NULL;
+    buffer_socket_set_callback(&self->bs, &default_callback);
+    self->bs.userdata = NULL;
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+// Get receive (and, while recording, disk) statistics
+static PyObject * BsockObject_get_stats(BsockObject *self) {
+    PyObject *rv, *value;
+    rv = Py_BuildValue("{s:L,s:L,s:L,s:L,s:L}",
+        "pkts_received", (PY_LONG_LONG) self->bs.pkts_received,
+        "pkts_invalid", (PY_LONG_LONG) self->bs.pkts_invalid,
+        "ring_full", (PY_LONG_LONG) self->bs.ring_full,
+        "pkts_dropped", (PY_LONG_LONG) self->bs.pkts_dropped,
+        "terms_received", (PY_LONG_LONG) self->bs.terms_received);
+    if (rv == NULL || self->rec == NULL) return rv;
+    value = Py_BuildValue("{s:L,s:L,s:L,s:L,s:d,s:d}",
+        "pkts_written", (PY_LONG_LONG) self->rec->pkts_written,
+        "bytes_written", (PY_LONG_LONG) self->rec->bytes_written,
+        "files_written", (PY_LONG_LONG) self->rec->files_written,
+        "write_errors", (PY_LONG_LONG) self->rec->write_errors,
+        "write_secs", self->rec->write_secs,
+        "max_write_secs", self->rec->max_write_secs);
+    if (value == NULL || PyDict_Update(rv, value) == -1) {
+        Py_XDECREF(value);
+        Py_DECREF(rv);
+        return NULL;
+    }
+    Py_DECREF(value);
+    return rv;
+}
+
 // Bind methods to object
 static PyMethodDef BsockObject_methods[] = {
     {"start", (PyCFunction)BsockObject_start, METH_VARARGS,
@@ -614,6 +1060,14 @@ static PyMethodDef BsockObject_methods[] = {
      "unset_callback()\nReset the callback to the default."},
     {"is_running", (PyCFunction)BsockObject_is_running, METH_NOARGS,
      "is_running()\nReturn 1 if receiver is running, 0 otherwise."},
+    {"set_streams", (PyCFunction)BsockObject_set_streams, METH_VARARGS,
+     "set_streams(n_streams)\nKeep receiving until n_streams STREAM_CTRL TERM packets have arrived (one from each sender), rather than stopping at the first.  0 ignores TERMs, leaving stop() to end reception."},
+    {"start_recording", (PyCFunction)BsockObject_start_recording, METH_VARARGS | METH_KEYWORDS,
+     "start_recording(prefix, max_file_bytes=0, max_file_secs=0, direct=False)\nRecord received packets to <prefix>.<n>.spead files (each with a .idx heap index readable by TransportMmap) instead of calling back into Python.  Files rotate after max_file_bytes or max_file_secs (0 = never).  With direct, files are written with O_DIRECT where supported.  Must be called before start()."},
+    {"stop_recording", (PyCFunction)BsockObject_stop_recording, METH_NOARGS,
+     "stop_recording()\nStop listening, and flush and close the recorded files."},
+    {"get_stats", (PyCFunction)BsockObject_get_stats, METH_NOARGS,
+     "get_stats()\nReturn a dictionary of receive statistics (and disk statistics while recording).  pkts_dropped counts datagrams the kernel dropped for lack of socket buffer space; it is -1 where the platform cannot report it (no SO_RXQ_OVFL)."},
     {NULL}  // Sentinel
 };
 
@@ -659,6 +1113,216 @@ PyTypeObject BsockType = {
     BsockObject_new,            /* tp_new */
 };
 
+/*___                       _ ____                 _
+/ ___| _ __   ___  __ _  __| / ___|  ___ _ __   __| | ___ _ __
+\___ \| '_ \ / _ \/ _` |/ _` \___ \ / _ \ '_ \ / _` |/ _ \ '__|
+ ___) | |_) |  __/ (_| | (_| |___) |  __/ | | | (_| |  __/ |
+|____/| .__/ \___|\__,_|\__,_|____/ \___|_| |_|\__,_|\___|_|
+      |_|                                                      */
+
+static void SenderObject_dealloc(SenderObject* self) {
+    Py_BEGIN_ALLOW_THREADS
+    spead_sender_wipe(&self->snd);
+    Py_END_ALLOW_THREADS
+    self->ob_type->tp_free((PyObject*)self);
+}
+
+static PyObject *SenderObject_new(PyTypeObject *type,
+        PyObject *args, PyObject *kwds) {
+    SenderObject *self;
+    self = (SenderObject *) type->tp_alloc(type, 0);
+    if (self != NULL) self->snd.sock = -1;
+    return (PyObject *) self;
+}
+
+// Initialize object (__init__)
+static int SenderObject_init(SenderObject *self, PyObject *args, PyObject *kwds) {
+    char *ip, *policy="block";
+    int port, max_heaps=64, pol, rv;
+    double rate=0;
+    static char *kwlist[] = {"ip", "port", "rate", "max_heaps", "policy", NULL};
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "si|dis", kwlist, &ip, &port, &rate, &max_heaps, &policy))
+        return -1;
+    if (strcmp(policy, "block") == 0) pol = SPEAD_SENDER_BLOCK;
+    else if (strcmp(policy, "drop_newest") == 0) pol = SPEAD_SENDER_DROP_NEWEST;
+    else if (strcmp(policy, "drop_oldest") == 0) pol = SPEAD_SENDER_DROP_OLDEST;
+    else {
+        PyErr_Format(PyExc_ValueError, "policy must be 'block', 'drop_newest' or 'drop_oldest', not '%s'", policy);
+        return -1;
+    }
+    if (max_heaps < 1) {
+        PyErr_Format(PyExc_ValueError, "max_heaps must be at least 1");
+        return -1;
+    }
+    Py_BEGIN_ALLOW_THREADS
+    spead_sender_wipe(&self->snd);
+    rv = spead_sender_init(&self->snd, ip, port, rate, max_heaps, pol);
+    Py_END_ALLOW_THREADS
+    if (rv == SPEAD_ERR) {
+        PyErr_SetFromErrno(PyExc_IOError);
+        return -1;
+    }
+    return 0;
+}
+
+static int SenderObject_check_open(SenderObject *self) {
+    if (self->snd.sock == -1) {
+        PyErr_Format(PyExc_RuntimeError, "PacketSender is closed");
+        return 0;
+    }
+    return 1;
+}
+
+// Copy a sequence of packets (strings or other buffers) into one block and queue it as a heap
+static PyObject * SenderObject_put(SenderObject *self, PyObject *args, PyObject *kwds) {
+    PyObject *pkts, *seq, *timeout_obj=Py_None;
+    SpeadSenderHeap *heap;
+    const void *buf;
+    Py_ssize_t buf_len, i, n;
+    int64_t nbytes=0;
+    double timeout=-1;
+    char *data;
+    int rv;
+    static char *kwlist[] = {"pkts", "timeout", NULL};
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "O|O", kwlist, &pkts, &timeout_obj))
+        return NULL;
+    if (!SenderObject_check_open(self)) return NULL;
+    if (timeout_obj != Py_None) {
+        timeout = PyFloat_AsDouble(timeout_obj);
+        if (timeout == -1 && PyErr_Occurred()) return NULL;
+        if (timeout < 0) timeout = 0;
+    }
+    seq = PySequence_Fast(pkts, "pkts must be a sequence of packets");
+    if (seq == NULL) return NULL;
+    n = PySequence_Fast_GET_SIZE(seq);
+    for (i = 0; i < n; i++) {
+        if (PyObject_AsReadBuffer(PySequence_Fast_GET_ITEM(seq, i), &buf, &buf_len) == -1) {
+            Py_DECREF(seq);
+            return NULL;
+        }
+        nbytes += buf_len;
+    }
+    heap = spead_sender_heap_alloc(n, nbytes);
+    if (heap == NULL) {
+        Py_DECREF(seq);
+        return PyErr_NoMemory();
+    }
+    data = heap->data;
+    for (i = 0; i < n; i++) {
+        PyObject_AsReadBuffer(PySequence_Fast_GET_ITEM(seq, i), &buf, &buf_len);
+        memcpy(data, buf, buf_len);
+        heap->pkt_lens[i] = buf_len;
+        data += buf_len;
+    }
+    Py_DECREF(seq);
+    // Release Python Global Interpreter Lock while waiting for room on the queue
+    Py_BEGIN_ALLOW_THREADS
+    rv = spead_sender_put(&self->snd, heap, timeout);
+    Py_END_ALLOW_THREADS
+    return PyBool_FromLong(rv);
+}
+
+static PyObject * SenderObject_flush(SenderObject *self, PyObject *args, PyObject *kwds) {
+    PyObject *timeout_obj=Py_None;
+    double timeout=-1;
+    int rv;
+    static char *kwlist[] = {"timeout", NULL};
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "|O", kwlist, &timeout_obj))
+        return NULL;
+    if (!SenderObject_check_open(self)) return NULL;
+    if (timeout_obj != Py_None) {
+        timeout = PyFloat_AsDouble(timeout_obj);
+        if (timeout == -1 && PyErr_Occurred()) return NULL;
+        if (timeout < 0) timeout = 0;
+    }
+    Py_BEGIN_ALLOW_THREADS
+    rv = spead_sender_flush(&self->snd, timeout);
+    Py_END_ALLOW_THREADS
+    return PyBool_FromLong(rv);
+}
+
+static PyObject * SenderObject_close(SenderObject *self) {
+    Py_BEGIN_ALLOW_THREADS
+    spead_sender_wipe(&self->snd);
+    Py_END_ALLOW_THREADS
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+// Get queue and send statistics.  The counters are read without the queue lock, so a dictionary
+// taken while heaps are moving may be momentarily inconsistent.
+static PyObject * SenderObject_get_stats(SenderObject *self) {
+    SpeadSender *snd = &self->snd;
+    return Py_BuildValue("{s:i,s:i,s:i,s:L,s:L,s:L,s:L,s:L,s:L,s:d,s:d,s:d}",
+        "queue_depth", snd->depth,
+        "max_queue_depth", snd->max_depth,
+        "max_heaps", snd->max_heaps,
+        "heaps_queued", (PY_LONG_LONG) snd->heaps_queued,
+        "heaps_sent", (PY_LONG_LONG) snd->heaps_sent,
+        "heaps_dropped", (PY_LONG_LONG) snd->heaps_dropped,
+        "pkts_sent", (PY_LONG_LONG) snd->pkts_sent,
+        "bytes_sent", (PY_LONG_LONG) snd->bytes_sent,
+        "send_errors", (PY_LONG_LONG) snd->send_errors,
+        "latency_last", snd->latency_last,
+        "latency_max", snd->latency_max,
+        "latency_mean", snd->heaps_sent ? snd->latency_total / snd->heaps_sent : 0.);
+}
+
+// Bind methods to object
+static PyMethodDef SenderObject_methods[] = {
+    {"put", (PyCFunction)SenderObject_put, METH_VARARGS | METH_KEYWORDS,
+     "put(pkts, timeout=None)\nCopy a heap's packets (a sequence of strings or other buffers) onto the queue for the sender thread.  If the queue is full, the policy decides: 'block' waits up to timeout seconds (None = forever) for room, 'drop_newest' discards these packets and 'drop_oldest' discards the heap queued longest.  Return True if the heap was queued, False if it was dropped."},
+    {"flush", (PyCFunction)SenderObject_flush, METH_VARARGS | METH_KEYWORDS,
+     "flush(timeout=None)\nWait up to timeout seconds (None = forever) for every queued heap to be sent.  Return True if the queue drained, False on timeout."},
+    {"close", (PyCFunction)SenderObject_close, METH_NOARGS,
+     "close()\nStop the sender thread, discarding (and counting as dropped) any heaps still queued, and close the socket."},
+    {"get_stats", (PyCFunction)SenderObject_get_stats, METH_NOARGS,
+     "get_stats()\nReturn a dictionary of queue and send statistics.  Latencies are in seconds, from put() to the last packet of a heap leaving the socket."},
+    {NULL}  // Sentinel
+};
+
+PyTypeObject SenderType = {
+    PyObject_HEAD_INIT(NULL)
+    0,                          /* ob_size */
+    "_spead.PacketSender",      /* tp_name */
+    sizeof(SenderObject),       /* tp_basicsize */
+    0,                          /* tp_itemsize */
+    (destructor)SenderObject_dealloc, /* tp_dealloc */
+    0,                          /* tp_print */
+    0,                          /* tp_getattr */
+    0,                          /* tp_setattr */
+    0,                          /* tp_compare */
+    0,                          /* tp_repr */
+    0,                          /* tp_as_number */
+    0,                          /* tp_as_sequence */
+    0,                          /* tp_as_mapping */
+    0,                          /* tp_hash  */
+    0,                          /* tp_call */
+    0,                          /* tp_str */
+    0,                          /* tp_getattro */
+    0,                          /* tp_setattro */
+    0,                          /* tp_as_buffer */
+    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE,        /* tp_flags */
+    "A bounded queue of heaps sent over UDP by a background thread. PacketSender(ip, port, rate=0, max_heaps=64, policy='block')", /* tp_doc */
+    0,                          /* tp_traverse */
+    0,                          /* tp_clear */
+    0,                          /* tp_richcompare */
+    0,                          /* tp_weaklistoffset */
+    0,                          /* tp_iter */
+    0,                          /* tp_iternext */
+    SenderObject_methods,       /* tp_methods */
+    0,                          /* tp_members */
+    0,                          /* tp_getset */
+    0,                          /* tp_base */
+    0,                          /* tp_dict */
+    0,                          /* tp_descr_get */
+    0,                          /* tp_descr_set */
+    0,                          /* tp_dictoffset */
+    (initproc)SenderObject_init, /* tp_init */
+    0,                          /* tp_alloc */
+    SenderObject_new,           /* tp_new */
+};
+
 /*___                       _   __  __           _       _      
 / ___| _ __   ___  __ _  __| | |  \/  | ___   __| |_   _| | ___ 
 \___ \| '_ \ / _ \/ _` |/ _` | | |\/| |/ _ \ / _` | | | | |/ _ \
@@ -909,12 +1573,119 @@ PyObject *spead_pack(PyObject *self, PyObject *args, PyObject *kwds) {
     return rv;
 }
 
+// Build a packed table of item pointers from (mode, id, val) triplets, where val is an address or
+// immediate value (an int), or an immediate value as a binary string of at most ADDRLEN bytes
+PyObject *spead_pack_item_table(PyObject *self, PyObject *args) {
+    PyObject *items, *seq, *rv, *item, *val;
+    Py_ssize_t n, i, j, len;
+    unsigned char *s;
+    char *data;
+    long mode, id;
+    uint64_t addr;
+    if (!PyArg_ParseTuple(args, "O", &items)) return NULL;
+    seq = PySequence_Fast(items, "items must be a sequence of (mode, id, val) triplets");
+    if (seq == NULL) return NULL;
+    n = PySequence_Fast_GET_SIZE(seq);
+    rv = PyString_FromStringAndSize(NULL, n * SPEAD_ITEMLEN);
+    if (rv == NULL) {
+        Py_DECREF(seq);
+        return NULL;
+    }
+    data = PyString_AS_STRING(rv);
+    for (i=0; i < n; i++) {
+        item = PySequence_Fast_GET_ITEM(seq, i);
+        if (!PyTuple_Check(item) || PyTuple_GET_SIZE(item) != 3) {
+            PyErr_Format(PyExc_ValueError, "items must be a sequence of (mode, id, val) triplets");
+            break;
+        }
+        mode = PyInt_AsLong(PyTuple_GET_ITEM(item, 0));
+        id = PyInt_AsLong(PyTuple_GET_ITEM(item, 1));
+        val = PyTuple_GET_ITEM(item, 2);
+        if (PyString_Check(val)) {
+            s = (unsigned char *) PyString_AS_STRING(val);
+            len = PyString_GET_SIZE(val);
+            if (len > SPEAD_ADDRLEN) {
+                PyErr_Format(PyExc_ValueError, "immediate value of item %ld is %d bytes long (max %d)",
+                    id, (int) len, SPEAD_ADDRLEN);
+                break;
+            }
+            for (j=0, addr=0; j < len; j++) addr = (addr << 8) | s[j];
+        } else if (PyInt_Check(val) || PyLong_Check(val)) {
+            addr = (uint64_t) PyInt_AsUnsignedLongLongMask(val);
+        } else {
+            PyErr_Format(PyExc_TypeError, "value of item %ld must be an int or a binary string", id);
+            break;
+        }
+        if (PyErr_Occurred()) break;
+        addr = htonll(SPEAD_ITEM_BUILD(mode, id, addr));
+        memcpy(data + i * SPEAD_ITEMLEN, &addr, SPEAD_ITEMLEN);
+    }
+    Py_DECREF(seq);
+    if (PyErr_Occurred()) {
+        Py_DECREF(rv);
+        return NULL;
+    }
+    return rv;
+}
+
+// Scan a buffer of concatenated packets, returning a batch of packet locations
+PyObject *spead_scan_packets(PyObject *self, PyObject *args, PyObject *kwds) {
+    PyObject *rv, *tup;
+    Py_buffer buf;
+    PY_LONG_LONG offset=0;
+    long max_pkts=-1, n=0;
+    int allow_junk=0;
+    SpeadScanInfo info;
+    static char *kwlist[] = {"data", "offset", "allow_junk", "max_pkts", NULL};
+    // s* (rather than s#) also accepts writable buffers, like bytearray and mmap
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "s*|Lil", kwlist, &buf, &offset, &allow_junk, &max_pkts))
+        return NULL;
+    if (offset < 0) {
+        PyBuffer_Release(&buf);
+        PyErr_Format(PyExc_ValueError, "offset must be >= 0 (got %lld)", (long long) offset);
+        return NULL;
+    }
+    rv = PyList_New(0);
+    while (rv != NULL && n != max_pkts &&
+            spead_scan_packet((const char *) buf.buf, buf.len, offset, allow_junk, &info) != SPEAD_ERR) {
+        tup = Py_BuildValue("(LLLLN)", (PY_LONG_LONG) info.offset, (PY_LONG_LONG) info.len,
+            (PY_LONG_LONG) info.heap_cnt, (PY_LONG_LONG) info.payload_off, PyBool_FromLong(info.is_stream_ctrl_term));
+        if (tup == NULL || PyList_Append(rv, tup) == -1) {
+            Py_XDECREF(tup);
+            Py_CLEAR(rv);
+            break;
+        }
+        Py_DECREF(tup);
+        offset = info.offset + info.len;
+        n++;
+    }
+    PyBuffer_Release(&buf);
+    if (rv == NULL) return NULL;
+    return Py_BuildValue("(NL)", rv, offset);
+}
+
+// Report live SpeadPacket/SpeadHeap objects and the state of the packet and object pools
+PyObject *spead_alloc_stats(PyObject *self) {
+    int64_t in_use, pooled;
+    spead_packet_pool_stats(&in_use, &pooled);
+    return Py_BuildValue("{s:l,s:l,s:i,s:i,s:L,s:L}",
+        "SpeadPacket", pypkt_live, "SpeadHeap", pyheap_live,
+        "SpeadPacket_freelist", pypkt_freelist_len, "SpeadHeap_freelist", pyheap_freelist_len,
+        "pkt_buffers_in_use", (PY_LONG_LONG) in_use, "pkt_buffers_pooled", (PY_LONG_LONG) pooled);
+}
+
 // Module methods
 static PyMethodDef spead_methods[] = {
     {"unpack", (PyCFunction)spead_unpack, METH_VARARGS | METH_KEYWORDS,
         "unpack(fmt, data, cnt=1, offset=0)\nReturn tuple using fmt to read from binary string 'data'"},
     {"pack", (PyCFunction)spead_pack, METH_VARARGS | METH_KEYWORDS,
         "pack(fmt, data, offset=0)\nReturn binary string packed from 'data' using fmt"},
+    {"pack_item_table", (PyCFunction)spead_pack_item_table, METH_VARARGS,
+        "pack_item_table(items)\nReturn the binary table of item pointers for a sequence of (mode, id, val) triplets, where val is an int, or an immediate value as a binary string of at most ADDRLEN bytes (as in heaps from ItemGroup.get_heap)."},
+    {"scan_packets", (PyCFunction)spead_scan_packets, METH_VARARGS | METH_KEYWORDS,
+        "scan_packets(data, offset=0, allow_junk=False, max_pkts=-1)\nLocate up to max_pkts complete packets in a buffer from offset on, without copying.  With allow_junk, resync on the next magic byte after unparseable data; otherwise stop there.  Return ([(offset, length, heap_cnt, payload_off, is_stream_ctrl_term), ...], offset after the last packet)."},
+    {"alloc_stats", (PyCFunction)spead_alloc_stats, METH_NOARGS,
+        "alloc_stats()\nReturn a dict of the number of live SpeadPacket and SpeadHeap objects, the lengths of their freelists, and the number of packet buffers in use and pooled (counting those held by BufferSockets), for finding leaks."},
     {NULL, NULL}  /* Sentinel */
 };
 
@@ -925,15 +1696,17 @@ static PyMethodDef spead_methods[] = {
 // Module init
 PyMODINIT_FUNC init_spead(void) {
     PyObject* m;
-    SpeadPktType.tp_new = PyType_GenericNew;
     BsockType.tp_new = PyType_GenericNew;
     if (PyType_Ready(&SpeadPktType) < 0) return;
     if (PyType_Ready(&SpeadHeapType) < 0) return;
     if (PyType_Ready(&BsockType) < 0) return;
+    if (PyType_Ready(&SenderType) < 0) return;
     m = Py_InitModule3("_spead", spead_methods,
     "A module for handling low-level (high performance) SPEAD packet manipulation.");
     Py_INCREF(&BsockType);
     PyModule_AddObject(m, "BufferSocket", (PyObject *)&BsockType);
+    Py_INCREF(&SenderType);
+    PyModule_AddObject(m, "PacketSender", (PyObject *)&SenderType);
     Py_INCREF(&SpeadHeapType);
     PyModule_AddObject(m, "SpeadHeap", (PyObject *)&SpeadHeapType);
     Py_INCREF(&SpeadPktType);
@@ -1,4 +1,7 @@
 #include <string.h>
+#include <stdlib.h>
+#include <pthread.h>
+#include <time.h>
 #include "include/spead_packet.h"
 
 // Return data at the specified offset (in bits) and # of bits as
@@ -79,6 +82,65 @@ void spead_copy_bits(char *data, char *val, int off, int n_bits) {
 |____/| .__/ \___|\__,_|\__,_|_|   \__,_|\___|_|\_\___|\__|
       |_|                                                  */
 
+/* Free packet buffers, shared by all threads (e.g. BufferSocket's receive thread and the
+ * Python objects that end up holding its packets), so that a steady stream of packets does
+ * not malloc and free a buffer for each one.  Buffers are chained through pkt->next. */
+static pthread_mutex_t spead_pkt_pool_mutex = PTHREAD_MUTEX_INITIALIZER;
+static SpeadPacket *spead_pkt_pool = NULL;
+static int spead_pkt_pool_len = 0;
+static int64_t spead_pkt_in_use = 0;    // Handed out by spead_packet_alloc and not yet freed
+
+// Get an initialized packet from the pool (or malloc), or NULL if out of memory
+SpeadPacket *spead_packet_alloc(void) {
+    SpeadPacket *pkt;
+    pthread_mutex_lock(&spead_pkt_pool_mutex);
+    pkt = spead_pkt_pool;
+    if (pkt != NULL) {
+        spead_pkt_pool = pkt->next;
+        spead_pkt_pool_len--;
+    }
+    spead_pkt_in_use++;
+    pthread_mutex_unlock(&spead_pkt_pool_mutex);
+    if (pkt == NULL) pkt = (SpeadPacket *) malloc(sizeof(SpeadPacket));
+    if (pkt == NULL) {
+        pthread_mutex_lock(&spead_pkt_pool_mutex);
+        spead_pkt_in_use--;
+        pthread_mutex_unlock(&spead_pkt_pool_mutex);
+        return NULL;
+    }
+    spead_packet_init(pkt);
+    return pkt;
+}
+
+// Return a packet from spead_packet_alloc to the pool (or free it, if the pool is full)
+void spead_packet_free(SpeadPacket *pkt) {
+    pthread_mutex_lock(&spead_pkt_pool_mutex);
+    spead_pkt_in_use--;
+    if (spead_pkt_pool_len < SPEAD_PKT_POOL_MAX) {
+        pkt->next = spead_pkt_pool;
+        spead_pkt_pool = pkt;
+        spead_pkt_pool_len++;
+        pkt = NULL;
+    }
+    pthread_mutex_unlock(&spead_pkt_pool_mutex);
+    if (pkt != NULL) free(pkt);
+}
+
+// Report how many packet buffers are in use, and how many are waiting in the pool
+void spead_packet_pool_stats(int64_t *in_use, int64_t *pooled) {
+    pthread_mutex_lock(&spead_pkt_pool_mutex);
+    *in_use = spead_pkt_in_use;
+    *pooled = spead_pkt_pool_len;
+    pthread_mutex_unlock(&spead_pkt_pool_mutex);
+}
+
+// Return the current time in ns since the epoch, on the same clock as SO_TIMESTAMPNS
+int64_t spead_now_ns(void) {
+    struct timespec ts;
+    clock_gettime(CLOCK_REALTIME, &ts);
+    return (int64_t) ts.tv_sec * 1000000000LL + ts.tv_nsec;
+}
+
 void spead_packet_init(SpeadPacket *pkt) {
     pkt->heap_cnt = SPEAD_ERR;
     pkt->heap_len = SPEAD_ERR;
@@ -86,6 +148,9 @@ void spead_packet_init(SpeadPacket *pkt) {
     pkt->is_stream_ctrl_term = 0;
     pkt->payload_len = 0;
     pkt->payload_off = 0;
+    pkt->rx_time_ns = 0;
+    pkt->src_ip = 0;
+    pkt->src_port = 0;
     pkt->payload = NULL;
     pkt->next = NULL;
 }
@@ -98,6 +163,9 @@ void spead_packet_copy(SpeadPacket *pkt1, SpeadPacket *pkt2) {
     pkt2->is_stream_ctrl_term = pkt1->is_stream_ctrl_term;
     pkt2->payload_len   = pkt1->payload_len;
     pkt2->payload_off   = pkt1->payload_off;
+    pkt2->rx_time_ns    = pkt1->rx_time_ns;
+    pkt2->src_ip        = pkt1->src_ip;
+    pkt2->src_port      = pkt1->src_port;
     pkt2->payload       = pkt1->payload;
     pkt2->next          = NULL;
     for (j=0; j < SPEAD_ITEMLEN * pkt1->n_items + pkt1->payload_len; j++) {
@@ -145,6 +213,53 @@ int64_t spead_packet_unpack_items(SpeadPacket *pkt) {
     return pkt->n_items * SPEAD_ITEMLEN; // Return # of bytes read
 }
 
+/* Find the next complete packet in data[offset:size] without copying it, filling in info.
+ * Unparseable bytes end the scan, unless allow_junk, in which case the scan resyncs on the
+ * next SPEAD_MAGIC byte (found with memchr).  Return the offset of the packet, or SPEAD_ERR
+ * if there is none. */
+int64_t spead_scan_packet(const char *data, int64_t size, int64_t offset, int allow_junk, SpeadScanInfo *info) {
+    uint64_t hdr, item;
+    int64_t hlen;
+    const char *p;
+    int i, n_items;
+    while (offset >= 0 && offset + SPEAD_HEADERLEN <= size) {
+        memcpy(&hdr, data + offset, sizeof(hdr));  // data need not be aligned
+        hdr = ntohll(hdr);
+        if ((SPEAD_GET_MAGIC(hdr) == SPEAD_MAGIC) && (SPEAD_GET_VERSION(hdr) == SPEAD_VERSION) &&
+                (SPEAD_GET_ITEMSIZE(hdr) == SPEAD_ITEM_PTR_WIDTH) &&
+                (SPEAD_GET_ADDRSIZE(hdr) == SPEAD_HEAP_ADDR_WIDTH)) {
+            n_items = SPEAD_GET_NITEMS(hdr);
+            hlen = SPEAD_ITEMLEN * (n_items + 1);
+            if (hlen <= SPEAD_MAX_PACKET_LEN && offset + hlen <= size) {
+                info->heap_cnt = SPEAD_ERR;
+                info->payload_off = 0;
+                info->is_stream_ctrl_term = 0;
+                info->len = hlen;
+                for (i=1; i <= n_items; i++) {
+                    memcpy(&item, data + offset + i * SPEAD_ITEMLEN, sizeof(item));
+                    item = ntohll(item);
+                    switch (SPEAD_ITEM_ID(item)) {
+                        case SPEAD_HEAP_CNT_ID:    info->heap_cnt    = (int64_t) SPEAD_ITEM_ADDR(item); break;
+                        case SPEAD_PAYLOAD_OFF_ID: info->payload_off = (int64_t) SPEAD_ITEM_ADDR(item); break;
+                        case SPEAD_PAYLOAD_LEN_ID: info->len = hlen + (int64_t) SPEAD_ITEM_ADDR(item); break;
+                        case SPEAD_STREAM_CTRL_ID: if (SPEAD_ITEM_ADDR(item) == SPEAD_STREAM_CTRL_TERM_VAL) info->is_stream_ctrl_term = 1; break;
+                        default: break;
+                    }
+                }
+                if (info->len <= SPEAD_MAX_PACKET_LEN && offset + info->len <= size) {
+                    info->offset = offset;
+                    return offset;
+                }
+            }
+        }
+        if (!allow_junk) break;
+        p = (const char *) memchr(data + offset + 1, SPEAD_MAGIC, size - offset - 1);
+        if (p == NULL) break;
+        offset = p - data;
+    }
+    return SPEAD_ERR;
+}
+
 /*___                       _ ___ _                 
 / ___| _ __   ___  __ _  __| |_ _| |_ ___ _ __ ___  
 \___ \| '_ \ / _ \/ _` |/ _` || || __/ _ \ '_ ` _ \ 
@@ -157,6 +272,7 @@ void spead_item_init(SpeadItem *item) {
     item->id = SPEAD_ERR;
     item->val = NULL;
     item->len = SPEAD_ERR;
+    item->off = -1;
     item->next = NULL;
 }
 
@@ -182,11 +298,26 @@ void spead_heap_init(SpeadHeap *heap) {
     heap->last_pkt = NULL;
     heap->head_item = NULL;
     heap->last_item = NULL;
+    heap->first_pkt_ns = 0;
+    heap->last_pkt_ns = 0;
+    heap->finalize_start_ns = 0;
+    heap->finalize_end_ns = 0;
+    heap->handoff_ns = 0;
+    heap->src_ip = 0;
+    heap->src_port = 0;
+    heap->filter_ids = NULL;
+    heap->n_filter_ids = 0;
+    heap->wanted = NULL;
+    heap->n_wanted = SPEAD_ERR;
+    heap->dropped = NULL;
+    heap->n_dropped = 0;
+    heap->size_dropped = 0;
 }
 
 void spead_heap_wipe(SpeadHeap *heap) {
     SpeadPacket *pkt, *next_pkt;
     SpeadItem *item, *next_item;
+    int *filter_ids = heap->filter_ids, n_filter_ids = heap->n_filter_ids;
     item = heap->head_item;
     while (item != NULL) {
         next_item = item->next;
@@ -198,13 +329,19 @@ void spead_heap_wipe(SpeadHeap *heap) {
     pkt = heap->head_pkt;
     while (pkt != NULL) {
         next_pkt = pkt->next;
-        free(pkt);
+        spead_packet_free(pkt);
         pkt = next_pkt;
     }
     // Do not touch heap->last_pkt: it was deleted above
+    free(heap->wanted);
+    free(heap->dropped);
     spead_heap_init(heap); // Wipe this heap clean
+    heap->filter_ids = filter_ids;  // ... except for its filter
+    heap->n_filter_ids = n_filter_ids;
 }
     
+static int spead_packet_has_items(SpeadPacket *pkt);
+
 int spead_heap_add_packet(SpeadHeap *heap, SpeadPacket *pkt) {
     SpeadPacket *_pkt;
     if (pkt->n_items == 0) return SPEAD_ERR;
@@ -212,6 +349,8 @@ int spead_heap_add_packet(SpeadHeap *heap, SpeadPacket *pkt) {
         heap->heap_cnt = pkt->heap_cnt;
         heap->head_pkt = pkt;
         heap->last_pkt = pkt;
+        heap->src_ip = pkt->src_ip;
+        heap->src_port = pkt->src_port;
     } 
     else { // We need to insert this packet in the correct order
         if (heap->heap_cnt != pkt->heap_cnt) return SPEAD_ERR;
@@ -237,6 +376,16 @@ int spead_heap_add_packet(SpeadHeap *heap, SpeadPacket *pkt) {
         }
     }
     if (pkt->heap_len != SPEAD_ERR) heap->heap_len = pkt->heap_len;
+    if (pkt->rx_time_ns > 0) {
+        if (heap->first_pkt_ns == 0 || pkt->rx_time_ns < heap->first_pkt_ns) heap->first_pkt_ns = pkt->rx_time_ns;
+        if (pkt->rx_time_ns > heap->last_pkt_ns) heap->last_pkt_ns = pkt->rx_time_ns;
+    }
+    // More item pointers may move where the wanted items lie (see spead_heap_can_drop)
+    if (heap->n_wanted != SPEAD_ERR && spead_packet_has_items(pkt)) {
+        free(heap->wanted);
+        heap->wanted = NULL;
+        heap->n_wanted = SPEAD_ERR;
+    }
     heap->received_len += pkt->payload_len;
     heap->has_all_packets = SPEAD_ERR;
     return spead_heap_got_all_packets(heap);
@@ -244,6 +393,8 @@ int spead_heap_add_packet(SpeadHeap *heap, SpeadPacket *pkt) {
 
 int spead_heap_got_all_packets(SpeadHeap *heap) {
     SpeadPacket *pkt = heap->head_pkt;
+    int d = 0;
+    int64_t end = 0;
     if (heap->heap_len == SPEAD_ERR || pkt == NULL) return 0;  // Don't compute if we can't know the answer
     if (heap->has_all_packets != SPEAD_ERR) return heap->has_all_packets; // Don't recompute if we do know the answer
     heap->has_all_packets = 0;
@@ -251,16 +402,34 @@ int spead_heap_got_all_packets(SpeadHeap *heap) {
     // done. If we have, we still need to check the actual packets because
     // there might be duplicates.
     if (heap->received_len < heap->heap_len) return 0;
-    while (pkt->next != NULL) {
-        if (pkt->payload_off + pkt->payload_len != pkt->next->payload_off) return 0;
-        pkt = pkt->next;
+    // Walk the packets kept and the ranges of those dropped together, in order of payload offset
+    while (pkt != NULL || d < heap->n_dropped) {
+        if (d < heap->n_dropped && (pkt == NULL || heap->dropped[2 * d] < pkt->payload_off)) {
+            if (heap->dropped[2 * d] != end) return 0;
+            end = heap->dropped[2 * d + 1];
+            d++;
+        } else {
+            if (pkt->payload_off != end) return 0;
+            end = pkt->payload_off + pkt->payload_len;
+            pkt = pkt->next;
+        }
     }
-    if (pkt->payload_off + pkt->payload_len != heap->heap_len) return 0;
+    if (end != heap->heap_len) return 0;
     heap->has_all_packets = 1;
     return 1;
 }
 
+static int spead_heap_finalize_items(SpeadHeap *heap);
+
 int spead_heap_finalize(SpeadHeap *heap) {
+    int rv;
+    heap->finalize_start_ns = spead_now_ns();
+    rv = spead_heap_finalize_items(heap);
+    heap->finalize_end_ns = spead_now_ns();
+    return rv;
+}
+
+static int spead_heap_finalize_items(SpeadHeap *heap) {
     SpeadPacket *pkt1, *pkt2;
     SpeadItem *item;
     int i, j, flag, id;
@@ -293,6 +462,7 @@ int spead_heap_finalize(SpeadHeap *heap) {
                     continue;
                 default: break;
             }
+            if (!spead_heap_wants(heap, id)) continue;  // Filtered out: never copied
             item = (SpeadItem *) malloc(sizeof(SpeadItem));
             if (item == NULL) return SPEAD_ERR;
             spead_item_init(item);
@@ -301,6 +471,7 @@ int spead_heap_finalize(SpeadHeap *heap) {
             // Direct-address items must be retrieved from the packet payloads
             if (SPEAD_ITEM_MODE(itemptr1) == SPEAD_DIRECTADDR) {
                 off = (int64_t) SPEAD_ITEM_ADDR(itemptr1);
+                item->off = off;
                 // Figure out len of item by defaulting to remaining heap, then looping over 
                 // remaining itemptrs (in all remaining of packets) to find start of next
                 // direct-address item.
@@ -376,3 +547,243 @@ int spead_heap_finalize(SpeadHeap *heap) {
     return 0;
 }
         
+
+/* Set bit i (most significant bit first, as numpy.packbits) of bitmap for each byte i of the
+ * value of item that was received, going by the payload ranges of the heap's packets.
+ * bitmap must hold (item->len + 7) / 8 bytes.  Immediate values are always complete. */
+void spead_heap_item_received(SpeadHeap *heap, SpeadItem *item, unsigned char *bitmap) {
+    SpeadPacket *pkt;
+    int64_t a, b, nbytes = (item->len + 7) / 8;
+    if (item->len <= 0) return;
+    if (item->off < 0) {
+        memset(bitmap, 0xFF, nbytes);
+    } else {
+        memset(bitmap, 0, nbytes);
+        for (pkt = heap->head_pkt; pkt != NULL; pkt = pkt->next) {
+            a = pkt->payload_off - item->off;
+            b = a + pkt->payload_len;
+            if (a < 0) a = 0;
+            if (b > item->len) b = item->len;
+            // Partial leading byte, whole bytes, then partial trailing byte
+            for (; a < b && (a & 7); a++) bitmap[a >> 3] |= 0x80 >> (a & 7);
+            if (a < (b & ~7LL)) {
+                memset(&bitmap[a >> 3], 0xFF, ((b & ~7LL) - a) >> 3);
+                a = b & ~7LL;
+            }
+            for (; a < b; a++) bitmap[a >> 3] |= 0x80 >> (a & 7);
+        }
+    }
+    // Clear the padding bits past the end of the value
+    if (item->len & 7) bitmap[nbytes - 1] &= (unsigned char) (0xFF << (8 - (item->len & 7)));
+}
+
+/* Return 1 if every byte in [off, off + len) of the heap payload is in the packets received so far.
+ * The packets are kept sorted by payload offset, so one pass suffices. */
+int spead_heap_has_range(SpeadHeap *heap, int64_t off, int64_t len) {
+    SpeadPacket *pkt;
+    int64_t end = off + len;
+    for (pkt = heap->head_pkt; pkt != NULL && off < end; pkt = pkt->next) {
+        if (pkt->payload_off > off) return 0;
+        if (pkt->payload_off + pkt->payload_len > off) off = pkt->payload_off + pkt->payload_len;
+    }
+    return off >= end;
+}
+
+/* Copy bytes [off, off + len) of the payload of a heap (which must have them all, see
+ * spead_heap_has_range) into dst. */
+void spead_heap_copy_range(SpeadHeap *heap, int64_t off, int64_t len, char *dst) {
+    SpeadPacket *pkt;
+    int64_t a, b;
+    for (pkt = heap->head_pkt; pkt != NULL; pkt = pkt->next) {
+        a = off > pkt->payload_off ? off : pkt->payload_off;
+        b = pkt->payload_off + pkt->payload_len;
+        if (b > off + len) b = off + len;
+        if (a < b) memcpy(&dst[a - off], &pkt->payload[a - pkt->payload_off], b - a);
+    }
+}
+
+static int spead_span_cmp(const void *a, const void *b) {
+    const SpeadItemSpan *x = (const SpeadItemSpan *) a, *y = (const SpeadItemSpan *) b;
+    if (x->off != y->off) return (x->off > y->off) - (x->off < y->off);
+    return (x->imm > y->imm) - (x->imm < y->imm);
+}
+
+/* For a heap that is still being assembled, find where the values of the items named by the item
+ * pointers in the packets received so far lie: *spans is set to a malloc'd array (to be freed by the
+ * caller) sorted by offset, with immediate items first (off = -1, their value in imm).  A direct
+ * item ends where the next one starts; the len of the last is -1 until the heap's HEAP_LEN is known.
+ * This trusts that no item pointer is still to come between two that have arrived, which holds when
+ * the sender puts the whole item table in the first packet of the heap (as iter_genpackets does), so
+ * nothing is reported before the packet at payload offset 0 has arrived.
+ * Returns the number of spans, or SPEAD_ERR if memory runs out. */
+int spead_heap_item_spans(SpeadHeap *heap, SpeadItemSpan **spans) {
+    SpeadPacket *pkt;
+    SpeadItemSpan *s = NULL, *t;
+    int i, n = 0, size = 0, id;
+    int64_t itemptr;
+    *spans = NULL;
+    if (heap->head_pkt == NULL || heap->head_pkt->payload_off != 0) return 0;
+    for (pkt = heap->head_pkt; pkt != NULL; pkt = pkt->next) {
+        for (i=1; i <= pkt->n_items; i++) {
+            itemptr = SPEAD_ITEM(pkt->data, i);
+            id = SPEAD_ITEM_ID(itemptr);
+            switch (id) {
+                case SPEAD_HEAP_CNT_ID:
+                case SPEAD_PAYLOAD_OFF_ID:
+                case SPEAD_PAYLOAD_LEN_ID:
+                case SPEAD_STREAM_CTRL_ID:
+                    continue;
+                default: break;
+            }
+            if (n == size) {
+                size = size ? 2 * size : 16;
+                t = (SpeadItemSpan *) realloc(s, size * sizeof(SpeadItemSpan));
+                if (t == NULL) {
+                    free(s);
+                    return SPEAD_ERR;
+                }
+                s = t;
+            }
+            s[n].id = id;
+            if (SPEAD_ITEM_MODE(itemptr) == SPEAD_DIRECTADDR) {
+                s[n].off = (int64_t) SPEAD_ITEM_ADDR(itemptr);
+                s[n].imm = n;  // Keeps items at the same offset (empty ones) in order when sorting
+            } else {
+                s[n].off = -1;
+                s[n].imm = (int64_t) SPEAD_ITEM_ADDR(itemptr);
+            }
+            n++;
+        }
+    }
+    if (n == 0) return 0;
+    qsort(s, n, sizeof(SpeadItemSpan), spead_span_cmp);
+    for (i=0; i < n; i++) {
+        if (s[i].off < 0) {
+            s[i].len = SPEAD_ADDRLEN;
+            continue;
+        }
+        s[i].imm = 0;
+        if (i + 1 < n) {
+            s[i].len = s[i + 1].off - s[i].off;
+        } else {
+            s[i].len = (heap->heap_len == SPEAD_ERR) ? -1 : heap->heap_len - s[i].off;
+        }
+    }
+    *spans = s;
+    return n;
+}
+
+static int spead_int_cmp(const void *a, const void *b) {
+    int x = *(const int *) a, y = *(const int *) b;
+    return (x > y) - (x < y);
+}
+
+/* Have the heap finalize only the items with the n ids given (and DESCRIPTORs, which are always
+ * kept), or all items if n < 0.  The filter is kept by spead_heap_wipe, so it applies to every heap
+ * assembled in this SpeadHeap until changed.  Returns SPEAD_ERR if memory runs out. */
+int spead_heap_set_filter(SpeadHeap *heap, const int *ids, int n) {
+    int *filter_ids = NULL;
+    if (n >= 0) {
+        filter_ids = (int *) malloc((n > 0 ? n : 1) * sizeof(int));
+        if (filter_ids == NULL) return SPEAD_ERR;
+        memcpy(filter_ids, ids, n * sizeof(int));
+        qsort(filter_ids, n, sizeof(int), spead_int_cmp);
+    }
+    free(heap->filter_ids);
+    heap->filter_ids = filter_ids;
+    heap->n_filter_ids = n;
+    free(heap->wanted);
+    heap->wanted = NULL;
+    heap->n_wanted = SPEAD_ERR;
+    return 0;
+}
+
+// Return whether the heap's filter lets through the item with this id
+int spead_heap_wants(SpeadHeap *heap, int id) {
+    if (heap->filter_ids == NULL || id == SPEAD_DESCRIPTOR_ID) return 1;
+    return bsearch(&id, heap->filter_ids, heap->n_filter_ids, sizeof(int), spead_int_cmp) != NULL;
+}
+
+// Return whether a packet carries item pointers other than the heap's own fields
+static int spead_packet_has_items(SpeadPacket *pkt) {
+    int i;
+    for (i=1; i <= pkt->n_items; i++) {
+        switch (SPEAD_ITEM_ID(SPEAD_ITEM(pkt->data, i))) {
+            case SPEAD_HEAP_CNT_ID:
+            case SPEAD_HEAP_LEN_ID:
+            case SPEAD_PAYLOAD_OFF_ID:
+            case SPEAD_PAYLOAD_LEN_ID:
+            case SPEAD_STREAM_CTRL_ID:
+                continue;
+            default: return 1;
+        }
+    }
+    return 0;
+}
+
+/* Return whether pkt, which belongs to the heap, holds nothing but the payload of items that the
+ * heap's filter leaves out, so that spead_heap_drop_packet can take it in place of
+ * spead_heap_add_packet.  As for spead_heap_item_spans, this needs the packet at payload offset 0
+ * to have arrived, and trusts it to hold all of the item pointers. */
+int spead_heap_can_drop(SpeadHeap *heap, SpeadPacket *pkt) {
+    SpeadItemSpan *spans;
+    int i, n;
+    int64_t end;
+    if (heap->filter_ids == NULL || heap->heap_cnt != pkt->heap_cnt || pkt->payload_len <= 0) return 0;
+    if (heap->head_pkt == NULL || heap->head_pkt->payload_off != 0) return 0;
+    if (spead_packet_has_items(pkt)) return 0;
+    if (heap->n_wanted == SPEAD_ERR) {
+        n = spead_heap_item_spans(heap, &spans);
+        if (n == SPEAD_ERR) return 0;
+        heap->wanted = (int64_t *) malloc((n > 0 ? 2 * n : 1) * sizeof(int64_t));
+        if (heap->wanted == NULL) {
+            free(spans);
+            return 0;
+        }
+        heap->n_wanted = 0;
+        for (i=0; i < n; i++) {
+            if (spans[i].off < 0 || !spead_heap_wants(heap, spans[i].id)) continue;
+            // The end of the last item is not known until HEAP_LEN is: keep all that follows it
+            end = spans[i].len < 0 ? INT64_MAX : spans[i].off + spans[i].len;
+            heap->wanted[2 * heap->n_wanted] = spans[i].off;
+            heap->wanted[2 * heap->n_wanted + 1] = end;
+            heap->n_wanted++;
+        }
+        free(spans);
+    }
+    for (i=0; i < heap->n_wanted; i++) {
+        if (heap->wanted[2 * i] < pkt->payload_off + pkt->payload_len && pkt->payload_off < heap->wanted[2 * i + 1])
+            return 0;
+    }
+    return 1;
+}
+
+/* Account for a packet of the heap that spead_heap_can_drop allowed, keeping only its payload range
+ * (so that the heap can still tell when it is complete) and not the packet itself, which the caller
+ * may free straight away.  Returns as spead_heap_add_packet does. */
+int spead_heap_drop_packet(SpeadHeap *heap, SpeadPacket *pkt) {
+    int i;
+    int64_t *dropped;
+    if (heap->n_dropped == heap->size_dropped) {
+        heap->size_dropped = heap->size_dropped ? 2 * heap->size_dropped : 16;
+        dropped = (int64_t *) realloc(heap->dropped, 2 * heap->size_dropped * sizeof(int64_t));
+        if (dropped == NULL) return SPEAD_ERR;
+        heap->dropped = dropped;
+    }
+    // Keep the ranges sorted, as the packets are
+    for (i = heap->n_dropped; i > 0 && heap->dropped[2 * (i - 1)] > pkt->payload_off; i--) {
+        heap->dropped[2 * i] = heap->dropped[2 * (i - 1)];
+        heap->dropped[2 * i + 1] = heap->dropped[2 * (i - 1) + 1];
+    }
+    heap->dropped[2 * i] = pkt->payload_off;
+    heap->dropped[2 * i + 1] = pkt->payload_off + pkt->payload_len;
+    heap->n_dropped++;
+    if (pkt->heap_len != SPEAD_ERR) heap->heap_len = pkt->heap_len;
+    if (pkt->rx_time_ns > 0) {
+        if (heap->first_pkt_ns == 0 || pkt->rx_time_ns < heap->first_pkt_ns) heap->first_pkt_ns = pkt->rx_time_ns;
+        if (pkt->rx_time_ns > heap->last_pkt_ns) heap->last_pkt_ns = pkt->rx_time_ns;
+    }
+    heap->received_len += pkt->payload_len;
+    heap->has_all_packets = SPEAD_ERR;
+    return spead_heap_got_all_packets(heap);
+}
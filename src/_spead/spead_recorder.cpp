@@ -0,0 +1,202 @@
+#include <string.h>
+#include <errno.h>
+#include <fcntl.h>
+#include <unistd.h>
+#include <sys/time.h>
+#include "include/spead_recorder.h"
+
+/*___                       _ ____                        _
+/ ___| _ __   ___  __ _  __| |  _ \ ___  ___ ___  _ __ __| | ___ _ __
+\___ \| '_ \ / _ \/ _` |/ _` | |_) / _ \/ __/ _ \| '__/ _` |/ _ \ '__|
+ ___) | |_) |  __/ (_| | (_| |  _ <  __/ (_| (_) | | | (_| |  __/ |
+|____/| .__/ \___|\__,_|\__,_|_| \_\___|\___\___/|_|  \__,_|\___|_|
+      |_|                                                             */
+
+static double spead_recorder_now(void) {
+    struct timeval tv;
+    gettimeofday(&tv, NULL);
+    return tv.tv_sec + 1e-6 * tv.tv_usec;
+}
+
+// Write len bytes of buf to the current file, keeping track of time spent in the kernel
+static int spead_recorder_write_all(SpeadRecorder *rec, char *buf, size_t len) {
+    ssize_t n;
+    double t0, dt;
+    t0 = spead_recorder_now();
+    while (len > 0) {
+        n = write(rec->fd, buf, len);
+        if (n < 0) {
+            if (errno == EINTR) continue;
+            rec->write_errors++;
+            return SPEAD_ERR;
+        }
+        buf += n; len -= n;
+        rec->bytes_written += n;
+    }
+    dt = spead_recorder_now() - t0;
+    rec->write_secs += dt;
+    if (dt > rec->max_write_secs) rec->max_write_secs = dt;
+    return 0;
+}
+
+// Write the index header at the start of the index file, leaving the file position after it
+static int spead_recorder_write_idx_header(SpeadRecorder *rec) {
+    int64_t hdr[2];
+    hdr[0] = htonll(rec->file_bytes);
+    hdr[1] = 0;
+    if (fseek(rec->idx, 0, SEEK_SET) != 0) return SPEAD_ERR;
+    if (fwrite(SPEAD_RECORDER_IDX_MAGIC, 8, 1, rec->idx) != 1) return SPEAD_ERR;
+    if (fwrite(hdr, sizeof(int64_t), 2, rec->idx) != 2) return SPEAD_ERR;
+    return 0;
+}
+
+static int spead_recorder_open(SpeadRecorder *rec) {
+    int flags = O_WRONLY | O_CREAT | O_TRUNC;
+    char idxname[SPEAD_RECORDER_NAMELEN + 4];
+    snprintf(rec->filename, SPEAD_RECORDER_NAMELEN, "%s.%05d.spead", rec->prefix, rec->file_num);
+    rec->fd = -1;
+#ifdef O_DIRECT
+    // Not every filesystem supports O_DIRECT (e.g. tmpfs), so fall back to buffered writes
+    if (rec->use_direct) rec->fd = open(rec->filename, flags | O_DIRECT, 0644);
+#endif
+    if (rec->fd == -1) rec->fd = open(rec->filename, flags, 0644);
+    if (rec->fd == -1) return SPEAD_ERR;
+    snprintf(idxname, sizeof(idxname), "%s.idx", rec->filename);
+    rec->idx = fopen(idxname, "wb");
+    if (rec->idx == NULL) {
+        close(rec->fd);
+        rec->fd = -1;
+        return SPEAD_ERR;
+    }
+    rec->file_bytes = 0;
+    if (spead_recorder_write_idx_header(rec) == SPEAD_ERR) {
+        fclose(rec->idx);
+        rec->idx = NULL;
+        close(rec->fd);
+        rec->fd = -1;
+        return SPEAD_ERR;
+    }
+    rec->file_start = spead_recorder_now();
+    rec->files_written++;
+    return 0;
+}
+
+static int spead_recorder_close(SpeadRecorder *rec) {
+    int rv;
+    if (rec->fd == -1) return 0;
+    rv = spead_recorder_flush(rec);
+    close(rec->fd);
+    rec->fd = -1;
+    // Now the file is complete, record its size so readers can tell the index is up to date
+    if (spead_recorder_write_idx_header(rec) == SPEAD_ERR) rv = SPEAD_ERR;
+    // Close index after data, so it never looks older than the file it describes
+    if (fclose(rec->idx) != 0) rv = SPEAD_ERR;
+    rec->idx = NULL;
+    return rv;
+}
+
+int spead_recorder_init(SpeadRecorder *rec, const char *prefix, int64_t max_file_bytes,
+        double max_file_secs, int use_direct) {
+    void *buf;
+    strncpy(rec->prefix, prefix, PATH_MAX - 1);
+    rec->prefix[PATH_MAX - 1] = '\0';
+    rec->max_file_bytes = max_file_bytes;
+    rec->max_file_secs = max_file_secs;
+    rec->use_direct = use_direct;
+    rec->fd = -1;
+    rec->idx = NULL;
+    rec->file_num = 0;
+    rec->buf_used = 0;
+    rec->pkts_written = 0;
+    rec->bytes_written = 0;
+    rec->files_written = 0;
+    rec->write_errors = 0;
+    rec->write_secs = 0;
+    rec->max_write_secs = 0;
+    rec->buf = NULL;
+    if (posix_memalign(&buf, SPEAD_RECORDER_ALIGN, SPEAD_RECORDER_BUFLEN) != 0) return SPEAD_ERR;
+    rec->buf = (char *) buf;
+    if (spead_recorder_open(rec) == SPEAD_ERR) {
+        free(rec->buf);
+        rec->buf = NULL;
+        return SPEAD_ERR;
+    }
+    return 0;
+}
+
+void spead_recorder_wipe(SpeadRecorder *rec) {
+    spead_recorder_close(rec);
+    if (rec->buf != NULL) free(rec->buf);
+    rec->buf = NULL;
+}
+
+/* Write out everything that is buffered.  Full buffers are written as they are (aligned);
+ * a partial tail means O_DIRECT has to be dropped for this file. */
+int spead_recorder_flush(SpeadRecorder *rec) {
+    int rv = 0;
+#ifdef O_DIRECT
+    int flags;
+    if (rec->buf_used % SPEAD_RECORDER_ALIGN != 0) {
+        flags = fcntl(rec->fd, F_GETFL);
+        if (flags != -1 && (flags & O_DIRECT)) fcntl(rec->fd, F_SETFL, flags & ~O_DIRECT);
+    }
+#endif
+    if (rec->buf_used > 0) rv = spead_recorder_write_all(rec, rec->buf, rec->buf_used);
+    rec->buf_used = 0;
+    if (rec->idx != NULL && fflush(rec->idx) != 0) rv = SPEAD_ERR;
+    return rv;
+}
+
+int spead_recorder_write(SpeadRecorder *rec, SpeadPacket *pkt) {
+    int64_t len, flags, stamp, record[6];
+    struct timeval tv;
+    size_t n;
+    char *data;
+    len = SPEAD_ITEMLEN * (pkt->n_items + 1) + pkt->payload_len;
+    if (rec->fd == -1) return SPEAD_ERR;
+    // Rotate files by size or age, always on packet boundaries
+    if ((rec->max_file_bytes > 0 && rec->file_bytes > 0 && rec->file_bytes + len > rec->max_file_bytes) ||
+            (rec->max_file_secs > 0 && spead_recorder_now() - rec->file_start >= rec->max_file_secs)) {
+        if (spead_recorder_close(rec) == SPEAD_ERR) return SPEAD_ERR;
+        rec->file_num++;
+        if (spead_recorder_open(rec) == SPEAD_ERR) return SPEAD_ERR;
+    }
+    record[0] = htonll(pkt->heap_cnt);
+    record[1] = htonll(rec->file_bytes);
+    record[2] = htonll(len);
+    record[3] = htonll(pkt->payload_off);
+    flags = pkt->is_stream_ctrl_term ? SPEAD_RECORDER_IDX_TERM : 0;
+    record[4] = htonll(flags);
+    gettimeofday(&tv, NULL);
+    stamp = (int64_t) tv.tv_sec * 1000000000 + (int64_t) tv.tv_usec * 1000;
+    record[5] = htonll(stamp);
+    if (fwrite(record, sizeof(int64_t), 6, rec->idx) != 6) rec->write_errors++;
+    // Copy the datagram into the write buffer, writing out whole buffers as they fill
+    data = pkt->data;
+    while (len > 0) {
+        n = SPEAD_RECORDER_BUFLEN - rec->buf_used;
+        if ((int64_t) n > len) n = len;
+        memcpy(rec->buf + rec->buf_used, data, n);
+        rec->buf_used += n; rec->file_bytes += n;
+        data += n; len -= n;
+        if (rec->buf_used == SPEAD_RECORDER_BUFLEN) {
+            if (spead_recorder_write_all(rec, rec->buf, rec->buf_used) == SPEAD_ERR) return SPEAD_ERR;
+            rec->buf_used = 0;
+        }
+    }
+    rec->pkts_written++;
+    if (pkt->is_stream_ctrl_term) return spead_recorder_flush(rec);
+    return 0;
+}
+
+// BufferSocket callback: userdata is a SpeadRecorder.  Steals (frees) pkt.
+int spead_recorder_callback(SpeadPacket *pkt, void *userdata) {
+    SpeadRecorder *rec = (SpeadRecorder *) userdata;
+    int rv = spead_recorder_write(rec, pkt);
+    spead_packet_free(pkt);
+    if (rv == SPEAD_ERR) {
+        fprintf(stderr, "spead_recorder_callback: Unable to write %s: %s\n", rec->filename, strerror(errno));
+        return 1;
+    }
+    return 0;
+}
@@ -0,0 +1,221 @@
+#include <string.h>
+#include <errno.h>
+#include <time.h>
+#include <unistd.h>
+#include <arpa/inet.h>
+#include <sys/time.h>
+#include "include/spead_sender.h"
+
+/*___                       _ ____                 _
+/ ___| _ __   ___  __ _  __| / ___|  ___ _ __   __| | ___ _ __
+\___ \| '_ \ / _ \/ _` |/ _` \___ \ / _ \ '_ \ / _` |/ _ \ '__|
+ ___) | |_) |  __/ (_| | (_| |___) |  __/ | | | (_| |  __/ |
+|____/| .__/ \___|\__,_|\__,_|____/ \___|_| |_|\__,_|\___|_|
+      |_|                                                      */
+
+// Only sleep for pacing once at least this far ahead; shorter waits carry over to the next packet
+#define SPEAD_SENDER_MIN_SLEEP      1e-4
+
+static double spead_sender_now(void) {
+    struct timeval tv;
+    gettimeofday(&tv, NULL);
+    return tv.tv_sec + 1e-6 * tv.tv_usec;
+}
+
+static void spead_sender_sleep(double secs) {
+    struct timespec ts;
+    ts.tv_sec = (time_t) secs;
+    ts.tv_nsec = (long) ((secs - ts.tv_sec) * 1e9);
+    while (nanosleep(&ts, &ts) == -1 && errno == EINTR);
+}
+
+// Wait on cond until signalled, or until the absolute time deadline (< 0 = forever).  Returns 0
+// once the deadline has passed.
+static int spead_sender_wait(SpeadSender *snd, pthread_cond_t *cond, double deadline) {
+    struct timespec ts;
+    if (deadline < 0) {
+        pthread_cond_wait(cond, &snd->lock);
+        return 1;
+    }
+    ts.tv_sec = (time_t) deadline;
+    ts.tv_nsec = (long) ((deadline - ts.tv_sec) * 1e9);
+    return pthread_cond_timedwait(cond, &snd->lock, &ts) != ETIMEDOUT;
+}
+
+// Send each packet of heap, pacing them to snd->rate as TransportUDPtx.write does
+static void spead_sender_send_heap(SpeadSender *snd, SpeadSenderHeap *heap) {
+    int i;
+    ssize_t n;
+    double now, target;
+    char *data = heap->data;
+    for (i = 0; i < heap->n_pkts; i++) {
+        do {
+            n = sendto(snd->sock, data, heap->pkt_lens[i], 0, (struct sockaddr *)&snd->dest, sizeof(snd->dest));
+        } while (n == -1 && errno == EINTR);
+        if (n == -1) snd->send_errors++;
+        else {
+            snd->pkts_sent++;
+            snd->bytes_sent += n;
+        }
+        if (snd->rate > 0) {
+            now = spead_sender_now();
+            target = snd->last_time + heap->pkt_lens[i] * 8.0 / snd->rate;
+            if (target > now) {
+                if (target - now > SPEAD_SENDER_MIN_SLEEP) spead_sender_sleep(target - now);
+                snd->last_time = target;
+            } else snd->last_time = now;
+        }
+        data += heap->pkt_lens[i];
+    }
+}
+
+// Take heaps off the queue and send them until told to stop
+static void *spead_sender_thread(void *arg) {
+    SpeadSender *snd = (SpeadSender *)arg;
+    SpeadSenderHeap *heap;
+    double latency;
+    pthread_mutex_lock(&snd->lock);
+    while (1) {
+        while (snd->run_thread && snd->head == NULL) pthread_cond_wait(&snd->not_empty, &snd->lock);
+        if (!snd->run_thread) break;
+        heap = snd->head;
+        snd->head = heap->next;
+        if (snd->head == NULL) snd->tail = NULL;
+        snd->depth--;
+        snd->busy = 1;
+        pthread_cond_broadcast(&snd->changed);
+        pthread_mutex_unlock(&snd->lock);
+        spead_sender_send_heap(snd, heap);
+        latency = spead_sender_now() - heap->queued;
+        free(heap);
+        pthread_mutex_lock(&snd->lock);
+        snd->busy = 0;
+        snd->heaps_sent++;
+        snd->latency_last = latency;
+        snd->latency_total += latency;
+        if (latency > snd->latency_max) snd->latency_max = latency;
+        pthread_cond_broadcast(&snd->changed);
+    }
+    pthread_mutex_unlock(&snd->lock);
+    return NULL;
+}
+
+int spead_sender_init(SpeadSender *snd, const char *ip, int port, double rate, int max_heaps, int policy) {
+    memset(snd, 0, sizeof(SpeadSender));
+    snd->sock = -1;
+    snd->dest.sin_family = AF_INET;
+    snd->dest.sin_port = htons(port);
+    if (inet_aton(ip, &snd->dest.sin_addr) == 0) {
+        errno = EINVAL;
+        return SPEAD_ERR;
+    }
+    snd->sock = socket(PF_INET, SOCK_DGRAM, 0);
+    if (snd->sock == -1) return SPEAD_ERR;
+    snd->rate = rate;
+    snd->max_heaps = max_heaps < 1 ? 1 : max_heaps;
+    snd->policy = policy;
+    snd->last_time = spead_sender_now();
+    pthread_mutex_init(&snd->lock, NULL);
+    pthread_cond_init(&snd->not_empty, NULL);
+    pthread_cond_init(&snd->changed, NULL);
+    snd->run_thread = 1;
+    if (pthread_create(&snd->thread, NULL, spead_sender_thread, snd) != 0) {
+        snd->run_thread = 0;
+        close(snd->sock);
+        snd->sock = -1;
+        pthread_mutex_destroy(&snd->lock);
+        pthread_cond_destroy(&snd->not_empty);
+        pthread_cond_destroy(&snd->changed);
+        return SPEAD_ERR;
+    }
+    return 0;
+}
+
+// Stop the sender thread (discarding, as dropped, any heaps still queued) and close the socket
+void spead_sender_wipe(SpeadSender *snd) {
+    SpeadSenderHeap *heap;
+    if (snd->sock == -1) return;
+    pthread_mutex_lock(&snd->lock);
+    snd->run_thread = 0;
+    pthread_cond_broadcast(&snd->not_empty);
+    pthread_mutex_unlock(&snd->lock);
+    pthread_join(snd->thread, NULL);
+    while (snd->head != NULL) {
+        heap = snd->head;
+        snd->head = heap->next;
+        free(heap);
+        snd->heaps_dropped++;
+    }
+    snd->tail = NULL;
+    snd->depth = 0;
+    close(snd->sock);
+    snd->sock = -1;
+    pthread_mutex_destroy(&snd->lock);
+    pthread_cond_destroy(&snd->not_empty);
+    pthread_cond_destroy(&snd->changed);
+}
+
+// Allocate a heap of n_pkts packets totalling nbytes, with the packet lengths and data in the same
+// block of memory (so a single free() releases it)
+SpeadSenderHeap *spead_sender_heap_alloc(int n_pkts, int64_t nbytes) {
+    SpeadSenderHeap *heap;
+    heap = (SpeadSenderHeap *) malloc(sizeof(SpeadSenderHeap) + n_pkts * sizeof(int64_t) + nbytes);
+    if (heap == NULL) return NULL;
+    heap->n_pkts = n_pkts;
+    heap->pkt_lens = (int64_t *) (heap + 1);
+    heap->data = (char *) (heap->pkt_lens + n_pkts);
+    heap->nbytes = nbytes;
+    heap->next = NULL;
+    return heap;
+}
+
+// Queue heap for sending, taking ownership of it.  If the queue is full, apply snd->policy, waiting
+// up to timeout seconds (< 0 = forever) under SPEAD_SENDER_BLOCK.  Returns 1 if the heap was queued
+// and 0 if it was dropped.
+int spead_sender_put(SpeadSender *snd, SpeadSenderHeap *heap, double timeout) {
+    SpeadSenderHeap *old;
+    double deadline = timeout < 0 ? -1 : spead_sender_now() + timeout;
+    pthread_mutex_lock(&snd->lock);
+    while (snd->depth >= snd->max_heaps) {
+        if (snd->policy == SPEAD_SENDER_DROP_OLDEST) {
+            old = snd->head;
+            snd->head = old->next;
+            if (snd->head == NULL) snd->tail = NULL;
+            snd->depth--;
+            snd->heaps_dropped++;
+            free(old);
+        } else if (snd->policy == SPEAD_SENDER_DROP_NEWEST || !spead_sender_wait(snd, &snd->changed, deadline)) {
+            snd->heaps_dropped++;
+            pthread_mutex_unlock(&snd->lock);
+            free(heap);
+            return 0;
+        }
+    }
+    heap->queued = spead_sender_now();
+    heap->next = NULL;
+    if (snd->tail == NULL) snd->head = heap;
+    else snd->tail->next = heap;
+    snd->tail = heap;
+    snd->depth++;
+    snd->heaps_queued++;
+    if (snd->depth > snd->max_depth) snd->max_depth = snd->depth;
+    pthread_cond_signal(&snd->not_empty);
+    pthread_mutex_unlock(&snd->lock);
+    return 1;
+}
+
+// Wait up to timeout seconds (< 0 = forever) for every queued heap to be sent.  Returns 1 once the
+// queue is empty and the sender idle, 0 on timeout.
+int spead_sender_flush(SpeadSender *snd, double timeout) {
+    int rv = 1;
+    double deadline = timeout < 0 ? -1 : spead_sender_now() + timeout;
+    pthread_mutex_lock(&snd->lock);
+    while (snd->head != NULL || snd->busy) {
+        if (!spead_sender_wait(snd, &snd->changed, deadline)) {
+            rv = snd->head == NULL && !snd->busy;
+            break;
+        }
+    }
+    pthread_mutex_unlock(&snd->lock);
+    return rv;
+}
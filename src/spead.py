@@ -11,6 +11,15 @@ import socket
 import numpy
 import logging
 import time
+import os
+import mmap
+import struct
+import tempfile
+import zlib
+import heapq
+import threading
+import multiprocessing
+import multiprocessing.pool
 from collections import deque
 from numpy.lib.utils import safe_eval
 import _spead
@@ -31,6 +40,8 @@ SHAPE_ID = 0x12
 FORMAT_ID = 0x13
 ID_ID = 0x14
 DTYPE_ID = 0x15
+DELTA_ID = 0x16
+COMPRESSION_ID = 0x17
 ADDRNULL = '\x00'*_spead.ADDRLEN
 DEBUG = False
 ADDRSIZE = _spead.ADDRSIZE
@@ -58,6 +69,8 @@ ID_FMT = mkfmt(('u', _spead.ADDRSIZE - (_spead.ITEMSIZE-_spead.ADDRSIZE)),
                ('u', _spead.ITEMSIZE - _spead.ADDRSIZE))
 SHAPE_FMT = mkfmt(('u', 8), ('u', 56))
 STR_FMT = mkfmt(('c', 8))
+DELTA_FMT = mkfmt(('u', _spead.ADDRSIZE), ('u', _spead.ADDRSIZE), ('u', _spead.ADDRSIZE))
+DELTA_HDRLEN = 3 * _spead.ADDRLEN
 
 ITEM = {
     'HEAP_CNT':         {'ID': _spead.HEAP_CNT_ID,    'FMT': DEFAULT_FMT,     'CNT': 1},
@@ -72,12 +85,35 @@ ITEM = {
     'SHAPE':            {'ID': SHAPE_ID,                    'FMT': SHAPE_FMT,       'CNT': -1},
     'FORMAT':           {'ID': FORMAT_ID,                   'FMT': FORMAT_FMT,      'CNT': -1},
     'ID':               {'ID': ID_ID,                       'FMT': ID_FMT,          'CNT': 1},
+    'DELTA':            {'ID': DELTA_ID,                    'FMT': STR_FMT,         'CNT': -1},
+    'COMPRESSION':      {'ID': COMPRESSION_ID,              'FMT': STR_FMT,         'CNT': -1},
 }
 
+# Sidecar index of a capture file (see TransportMmap): a header (magic, size of the capture file,
+# scan flags) followed by one record per packet.  timestamp is the arrival time in ns since the
+# epoch, where the capture recorded it (0 otherwise).
+HEAP_INDEX_MAGIC = 'SPEADIX1'
+HEAP_INDEX_HDR_FMT = '>8sQQ'
+HEAP_INDEX_HDRLEN = struct.calcsize(HEAP_INDEX_HDR_FMT)
+HEAP_INDEX_DTYPE = numpy.dtype([('heap_cnt', '>i8'), ('offset', '>i8'), ('length', '>i8'),
+                                ('payload_off', '>i8'), ('flags', '>i8'), ('timestamp', '>i8')])
+HEAP_INDEX_SUFFIX = '.idx'
+HEAP_INDEX_TERM = 0x1           # record flag: packet carries STREAM_CTRL = TERM
+HEAP_INDEX_ALLOW_JUNK = 0x1     # header flag: index was built resyncing over junk
+# First 4 bytes of every packet header of this flavour, used to resync on junk
+PKT_MAGIC = struct.pack('>BBBB', _spead.MAGIC, _spead.VERSION,
+                        (_spead.ITEMSIZE - _spead.ADDRSIZE) / 8, _spead.ADDRSIZE / 8)
+
 NAME = {}
 for name, d in ITEM.iteritems():
     NAME[d['ID']] = name
 
+# Codecs that may be announced in a descriptor's COMPRESSION item: name -> (compress, decompress)
+COMPRESSION = {
+    'zlib': (lambda s: zlib.compress(s, 1), zlib.decompress),
+    'zlib9': (lambda s: zlib.compress(s, 9), zlib.decompress),
+}
+
 #  _   _ _   _ _ _ _         
 # | | | | |_(_) (_) |_ _   _ 
 # | | | | __| | | | __| | | |
@@ -97,6 +133,27 @@ def calcsize(fmt):
 def calcdim(fmt):
     return len(fmt)/3
 
+
+def pick_compression(s, link_rate, codecs=None):
+    """Time each codec on the sample value string s and return the name of the one that gets s
+    across a link of link_rate bits per second soonest (including compression and decompression
+    time), or None if sending it raw is fastest."""
+    best, best_t = None, len(s) * 8.0 / link_rate
+    if codecs is None:
+        codecs = COMPRESSION.keys()
+    for name in codecs:
+        compress, decompress = COMPRESSION[name]
+        t0 = time.time()
+        c = compress(s)
+        t1 = time.time()
+        decompress(c)
+        t = (time.time() - t0) + len(c) * 8.0 / link_rate
+        logger.debug('pick_compression: %s: %d -> %d bytes, compress=%.6fs, total=%.6fs (raw=%.6fs)' %
+                     (name, len(s), len(c), t1 - t0, t, len(s) * 8.0 / link_rate))
+        if t < best_t:
+            best, best_t = name, t
+    return best
+
 #def unpack(fmt, data, cnt=1, offset=0): return _spead.unpack(fmt, data, cnt=cnt, offset=offset)
 
 
@@ -187,7 +244,7 @@ def readable_heap(heap, prepend=''):
 #                             |_|                  
 
 
-class Descriptor:
+class Descriptor(object):
     """A Descriptor is meta-information associated with an Item, including its id, name, description,
     vector shape, and format for representation as a binary strings.  A shape of [] indicates an Item
     with a singular value, while a shape of [1] indicates a value that is a 1D array with one entry.
@@ -196,16 +253,27 @@ class Descriptor:
     A Numpy compatible descriptor can also be created. This utilises numpy style packing and unpacking in the data
     transport and is significantly faster. The ndarray parameter takes either an existing numpy array or a two element
     tuple containing a numpy compatible dtype and a shape tuple. e.g. ndarray=(np.float32,(512,24))
+
+    Values may be compressed on the wire by naming one of the COMPRESSION codecs (e.g. compression='zlib');
+    the codec is announced to receivers in the descriptor. See pick_compression() for choosing one.
     """
-    def __init__(self, from_string=None, id=None, name='', description='', shape=[], fmt=DEFAULT_FMT, ndarray=None):
+    __slots__ = ('id', 'name', 'description', 'shape', 'format', 'compression', 'dtype_str', 'dtype',
+                 'fortran_order', 'size', 'nbits', '_offset', '_scalar')
+
+    def __init__(self, from_string=None, id=None, name='', description='', shape=[], fmt=DEFAULT_FMT, ndarray=None,
+                 compression=None):
         if from_string:
             self.from_descriptor_string(from_string)
         else:
+            if compression is not None and compression not in COMPRESSION:
+                raise ValueError('Unknown compression codec %r (expected one of %s)' %
+                                 (compression, COMPRESSION.keys()))
             self.id = id
             self.name = name
             self.description = description
             self.shape = shape
             self.format = fmt
+            self.compression = compression
             self.dtype_str = None
             self.dtype = None
             self.fortran_order = False
@@ -221,6 +289,12 @@ class Descriptor:
                                     'of type numpy.ndarray (it has type: ' + str(type(ndarray)) + ')')
             else:
                 self._calcsize()
+            self._set_scalar()
+
+    def _set_scalar(self):
+        """Note whether values of this Descriptor are single (non-numpy) values, which Items store
+        unwrapped rather than in the [(x,)] form used by pack and unpack."""
+        self._scalar = self.dtype_str is None and self.size != -1 and len(self.shape) == 0
 
     def _dtype_pack(self, ndarray):
         """Generate a numpy compatible description string from the specified numpy array."""
@@ -299,6 +373,11 @@ class Descriptor:
         val = numpy.reshape(val, self.shape, 'F' if self.fortran_order else 'C')
         return val
 
+    def view_numpy(self, buf):
+        """Like unpack_numpy, but return a read-only view of buf (which must outlive it) instead of a copy."""
+        val = numpy.frombuffer(buf, dtype=self.dtype.newbyteorder('S'), count=self.size)
+        return numpy.reshape(val, self.shape, 'F' if self.fortran_order else 'C')
+
     #def resolve_ids(self, id_dict={}):
     #    '''Use a dictionary of IDs to resolve descriptors that are linked to other descriptors.'''
     #    self._unresolved_ids = {}
@@ -326,6 +405,8 @@ class Descriptor:
         }
         if self.dtype_str is not None:
             heap[DTYPE_ID] = (_spead.DIRECTADDR, self.dtype_str)
+        if self.compression is not None:
+            heap[COMPRESSION_ID] = (_spead.DIRECTADDR, self.compression)
 
         return ''.join([p for p in iter_genpackets(heap)])
 
@@ -390,6 +471,11 @@ class Descriptor:
                 self._calcsize()
             self.name = ''.join([f[0] for f in items[NAME_ID]])
             self.description = ''.join([f[0] for f in items[DESCRIPTION_ID]])
+            self.compression = items.get(COMPRESSION_ID, None)
+            if self.compression is not None and self.compression not in COMPRESSION:
+                logger.warning('DESCRIPTOR: item "%s" uses unknown compression codec %r' %
+                               (self.name, self.compression))
+            self._set_scalar()
 
 #  ___ _
 # |_ _| |_ ___ _ __ ___  
@@ -400,17 +486,24 @@ class Descriptor:
 
 class Item(Descriptor):
     """An Item inherits from a Descriptor, and adds a value that can be set, retrieved, an converted
-    into a binary string.  An Item also keeps track of when its value has changed."""
+    into a binary string.  An Item also keeps track of when its value has changed.  Single values are
+    stored as they are given, and only wrapped for pack() when the value string is made.  A value
+    received with from_value_string(s, lazy=True) is only decoded when it is first used."""
+    __slots__ = ('_val', '_raw', '_changed', '_dirty')
+
     def __init__(self, name='', id=None, description='',
-                 shape=[], fmt=DEFAULT_FMT, from_string=None, ndarray=None, init_val=None):
+                 shape=[], fmt=DEFAULT_FMT, from_string=None, ndarray=None, init_val=None, compression=None):
         if init_val is not None and isinstance(init_val, numpy.ndarray) and shape == [] and fmt == DEFAULT_FMT:
             ndarray = init_val
             # if we can, setup our shape and format from the initial value.
             # Honour any override from the user in terms of shape and format.
         Descriptor.__init__(self, from_string=from_string, id=id,
-                            name=name, description=description, shape=shape, fmt=fmt, ndarray=ndarray)
-        self._value = None
+                            name=name, description=description, shape=shape, fmt=fmt, ndarray=ndarray,
+                            compression=compression)
+        self._val = None
+        self._raw = None
         self._changed = False
+        self._dirty = []
         if not init_val is None:
             self.set_value(init_val)
 
@@ -418,31 +511,138 @@ class Item(Descriptor):
         """Directly set the value of this Item to the provided value, and mark this Item as changed."""
         if v is None:
             raise ValueError('Cannot explicitly set a value of None')
-        if self.size != -1 and len(self.shape) == 0:
-            v = (v,)
-            if calcdim(self.format) == 1:
-                v = [(x,) for x in v]
         self._value = v
         self._changed = True
+        self._dirty = []
+
+    def set_slice(self, index, v):
+        """Write v into value[index] of a numpy-backed Item and record the byte ranges touched, so
+        that only those ranges need to be sent (see to_delta_string).  Ranges are tracked at the
+        granularity of the first axis; Fortran-ordered and 0-d arrays, and indices that cannot be mapped
+        to rows, fall back to resending the whole value."""
+        if self.dtype_str is None or not isinstance(self._value, numpy.ndarray):
+            raise TypeError('item "%s" (ID=%s): set_slice requires an initialized numpy-backed item' %
+                            (self.name, self.id))
+        rows = None
+        if not (self.fortran_order or self._changed or self._value.ndim == 0):
+            rows = self._index_rows(index)
+        self._value[index] = v
+        if rows is None:
+            self._changed = True
+            return
+        if rows.size == 0:
+            return
+        row_bytes = self._value.nbytes / self._value.shape[0]
+        # Coalesce consecutive rows into contiguous byte ranges
+        breaks = numpy.nonzero(numpy.diff(rows) != 1)[0]
+        starts = numpy.concatenate(([rows[0]], rows[breaks + 1]))
+        stops = numpy.concatenate((rows[breaks], [rows[-1]])) + 1
+        for start, stop in zip(starts, stops):
+            self._dirty.append((int(start) * row_bytes, int(stop) * row_bytes))
+
+    def _index_rows(self, index):
+        """Return the sorted first-axis rows that value[index] touches, or None if that is unknown."""
+        if isinstance(index, tuple):
+            index = index[0] if len(index) > 0 else slice(None)
+        try:
+            if isinstance(index, numpy.ndarray) and index.dtype == bool and index.ndim > 1:
+                if index.shape != self._value.shape[:index.ndim]:
+                    return None
+                return numpy.unique(numpy.nonzero(index)[0])
+            return numpy.unique(numpy.atleast_1d(numpy.arange(self._value.shape[0])[index]))
+        except (IndexError, TypeError, ValueError):
+            return None
+
+    def has_delta(self):
+        """Return whether this Item has partial updates pending (and no full update)."""
+        return not self._changed and len(self._dirty) > 0
+
+    def to_delta_string(self):
+        """Return the pending partial updates of this Item as a binary string of records, each
+        consisting of (id, byte offset, byte length) packed with DELTA_FMT followed by the bytes.
+        Deltas are always sent uncompressed, even for Items that have a compression codec."""
+        ranges, rv = [], []
+        for start, stop in sorted(self._dirty):
+            if ranges and start <= ranges[-1][1]:
+                ranges[-1][1] = max(ranges[-1][1], stop)
+            else:
+                ranges.append([start, stop])
+        flat = self._value.reshape(-1)
+        itemsize = flat.itemsize
+        for start, stop in ranges:
+            data = flat[start / itemsize:stop / itemsize].byteswap().tostring()
+            rv.append(_spead.pack(DELTA_FMT, ((self.id, start, len(data)),)))
+            rv.append(data)
+        return ''.join(rv)
+
+    def from_delta_string(self, s):
+        """Patch the current value of this Item in place with one record from to_delta_string()."""
+        if self.dtype is None or not isinstance(self._value, numpy.ndarray):
+            raise ValueError('item "%s" (ID=%d): cannot apply a delta before a full value was received' %
+                             (self.name, self.id))
+        id, start, length = _spead.unpack(DELTA_FMT, s[:DELTA_HDRLEN])[0]
+        flat = self._value.reshape(-1)
+        if not numpy.may_share_memory(flat, self._value):
+            raise ValueError('item "%s" (ID=%d): cannot apply a delta to a non-contiguous value' %
+                             (self.name, self.id))
+        itemsize = flat.itemsize
+        if start % itemsize != 0 or length % itemsize != 0 or start + length > flat.nbytes or \
+                len(s) < DELTA_HDRLEN + length:
+            raise ValueError('item "%s" (ID=%d): delta of %d bytes at offset %d does not fit a value of %d bytes' %
+                             (self.name, self.id, length, start, flat.nbytes))
+        data = numpy.fromstring(s[DELTA_HDRLEN:DELTA_HDRLEN+length], dtype=self.dtype).byteswap()
+        flat[start / itemsize:start / itemsize + data.size] = data
+        self._changed = True
 
-    def from_value_string(self, s):
-        """Set the value of this Item by unpacking the provided binary string."""
+    def _get_value(self):
+        if self._raw is not None:
+            self._val = self._decode_value(*self._raw)
+            self._raw = None
+        return self._val
+
+    def _set_value(self, v):
+        self._val, self._raw = v, None
+
+    # The value itself, decoded from the string given to from_value_string(s, lazy=True) on first use
+    _value = property(_get_value, _set_value)
+
+    def from_value_string(self, s, copy=True, lazy=False):
+        """Set the value of this Item by unpacking the provided binary string.  With copy=False, an
+        uncompressed numpy-backed value becomes a read-only view of s (see view_numpy).  With lazy,
+        s is only kept, and unpacked when the value is first used (so that errors in it are raised
+        then); until then, a later call replaces it without it ever being unpacked.  Only a str is
+        kept like this with copy: a view, or a buffer whose memory may be reused (e.g. a HeapRing
+        slot), is made or unpacked straight away."""
+        if lazy and copy and isinstance(s, str):
+            self._val, self._raw, self._changed = None, (s, copy), True
+        else:
+            self._value, self._changed = self._decode_value(s, copy), True
+
+    def _decode_value(self, s, copy=True):
+        """Return the value unpacked from the binary string s (see from_value_string)."""
+        if not copy and self.dtype_str is not None and self.compression is None:
+            return self.view_numpy(s)
+        if self.compression is not None:
+            if self.compression not in COMPRESSION:
+                raise ValueError('item "%s" (ID=%d): cannot decode value compressed with unknown codec %r' %
+                                 (self.name, self.id, self.compression))
+            s = COMPRESSION[self.compression][1](s)
         if self.dtype_str is not None:
-            self._value, self._changed = self.unpack_numpy(s), True
+            return self.unpack_numpy(s)
+        elif self._scalar:
+            v = self.unpack(s)
+            if calcdim(self.format) == 1:
+                v = v[0]
+            return v[0]
         else:
-            self._value, self._changed = self.unpack(s), True
+            return self.unpack(s)
 
     def get_value(self, default=None):
         """Directly return the value of this Item. If the value has never
         been set, returns `default`."""
-        v = self._value
-        if v is None:
+        if self._value is None:
             return default
-        if self.shape != -1 and len(self.shape) == 0:
-            if calcdim(self.format) == 1:
-                v = [x[0] for x in v]
-            v = v[0]
-        return v
+        return self._value
 
     def to_value_string(self):
         """Return the value of this Item encoded as a binary string."""
@@ -450,12 +650,20 @@ class Item(Descriptor):
             raise RuntimeError('item "%s" (ID=%d): value was not initialized' % (self.name, self.id))
         try:
             if self.dtype_str is not None:
-                return self.pack_numpy(self._value)
+                s = self.pack_numpy(self._value)
+            elif self._scalar:
+                s = self.pack([(self._value,)] if calcdim(self.format) == 1 else (self._value,))
             else:
-                return self.pack(self._value)
+                s = self.pack(self._value)
         except(TypeError, ValueError):
             raise TypeError('item "%s" (ID=%d): had an invalid value for format=%s, shape=%s: %s' %
                             (self.name, self.id, [self.format], self.shape, self._value))
+        if self.compression is not None:
+            # Values narrower than an address are read back at _offset, as if they had been sent immediate
+            if self.dtype_str is None and self._offset:
+                s = (ADDRNULL + s)[-_spead.ADDRLEN:]
+            s = COMPRESSION[self.compression][0](s)
+        return s
 
     def has_changed(self):
         """Return whether this Item has been changed."""
@@ -464,6 +672,7 @@ class Item(Descriptor):
     def unset_changed(self):
         """Mark this Item as unchanged."""
         self._changed = False
+        self._dirty = []
 
 #  ___ _                  ____
 # |_ _| |_ ___ _ __ ___  / ___|_ __ ___  _   _ _ __  
@@ -473,14 +682,19 @@ class Item(Descriptor):
 #                                             |_|    
 
 
-class ItemGroup:
+class ItemGroup(object):
     """An ItemGroup is a collection of Items whose collective state may be synchronized to another
     instance of an ItemGroup via heaps that are encoded as SPEAD packets."""
+    __slots__ = ('heap_cnt', '_items', '_names', '_new_names', '_desc_cache', '_desc_interval', '_desc_countdown')
+
     def __init__(self):
         self.heap_cnt = 1  # We start heap_cnt at 1 b/c control packets have heap_cnt = 0
         self._items = {}
         self._names = {}
         self._new_names = {}
+        self._desc_cache = {}
+        self._desc_interval = None
+        self._desc_countdown = None
 
     def add_item(self, *args, **kwargs):
         """Add an Item to the group.  The state of this Item will be propagated through the heaps
@@ -493,6 +707,7 @@ class ItemGroup:
         self._items[item.id] = item
         self._new_names[item.name] = item
         self._update_keys()
+        return item
 
     def _update_keys(self):
         """Regenerate the self._names dictionary that maps Item names to the ids by which Items
@@ -501,6 +716,30 @@ class ItemGroup:
         for o in self._items.itervalues():
             self._names[o.name] = o.id
 
+    def _descriptor_string(self, item):
+        """Return item.to_descriptor_string(), encoding it only if the descriptor changed since it
+        was last encoded."""
+        shape = item.shape if isinstance(item.shape, int) else tuple(item.shape)
+        key = (item.id, item.name, item.description, shape, item.format, item.dtype_str, item.compression)
+        cached = self._desc_cache.get(item.id)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        d = item.to_descriptor_string()
+        self._desc_cache[item.id] = (key, d)
+        return d
+
+    def get_descriptors(self):
+        """Return the encoded descriptors of all Items, e.g. for re-announcing them to receivers
+        that joined late.  Descriptors are only re-encoded when they have changed."""
+        return [self._descriptor_string(item) for item in self._items.itervalues()]
+
+    def set_descriptor_interval(self, n_heaps=None):
+        """Have every n_heaps-th heap from get_heap() carry the descriptors of all Items, so that
+        late-joining receivers learn them.  None (the default) only sends new descriptors."""
+        if n_heaps is not None and n_heaps < 1:
+            raise ValueError('ITEMGROUP.set_descriptor_interval: n_heaps must be at least 1')
+        self._desc_interval = self._desc_countdown = n_heaps
+
     def get_item(self, name):
         """Return the Item with the requested name."""
         return self._items[self._names[name]]
@@ -521,6 +760,10 @@ class ItemGroup:
         """ItemGroup[name] = val sets the value of the Item with the provided name."""
         return self.get_item(name).set_value(val)
 
+    def set_slice(self, name, index, val):
+        """Set ItemGroup[name][index] = val, so that the next heap only carries the changed rows."""
+        return self.get_item(name).set_slice(index, val)
+
     def get_heap(self, heap=None):
         """Return the heap that must be transmitted to propagate the change in the state of
         this ItemGroup since the last time this function was called.  An existing heap
@@ -537,21 +780,43 @@ class ItemGroup:
         # that is provided by self._names. So essentially this was doing nothing.
         heap[_spead.DESCRIPTOR_ID] = []
         sent_names = []
-        for item in self._new_names.itervalues():
-            if DEBUG:
-                logger.debug('ITEMGROUP.get_heap: Adding descriptor for id=%d (name=%s)' % (item.id, item.name))
-            heap[_spead.DESCRIPTOR_ID].append(item.to_descriptor_string())
-            sent_names.append(item.name)
+        resend = False
+        if self._desc_interval is not None:
+            self._desc_countdown -= 1
+            if self._desc_countdown <= 0:
+                self._desc_countdown, resend = self._desc_interval, True
+        if resend:
+            logger.info('ITEMGROUP.get_heap: Re-sending all descriptors')
+            heap[_spead.DESCRIPTOR_ID].extend(self.get_descriptors())
+            sent_names = self._new_names.keys()
+        else:
+            for item in self._new_names.itervalues():
+                if DEBUG:
+                    logger.debug('ITEMGROUP.get_heap: Adding descriptor for id=%d (name=%s)' % (item.id, item.name))
+                heap[_spead.DESCRIPTOR_ID].append(self._descriptor_string(item))
+                sent_names.append(item.name)
         for name in sent_names:
             self._new_names.pop(name)
          # we explicitly remove the names we have sent, rather than dumping the whole dict, just in case
          # things get modified as we iterate.
         # Add entries for any items that have changed
+        deltas, scalars = [], {}
         for item in self._items.itervalues():
+            if item.has_delta():
+                if DEBUG:
+                    logger.debug('ITEMGROUP.get_heap: Adding delta for id=%d (name=%s)' % (item.id, item.name))
+                deltas.append(item.to_delta_string())
+                item.unset_changed()
+                continue
             if not item.has_changed():
                 continue
+            # Whole-byte scalars that are sent immediate are packed together below, a format at a time
+            if item._scalar and item.compression is None and 0 < item.nbits <= _spead.ADDRSIZE and \
+                    item.nbits % 8 == 0 and item._value is not None:
+                scalars.setdefault(item.format, []).append(item)
+                continue
             val = item.to_value_string()
-            if len(val) > _spead.ADDRLEN or item.size < 0:
+            if len(val) > _spead.ADDRLEN or item.size < 0 or item.compression is not None:
                 mode = _spead.DIRECTADDR
             else:
                 mode = _spead.IMMEDIATEADDR
@@ -560,15 +825,86 @@ class ItemGroup:
             heap[item.id] = (mode, val)
             # Once data is gathered from changed item, mark it as unchanged
             item.unset_changed()
+        for fmt, items in scalars.iteritems():
+            self._add_scalars(heap, fmt, items)
+        if deltas:
+            heap[DELTA_ID] = (_spead.DIRECTADDR, ''.join(deltas))
         logger.info('ITEMGROUP.get_heap: Done building heap with HEAP_CNT=%d' % (self.heap_cnt - 1))
         return heap
 
-    def update(self, heap):
-        """Update the state of this ItemGroup using the heap generated by ItemGroup.get_heap()."""
+    def get_template(self, names=None, max_pkt_size=_spead.MAX_PACKET_LEN):
+        """Return a HeapTemplate for heaps carrying the named Items (all of them by default), laid
+        out from their current values.  Descriptors are not part of a template: send them first
+        with get_heap()."""
+        if names is None:
+            names = self.keys()
+        layout = []
+        for name in names:
+            item = self.get_item(name)
+            if item.size < 0:
+                raise ValueError('ITEMGROUP.get_template: item "%s" does not have a fixed size' % name)
+            val = item.to_value_string()
+            if len(val) > _spead.ADDRLEN or item.compression is not None:
+                layout.append((item.id, _spead.DIRECTADDR, len(val)))
+            else:
+                layout.append((item.id, _spead.IMMEDIATEADDR, len(val)))
+        return HeapTemplate(layout, max_pkt_size=max_pkt_size)
+
+    def fill_template(self, template):
+        """Fill template with the next HEAP_CNT and the current values of its Items, returning the
+        packets to send.  Every Item in the template is sent, changed or not."""
+        values = {}
+        for id, mode, length in template.layout:
+            item = self._items[id]
+            values[id] = item.to_value_string()
+            item.unset_changed()
+        pkts = template.fill(self.heap_cnt, values)
+        self.heap_cnt += 1
+        return pkts
+
+    def _add_scalars(self, heap, fmt, items):
+        """Add immediate entries to heap for changed scalar Items sharing the format fmt, packing all
+        of their values with one call to _spead.pack."""
+        if calcdim(fmt) == 1:
+            rows = [(item._value,) for item in items]
+        else:
+            rows = [item._value for item in items]
+        try:
+            s = _spead.pack(fmt, rows)
+        except (TypeError, ValueError):
+            s = None  # Let to_value_string say which value was invalid
+        nbytes = items[0].nbits / 8
+        for i, item in enumerate(items):
+            if s is None:
+                val = item.to_value_string()
+            else:
+                val = s[i*nbytes:(i+1)*nbytes]
+            if DEBUG:
+                logger.debug('ITEMGROUP.get_heap: Adding entry for id=%d (name=%s)' % (item.id, item.name))
+            heap[item.id] = (_spead.IMMEDIATEADDR, val)
+            item.unset_changed()
+
+    def update(self, heap, copy=True, lossy=False, lazy=True):
+        """Update the state of this ItemGroup using the heap generated by ItemGroup.get_heap().
+        With copy=False, numpy-backed values are views of the heap's buffers (see Item.from_value_string).
+        With lazy (the default), values are only unpacked when they are read (e.g. by ItemGroup[name]),
+        so Items that are never read cost nothing to update; errors in a value are raised when it is read.
+        Values patched by deltas in the heap, or not held in strings (see Item.from_value_string), are
+        unpacked straight away.
+        With lossy, Items are also updated from values that were only partly received (from
+        iterheaps(tport, lossy=True)), with zeros in place of the missing bytes.  Returns the names
+        of the Items so updated."""
         self.heap_cnt = heap.heap_cnt
         logger.info('ITEMGROUP.update: Updating values from heap with HEAP_CNT=%d' % self.heap_cnt)
+        invalid, partial = [], []
+        if lossy and not getattr(heap, 'is_valid', True):
+            items = heap.get_items(include_invalid=True)
+            invalid = heap.get_invalid_ids()
+            if _spead.DESCRIPTOR_ID in invalid:
+                items[_spead.DESCRIPTOR_ID] = heap.get_items()[_spead.DESCRIPTOR_ID]
+        else:
+            items = heap.get_items()
         # Handle any new DESCRIPTORs first
-        items = heap.get_items()
         for d in items[_spead.DESCRIPTOR_ID]:
             if DEBUG:
                 logger.debug('ITEMGROUP.update: Processing descriptor')
@@ -579,9 +915,108 @@ class ItemGroup:
             if DEBUG:
                 logger.debug('ITEMGROUP.update: Updating value for id=%d, name=%s' % (id, self._items[id].name))
             try:
-                self._items[id].from_value_string(items[id])
+                # Incomplete values are unpacked now, so that those that cannot be are skipped here
+                self._items[id].from_value_string(items[id], copy=copy, lazy=lazy and id not in invalid)
             except KeyError:
                 continue
+            except ValueError:
+                if id not in invalid:
+                    raise
+                # A partial value too short to decode (e.g. one that lost its end) is skipped
+                logger.warning('ITEMGROUP.update: Could not decode incomplete value for id=%d' % id)
+                continue
+            if id in invalid:
+                partial.append(self._items[id].name)
+        # Finally, patch existing values with any partial updates
+        if DELTA_ID in items:
+            self._apply_deltas(items[DELTA_ID])
+        return partial
+
+    def iter_update(self, heaps, workers=2, processes=False, max_reorder=8):
+        """Update this ItemGroup from each heap in heaps (e.g. iterheaps(tport)), like calling update(),
+        but with item values decoded on a pool of worker threads (or processes, if processes) while
+        later heaps are still being received and assembled.  Descriptors are handled as heaps arrive;
+        decoded values (and deltas) are applied in HEAP_CNT order, holding back at most max_reorder
+        heaps to restore that order.  Yields (heap_cnt, {name: value}) with the values each heap updated;
+        these are the Items' own values, so arrays are patched in place by later deltas."""
+        if processes:
+            pool = multiprocessing.Pool(workers)
+        else:
+            pool = multiprocessing.pool.ThreadPool(workers)
+        descriptors, pending, seq = {}, [], 0
+        try:
+            for heap in heaps:
+                items = heap.get_items()
+                for d in items[_spead.DESCRIPTOR_ID]:
+                    descriptors[self.add_item(from_string=d).id] = d
+                values, used = {}, {}
+                for id, s in items.iteritems():
+                    if id not in self._items or id == _spead.DESCRIPTOR_ID:
+                        continue
+                    if id not in descriptors:
+                        descriptors[id] = self._items[id].to_descriptor_string()
+                    values[id], used[id] = s, descriptors[id]
+                result = pool.apply_async(_decode_values, (used, values))
+                heapq.heappush(pending, (heap.heap_cnt, seq, result, items.get(DELTA_ID)))
+                seq += 1
+                while len(pending) > max_reorder:
+                    yield self._deliver(*heapq.heappop(pending))
+            while pending:
+                yield self._deliver(*heapq.heappop(pending))
+        finally:
+            pool.terminate()
+
+    def _deliver(self, heap_cnt, seq, result, deltas):
+        """Apply the decoded values (and then the deltas) of one heap queued by iter_update."""
+        self.heap_cnt = heap_cnt
+        updated = []
+        for id, value in result.get().iteritems():
+            item = self._items[id]
+            item._value, item._changed = value, True
+            updated.append(item)
+        if deltas is not None:
+            self._apply_deltas(deltas)
+            o = 0
+            while o + DELTA_HDRLEN <= len(deltas):
+                id, start, length = _spead.unpack(DELTA_FMT, deltas[o:o+DELTA_HDRLEN])[0]
+                if id in self._items:
+                    updated.append(self._items[id])
+                o += DELTA_HDRLEN + length
+        return heap_cnt, dict([(item.name, item.get_value()) for item in updated])
+
+    def _apply_deltas(self, s):
+        """Apply the concatenated records of a DELTA item to the Items they refer to."""
+        o = 0
+        while o + DELTA_HDRLEN <= len(s):
+            id, start, length = _spead.unpack(DELTA_FMT, s[o:o+DELTA_HDRLEN])[0]
+            end = o + DELTA_HDRLEN + length
+            try:
+                self._items[id].from_delta_string(s[o:end])
+            except KeyError:
+                pass
+            except ValueError, e:
+                logger.warning('ITEMGROUP.update: Ignoring delta: %s' % e)
+            o = end
+
+# Items decoded by _decode_values, per worker thread: descriptor string -> Item
+_decode_cache = threading.local()
+
+
+def _decode_values(descriptors, values):
+    """Decode the value strings {id: s} of a heap given the descriptor string of each id, returning
+    {id: value}.  Runs in a worker of ItemGroup.iter_update()."""
+    cache = getattr(_decode_cache, 'items', None)
+    if cache is None or len(cache) > 4096:
+        cache = _decode_cache.items = {}
+    rv = {}
+    for id, s in values.iteritems():
+        d = descriptors[id]
+        item = cache.get(d)
+        if item is None:
+            item = cache[d] = Item(from_string=d)
+        item.from_value_string(s)
+        rv[id] = item._value
+    return rv
 
 #  ____  ____  _____    _    ____    ____  __  __   _______  __
 # / ___||  _ \| ____|  / \  |  _ \  |  _ \ \ \/ /  |_   _\ \/ /
@@ -595,7 +1030,6 @@ def iter_genpackets(heap, max_pkt_size=_spead.MAX_PACKET_LEN):
     iterate over the set of binary SPEAD packets that propagate this data
     to a receiver.  The stream will be broken into packets of the specified maximum size."""
     assert(_spead.HEAP_CNT_ID in heap.keys())  # Every heap has to have a HEAP_CNT
-    pkt = _spead.SpeadPacket()
     descriptors = heap.pop(_spead.DESCRIPTOR_ID, [])
     items, heap_pyld, offset = [], [], 0
     logger.info('itergenpackets: Converting a heap into packets')
@@ -616,12 +1050,11 @@ def iter_genpackets(heap, max_pkt_size=_spead.MAX_PACKET_LEN):
             items.append((_spead.DIRECTADDR, id, offset))
             heap_pyld.append(val)
             offset += vlen
-        # Pad out to _spead.ADDRLEN for bits < _spead.ADDRSIZE
+        # Immediate values go into the item table as they are (pack_item_table right-aligns them)
         else:
             if DEBUG:
                 logger.debug('itergenpackets: Adding standard item to header, id=%d, len(val)=%d' % (id, len(val)))
-            items.append((_spead.IMMEDIATEADDR, id,
-                          _spead.unpack(DEFAULT_FMT, (ADDRNULL+val)[-_spead.ADDRLEN:])[0][0]))
+            items.append((_spead.IMMEDIATEADDR, id, val))
     heap_pyld = ''.join(heap_pyld)
     heap_len, payload_cnt, offset = len(heap_pyld), 0, 0
     while True:
@@ -631,19 +1064,17 @@ def iter_genpackets(heap, max_pkt_size=_spead.MAX_PACKET_LEN):
         if payload_cnt == 0:
             h = items
         else:
-            h = [(_spead.IMMEDIATEADDR, _spead.HEAP_CNT_ID,
-                  _spead.unpack(DEFAULT_FMT, heap[_spead.HEAP_CNT_ID][1])[0][0])]
+            h = [(_spead.IMMEDIATEADDR, _spead.HEAP_CNT_ID, heap[_spead.HEAP_CNT_ID][1])]
         hlen = _spead.ITEMLEN * (len(h) + 4)  # 4 for the spead hdr, heap_len, payload_len and payload_off
         payload_len = min(_spead.MAX_PACKET_LEN - hlen, heap_len - offset)
         h.append((_spead.IMMEDIATEADDR, _spead.HEAP_LEN_ID, heap_len))
         h.append((_spead.IMMEDIATEADDR, _spead.PAYLOAD_LEN_ID, payload_len))
         h.append((_spead.IMMEDIATEADDR, _spead.PAYLOAD_OFF_ID, offset))
-        pkt.items = h
-        pkt.payload = heap_pyld[offset:offset+payload_len]
         if DEBUG:
             logger.debug('itergenpackets: Made packet with hlen=%d, payoff=%d, paylen=%d' %
                          (len(h), offset, payload_len))
-        yield pkt.pack()
+        yield ''.join((PKT_MAGIC, struct.pack('>HH', 0, len(h)), _spead.pack_item_table(h),
+                       heap_pyld[offset:offset+payload_len]))
         offset += payload_len
         payload_cnt += 1
         if offset >= heap_len:
@@ -651,6 +1082,100 @@ def iter_genpackets(heap, max_pkt_size=_spead.MAX_PACKET_LEN):
     logger.info('itergenpackets: Done converting a heap into packets')
     return
 
+
+class HeapTemplate:
+    """A precompiled packet layout for heaps that always carry the same items with the same sizes,
+    e.g. the repetitive dumps of a correlator.  The packets, their item pointer tables and the
+    placement of every value are computed once; fill() then only patches HEAP_CNT and the
+    immediate values and copies the direct values into place.  The packets returned by fill()
+    are reused, so they must be written out before the next call."""
+    def __init__(self, layout, max_pkt_size=_spead.MAX_PACKET_LEN):
+        """layout is a list of (id, mode, length) for the items of each heap, where length is the
+        size in bytes of the value of a DIRECTADDR item (and is ignored for IMMEDIATEADDR)."""
+        self.layout = list(layout)
+        self._imm, self._direct = {}, {}
+        items, heap_len = [(_spead.IMMEDIATEADDR, _spead.HEAP_CNT_ID, 0)], 0
+        for id, mode, length in self.layout:
+            if id in self._imm or id in self._direct or id == _spead.HEAP_CNT_ID:
+                raise ValueError('HeapTemplate: item id %d appears more than once' % id)
+            if mode == _spead.DIRECTADDR:
+                items.append((_spead.DIRECTADDR, id, heap_len))
+                self._direct[id] = (heap_len, length)
+                heap_len += length
+            else:
+                self._imm[id] = len(items)
+                items.append((_spead.IMMEDIATEADDR, id, 0))
+        self.heap_len = heap_len
+        # Lay out the packets exactly as iter_genpackets() would
+        self.packets, segments, offset = [], [], 0
+        while True:
+            h = items if not self.packets else items[:1]
+            hlen = _spead.ITEMLEN * (len(h) + 4)
+            payload_len = min(max_pkt_size - hlen, heap_len - offset)
+            if payload_len <= 0 and heap_len > offset:
+                raise ValueError('HeapTemplate: %d items do not fit in a packet of %d bytes' %
+                                 (len(items), max_pkt_size))
+            h = h + [(_spead.IMMEDIATEADDR, _spead.HEAP_LEN_ID, heap_len),
+                     (_spead.IMMEDIATEADDR, _spead.PAYLOAD_LEN_ID, payload_len),
+                     (_spead.IMMEDIATEADDR, _spead.PAYLOAD_OFF_ID, offset)]
+            hdr = ''.join((PKT_MAGIC, struct.pack('>HH', 0, len(h)), _spead.pack_item_table(h)))
+            self.packets.append(bytearray(hdr) + bytearray(payload_len))
+            segments.append((offset, offset + payload_len, len(hdr)))
+            offset += payload_len
+            if offset >= heap_len:
+                break
+        # Offset of the address field of HEAP_CNT (the first item) in every packet
+        self._cnt_offs = [_spead.ITEMLEN + (_spead.ITEMLEN - _spead.ADDRLEN)] * len(self.packets)
+        # Where each direct value lands: [(packet, offset in packet, offset in value, length)]
+        self._scatter = {}
+        for id, (start, length) in self._direct.iteritems():
+            pieces, end = [], start + length
+            for pkt, (lo, hi, hdr_len) in zip(self.packets, segments):
+                a, b = max(lo, start), min(hi, end)
+                if a < b:
+                    pieces.append((pkt, hdr_len + a - lo, a - start, b - a))
+            self._scatter[id] = pieces
+
+    def _imm_off(self, id):
+        return _spead.ITEMLEN * (self._imm[id] + 1) + (_spead.ITEMLEN - _spead.ADDRLEN)
+
+    def fill(self, heap_cnt, values):
+        """Write heap_cnt and the values {id: binary string or buffer} into the template's packets
+        and return them.  Items left out of values keep whatever they were last filled with."""
+        cnt = struct.pack('>Q', heap_cnt)[-_spead.ADDRLEN:]
+        p0 = self.packets[0]
+        for pkt, o in zip(self.packets, self._cnt_offs):
+            pkt[o:o+_spead.ADDRLEN] = cnt
+        for id, val in values.iteritems():
+            if id in self._imm:
+                if len(val) > _spead.ADDRLEN:
+                    raise ValueError('HeapTemplate.fill: immediate value of id %d is %d bytes long' %
+                                     (id, len(val)))
+                o = self._imm_off(id)
+                p0[o:o+_spead.ADDRLEN] = (ADDRNULL + str(val))[-_spead.ADDRLEN:]
+            elif id in self._direct:
+                length = self._direct[id][1]
+                if len(buffer(val)) != length:
+                    raise ValueError('HeapTemplate.fill: value of id %d is %d bytes long, expected %d' %
+                                     (id, len(buffer(val)), length))
+                for pkt, o, src, n in self._scatter[id]:
+                    pkt[o:o+n] = buffer(val, src, n)
+            else:
+                raise KeyError('HeapTemplate.fill: id %d is not in the template' % id)
+        return self.packets
+
+    def get_heap(self, heap_cnt, values):
+        """Return values as a heap dictionary (for heap-level transports), checked against the layout."""
+        heap = {_spead.HEAP_CNT_ID: (_spead.IMMEDIATEADDR, struct.pack('>Q', heap_cnt)[-_spead.ADDRLEN:])}
+        for id, val in values.iteritems():
+            if id in self._imm:
+                heap[id] = (_spead.IMMEDIATEADDR, (ADDRNULL + str(val))[-_spead.ADDRLEN:])
+            elif id in self._direct:
+                heap[id] = (_spead.DIRECTADDR, str(buffer(val)))
+            else:
+                raise KeyError('HeapTemplate.get_heap: id %d is not in the template' % id)
+        return heap
+
 #  _____                                     _
 # |_   _| __ __ _ _ __  ___ _ __   ___  _ __| |_ 
 #   | || '__/ _` | '_ \/ __| '_ \ / _ \| '__| __|
@@ -659,6 +1184,9 @@ def iter_genpackets(heap, max_pkt_size=_spead.MAX_PACKET_LEN):
 #                          |_|                   
 
 
+SCAN_BATCH = 1024    # Packets located per call to _spead.scan_packets
+
+
 class TransportString:
     def __init__(self, s='', allow_junk=False):
         self.offset = 0
@@ -668,29 +1196,21 @@ class TransportString:
 
     def iterpackets(self):
         """Iterate over all valid packets in string until the string ends or STREAM_CTRL = TERM is received."""
-        while not self.got_term_sig:
+        if self.got_term_sig:
+            return
+        for offset, length, heap_cnt, payload_off, term in \
+                iter_packet_offsets(self.data, self.offset, self.allow_junk):
+            self.offset = offset + length
+            # Check if this pkt has a stream terminator
+            if term:
+                self.got_term_sig = True
+                break
             pkt = _spead.SpeadPacket()
-            try:
-                self.offset += pkt.unpack(self.data[self.offset:])
-                # Check if this pkt has a stream terminator
-                if pkt.is_stream_ctrl_term:
-                    self.got_term_sig = True
-                    break
-                if DEBUG:
-                    logger.debug('TRANSPORTSTRING.iterpackets: Yielding packet, offset=%d/%d' %
-                                 (self.offset, len(self.data)))
-                yield pkt
-            except ValueError:
-                if self.offset >= len(self.data) - _spead.ITEMLEN:
-                    if DEBUG:
-                        logger.debug('TRANSPORTSTRING.iterpackets: Reached end of string')
-                    break
-                elif self.allow_junk:
-                    if DEBUG:
-                        logger.debug('TRANSPORTSTRING.iterpackets: Skipping a byte')
-                    self.offset += 1
-                else:
-                    break
+            pkt.unpack(buffer(self.data, offset, length))
+            if DEBUG:
+                logger.debug('TRANSPORTSTRING.iterpackets: Yielding packet, offset=%d/%d' %
+                             (self.offset, len(self.data)))
+            yield pkt
         return
 
     def seek(self, val=0):
@@ -738,6 +1258,153 @@ class TransportFile(file):
             return file.write(self, s)
 
 
+def iter_packet_offsets(data, offset=0, allow_junk=False):
+    """Scan a buffer (string, bytearray or mmap) of concatenated SPEAD packets without copying it,
+    yielding (offset, length, heap_cnt, payload_off, is_stream_ctrl_term) for each packet.  With
+    allow_junk, resync on the next packet magic after unparseable bytes; otherwise stop there."""
+    while True:
+        pkts, offset = _spead.scan_packets(data, offset, allow_junk, SCAN_BATCH)
+        if len(pkts) == 0:
+            break
+        for p in pkts:
+            yield p
+
+
+class TransportMmap:
+    """Read a capture file (packets as written by TransportFile) through mmap.  Packets are located
+    through a heap index (HEAP_INDEX_DTYPE records) that is loaded from filename + HEAP_INDEX_SUFFIX
+    when it matches the capture, and otherwise built by scanning the file (and saved, if save_index).
+    Supports sequential replay through iterpackets() and random access through read_heap().
+
+    A HEAP_CNT may occur more than once in a capture (e.g. a sender that restarted); each occurrence
+    is kept apart and selected with read_heap(heap_cnt, occurrence).  Note that every packet handed
+    out is still unpacked into a freshly allocated SpeadPacket, which copies its bytes out of the map;
+    only the scan and index avoid copying the file."""
+    def __init__(self, filename, allow_junk=False, save_index=True):
+        self.filename = filename
+        self._f = open(filename, 'rb')
+        self.size = os.fstat(self._f.fileno()).st_size
+        self.data = mmap.mmap(self._f.fileno(), self.size, access=mmap.ACCESS_READ) if self.size > 0 else ''
+        self.allow_junk = allow_junk
+        self.got_term_sig = False
+        self.index = self._load_index()
+        if self.index is None:
+            self.index = self.build_index()
+            if save_index:
+                try:
+                    self.write_index()
+                except IOError, e:
+                    logger.warning('TRANSPORTMMAP: Could not save heap index: %s' % e)
+        self._heaps = self._group_heaps()
+
+    def _index_flags(self):
+        return HEAP_INDEX_ALLOW_JUNK if self.allow_junk else 0
+
+    def _load_index(self):
+        idx_name = self.filename + HEAP_INDEX_SUFFIX
+        try:
+            if os.path.getmtime(idx_name) < os.path.getmtime(self.filename):
+                return None
+            f = open(idx_name, 'rb')
+            try:
+                hdr = f.read(HEAP_INDEX_HDRLEN)
+                if len(hdr) != HEAP_INDEX_HDRLEN:
+                    return None
+                magic, size, flags = struct.unpack(HEAP_INDEX_HDR_FMT, hdr)
+                if magic != HEAP_INDEX_MAGIC or size != self.size or flags != self._index_flags():
+                    return None
+                index = numpy.fromfile(f, dtype=HEAP_INDEX_DTYPE)
+            finally:
+                f.close()
+        except (OSError, IOError):
+            return None
+        if len(index) > 0 and index['offset'][-1] + index['length'][-1] > self.size:
+            logger.warning('TRANSPORTMMAP: Heap index of %s runs past the end of the file, rebuilding' %
+                           self.filename)
+            return None
+        return index
+
+    def build_index(self):
+        """Scan the file and return its heap index."""
+        records = [(heap_cnt, off, length, payload_off, HEAP_INDEX_TERM if term else 0, 0)
+                   for off, length, heap_cnt, payload_off, term in
+                   iter_packet_offsets(self.data, allow_junk=self.allow_junk)]
+        return numpy.array(records, dtype=HEAP_INDEX_DTYPE)
+
+    def write_index(self):
+        """Store the heap index alongside the capture file."""
+        f = open(self.filename + HEAP_INDEX_SUFFIX, 'wb')
+        try:
+            f.write(struct.pack(HEAP_INDEX_HDR_FMT, HEAP_INDEX_MAGIC, self.size, self._index_flags()))
+            self.index.tofile(f)
+        finally:
+            f.close()
+
+    def _group_heaps(self):
+        """Map each HEAP_CNT to a list of occurrences, each a list of packet indices.  A new occurrence
+        starts after a STREAM_CTRL = TERM packet, or when a packet repeats a payload offset already
+        seen in the open occurrence of its HEAP_CNT."""
+        heaps, open_heaps = {}, {}
+        for i in xrange(len(self.index)):
+            rec = self.index[i]
+            if rec['flags'] & HEAP_INDEX_TERM:
+                open_heaps = {}
+                continue
+            heap_cnt, payload_off = int(rec['heap_cnt']), int(rec['payload_off'])
+            occ = open_heaps.get(heap_cnt)
+            if occ is None or payload_off in occ[1]:
+                occ = open_heaps[heap_cnt] = ([], set())
+                heaps.setdefault(heap_cnt, []).append(occ[0])
+            occ[0].append(i)
+            occ[1].add(payload_off)
+        return heaps
+
+    def heap_cnts(self):
+        """Return the HEAP_CNTs present in the capture, in order of first appearance."""
+        return sorted(self._heaps.keys(), key=lambda h: self._heaps[h][0][0])
+
+    def occurrences(self, heap_cnt):
+        """Return how many times the heap with the given HEAP_CNT occurs in the capture."""
+        return len(self._heaps.get(heap_cnt, []))
+
+    def has_timestamps(self):
+        """Return whether the capture recorded packet arrival times."""
+        return len(self.index) > 0 and bool(numpy.all(self.index['timestamp'] > 0))
+
+    def packet_string(self, i):
+        """Return the raw bytes of the i-th packet in the capture."""
+        off = int(self.index['offset'][i])
+        return self.data[off:off+int(self.index['length'][i])]
+
+    def _packet(self, i):
+        off, length = int(self.index['offset'][i]), int(self.index['length'][i])
+        pkt = _spead.SpeadPacket()
+        pkt.unpack(buffer(self.data, off, length))
+        return pkt
+
+    def iterpackets(self):
+        """Iterate over the packets in the capture until it ends or STREAM_CTRL = TERM is found."""
+        for i, flags in enumerate(self.index['flags']):
+            if flags & HEAP_INDEX_TERM:
+                self.got_term_sig = True
+                break
+            yield self._packet(i)
+
+    def read_heap(self, heap_cnt, occurrence=0):
+        """Assemble and finalize the given occurrence of the heap with the given HEAP_CNT.  Raises
+        KeyError if it is not in the capture, IndexError if it occurs fewer times."""
+        heap = _spead.SpeadHeap()
+        for i in self._heaps[heap_cnt][occurrence]:
+            heap.add_packet(self._packet(i))
+        heap.finalize()
+        return heap
+
+    def close(self):
+        if not isinstance(self.data, str):
+            self.data.close()
+        self._f.close()
+
+
 class TransportUDPtx:
     def __init__(self, ip, port, rate=None):
         """Initialize a UDP transport. This does not handle multicast subscription.
@@ -774,13 +1441,35 @@ class TransportUDPtx:
                 self._last_time = now
 
 
+class TransportUDPtxAsync(_spead.PacketSender):
+    def __init__(self, ip, port, rate=None, max_heaps=64, policy='block', timeout=None):
+        """Like TransportUDPtx, but a heap's packets go onto a queue of at most max_heaps heaps, from
+        which a native thread sends them (paced to rate bits per second, if given) while the caller
+        carries on.  policy says what happens to a heap written while the queue is full: 'block'
+        waits up to timeout seconds (None = forever) for room before dropping it, 'drop_newest'
+        drops it at once and 'drop_oldest' drops the heap queued longest instead.  get_stats()
+        reports the queue depth, heaps dropped and send latency."""
+        _spead.PacketSender.__init__(self, socket.gethostbyname(ip), port, rate or 0, max_heaps, policy)
+        self.timeout = timeout
+
+    def write_packets(self, pkts):
+        """Queue the packets of one heap, returning False if the heap was dropped."""
+        return self.put(pkts, self.timeout)
+
+    def write(self, data):
+        return self.put([data], self.timeout)
+
+
 class TransportUDPrx(_spead.BufferSocket):
-    def __init__(self, port, pkt_count=128, buffer_size=0):
+    def __init__(self, port, pkt_count=128, buffer_size=0, streams=1):
+        """Receive on UDP port until streams senders have each sent a STREAM_CTRL TERM packet (0 for
+        until stop() is called); see iterheaps(tport, demux=True) for keeping senders apart."""
         _spead.BufferSocket.__init__(self, pkt_count)
         self.pkts = deque()
         def callback(pkt):
             self.pkts.appendleft(pkt)
         self.set_callback(callback)
+        self.set_streams(streams)
         self.start(port, buffer_size)
 
     def iterpackets(self):
@@ -792,9 +1481,221 @@ class TransportUDPrx(_spead.BufferSocket):
                 except IndexError:
                     pass  # we have handled current packet queue
             time.sleep(0.00001)
+        # Packets (up to the last TERM) may have been queued after the last look
+        while len(self.pkts) > 0:
+            yield self.pkts.pop()
         logger.info('TRANSPORTUDPRX: Stream was shut down')
         return
 
+STREAM_FRAME_FMT = '>Q'         # Length prefix of each heap on a stream transport
+STREAM_FRAME_LEN = struct.calcsize(STREAM_FRAME_FMT)
+STREAM_COALESCE_LEN = 1 << 16   # Pieces of a frame shorter than this are joined before sending
+
+
+def heap_to_frame(heap):
+    """Encode a heap (as made by ItemGroup.get_heap) as a single SPEAD packet carrying the whole heap
+    (not limited to MAX_PACKET_LEN, unlike iter_genpackets), returned as a list of strings to be
+    written out in order."""
+    ptrs, pieces, offset = [], [], 0
+    for d in heap.get(_spead.DESCRIPTOR_ID, []):
+        ptrs.append((_spead.DIRECTADDR, _spead.DESCRIPTOR_ID, offset))
+        pieces.append(d)
+        offset += len(d)
+    for id, entry in heap.iteritems():
+        if id == _spead.DESCRIPTOR_ID:
+            continue
+        mode, val = entry
+        if mode == _spead.DIRECTADDR:
+            ptrs.append((_spead.DIRECTADDR, id, offset))
+            pieces.append(val)
+            offset += len(val)
+        else:
+            ptrs.append((_spead.IMMEDIATEADDR, id, val))
+    ptrs += [(_spead.IMMEDIATEADDR, _spead.HEAP_LEN_ID, offset),
+             (_spead.IMMEDIATEADDR, _spead.PAYLOAD_OFF_ID, 0),
+             (_spead.IMMEDIATEADDR, _spead.PAYLOAD_LEN_ID, offset)]
+    return [PKT_MAGIC + struct.pack('>HH', 0, len(ptrs)) + _spead.pack_item_table(ptrs)] + pieces
+
+
+def frame_to_heap(buf):
+    """Decode a frame made by heap_to_frame (a string or bytearray) into a BufferHeap whose values
+    are buffers into buf."""
+    if len(buf) < _spead.ITEMLEN or str(buf[:len(PKT_MAGIC)]) != PKT_MAGIC:
+        raise ValueError('data does not represent a SPEAD packet')
+    n_items = struct.unpack_from('>Q', buf, 0)[0] & 0xFFFF
+    hlen = _spead.ITEMLEN * (n_items + 1)
+    if len(buf) < hlen:
+        raise ValueError('len(data) = %d (needed at least %d)' % (len(buf), hlen))
+    ptrs = numpy.frombuffer(buf, dtype='>u8', count=n_items, offset=_spead.ITEMLEN)
+    modes = ptrs >> (_spead.ITEMSIZE - 1)
+    ids = (ptrs >> _spead.ADDRSIZE) & ((1 << (_spead.ITEMSIZE - _spead.ADDRSIZE - 1)) - 1)
+    addrs = ptrs & ((1 << _spead.ADDRSIZE) - 1)
+    heap_cnt, heap_len, term = _spead.ERR, len(buf) - hlen, False
+    items, direct = {_spead.DESCRIPTOR_ID: []}, []
+    for i in xrange(n_items):
+        id, addr = int(ids[i]), int(addrs[i])
+        if modes[i] == _spead.DIRECTADDR:
+            direct.append((id, addr))
+        elif id == _spead.HEAP_CNT_ID:
+            heap_cnt = addr
+        elif id == _spead.HEAP_LEN_ID:
+            heap_len = addr
+        elif id == _spead.STREAM_CTRL_ID:
+            term = addr == _spead.STREAM_CTRL_TERM_VAL
+        elif id not in (_spead.PAYLOAD_OFF_ID, _spead.PAYLOAD_LEN_ID):
+            o = _spead.ITEMLEN * (i + 2) - _spead.ADDRLEN
+            items[id] = str(buf[o:o+_spead.ADDRLEN])
+    if hlen + heap_len > len(buf):
+        raise ValueError('len(data) = %d (needed at least %d)' % (len(buf), hlen + heap_len))
+    # As in SpeadHeap.finalize, each direct-address value runs up to the next one (or the heap's end)
+    for i, (id, addr) in enumerate(direct):
+        end = direct[i+1][1] if i + 1 < len(direct) else heap_len
+        val = buffer(buf, hlen + addr, end - addr)
+        if id == _spead.DESCRIPTOR_ID:
+            items[id].append(str(val))
+        else:
+            items[id] = val
+    return BufferHeap(heap_cnt, items, is_stream_ctrl_term=term)
+
+
+class TransportStreamTx:
+    """Send heaps over stream sockets, each heap whole as one length-prefixed frame (see
+    heap_to_frame) rather than as MTU-sized packets.  Connections form a pool, so that one sender
+    can fan out to several receivers: each heap goes to all of them, or with round_robin, to each
+    in turn.  Use through a Transmitter, which hands heaps to write_heap()."""
+    def __init__(self, round_robin=False):
+        self.socks = []
+        self.round_robin = round_robin
+        self._next = 0
+
+    def _add(self, sock):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4 << 20)
+        self.socks.append(sock)
+
+    def write_heap(self, heap):
+        pieces = heap_to_frame(heap)
+        pieces[0] = struct.pack(STREAM_FRAME_FMT, sum([len(p) for p in pieces])) + pieces[0]
+        if self.round_robin and len(self.socks) > 0:
+            socks = [self.socks[self._next % len(self.socks)]]
+            self._next += 1
+        else:
+            socks = self.socks
+        for sock in socks:
+            # Python 2 sockets have no writev: join the small pieces, and send large values as they are
+            small = []
+            for p in pieces:
+                if len(p) < STREAM_COALESCE_LEN:
+                    small.append(p)
+                    continue
+                if small:
+                    sock.sendall(''.join(small))
+                    small = []
+                sock.sendall(p)
+            if small:
+                sock.sendall(''.join(small))
+
+    def close(self):
+        for sock in self.socks:
+            sock.close()
+        self.socks = []
+
+
+class TransportTCPtx(TransportStreamTx):
+    def __init__(self, ip, port, round_robin=False):
+        """Initialize a TCP transport connected to a TransportTCPrx at (ip, port).  Further receivers
+        can be added to the pool with connect()."""
+        TransportStreamTx.__init__(self, round_robin=round_robin)
+        self.connect(ip, port)
+
+    def connect(self, ip, port):
+        sock = socket.create_connection((ip, port))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._add(sock)
+
+
+class TransportUnixtx(TransportStreamTx):
+    def __init__(self, path, round_robin=False):
+        """Initialize a Unix-domain stream transport connected to a TransportUnixrx at path.  Further
+        receivers can be added to the pool with connect()."""
+        TransportStreamTx.__init__(self, round_robin=round_robin)
+        self.connect(path)
+
+    def connect(self, path):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(path)
+        self._add(sock)
+
+
+class TransportStreamRx:
+    """Receive the heaps sent by a TransportStreamTx: accept one connection on a listening socket
+    and read length-prefixed frames from it into buffers of their own (no concatenation of chunks),
+    until STREAM_CTRL = TERM is received or the sender disconnects.  Use through iterheaps()."""
+    def __init__(self, listen_sock):
+        self.listen_sock = listen_sock
+        self.sock = None
+        self.got_term_sig = False
+
+    def _read(self, n):
+        """Read exactly n bytes into a new bytearray, or return None at end of stream."""
+        buf = bytearray(n)
+        view, got = memoryview(buf), 0
+        while got < n:
+            r = self.sock.recv_into(view[got:], n - got)
+            if r == 0:
+                if got > 0:
+                    logger.warning('TRANSPORTSTREAMRX: Stream ended within a frame')
+                return None
+            got += r
+        return buf
+
+    def iterheaps(self):
+        if self.sock is None:
+            self.sock, addr = self.listen_sock.accept()
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 << 20)
+            logger.info('TRANSPORTSTREAMRX: Accepted connection from %s' % (addr,))
+        while True:
+            hdr = self._read(STREAM_FRAME_LEN)
+            if hdr is None:
+                break
+            frame = self._read(struct.unpack(STREAM_FRAME_FMT, str(hdr))[0])
+            if frame is None:
+                break
+            heap = frame_to_heap(frame)
+            if heap.is_stream_ctrl_term:
+                self.got_term_sig = True
+                break
+            yield heap
+        logger.info('TRANSPORTSTREAMRX: Stream was shut down')
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+        self.listen_sock.close()
+
+
+class TransportTCPrx(TransportStreamRx):
+    def __init__(self, port, ip=''):
+        """Listen for a TransportTCPtx on the given port."""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((ip, port))
+        sock.listen(1)
+        TransportStreamRx.__init__(self, sock)
+
+
+class TransportUnixrx(TransportStreamRx):
+    def __init__(self, path):
+        """Listen for a TransportUnixtx on the Unix-domain socket at path (removed again by close())."""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(path)
+        sock.listen(1)
+        self.path = path
+        TransportStreamRx.__init__(self, sock)
+
+    def close(self):
+        TransportStreamRx.close(self)
+        os.remove(self.path)
+
 #  _____                              _ _   _
 # |_   _| __ __ _ _ __  ___ _ __ ___ (_) |_| |_ ___ _ __ 
 #   | || '__/ _` | '_ \/ __| '_ ` _ \| | __| __/ _ \ '__|
@@ -813,12 +1714,32 @@ class Transmitter:
         all ids in a heap are to be sent, ids_to_send should contain the ones to be transmitted."""
         if DEBUG:
             logger.debug(readable_heap(heap, prepend='TX.send_heap:'))
+        # Heap-level transports (e.g. TransportShm) take the heap whole
+        if hasattr(self.t, 'write_heap'):
+            self.t.write_heap(heap)
+            return
+        # Queued transports (e.g. TransportUDPtxAsync) take a heap's packets together
+        if hasattr(self.t, 'write_packets'):
+            self.t.write_packets(list(iter_genpackets(heap, max_pkt_size=max_pkt_size)))
+            return
         for cnt, p in enumerate(iter_genpackets(heap, max_pkt_size=max_pkt_size)):
             logger.info('TX.send_heap: Sending heap packet %d' % cnt)
             if DEBUG:
                 logger.debug(readable_binpacket(p, prepend='TX.send_heap,pkt=%d:' % cnt))
             self.t.write(p)
 
+    def send_template(self, template, heap_cnt, values):
+        """Fill a HeapTemplate with heap_cnt and values {id: binary string} and write its packets
+        to this Transmitter's Transport."""
+        if hasattr(self.t, 'write_heap'):
+            self.t.write_heap(template.get_heap(heap_cnt, values))
+            return
+        if hasattr(self.t, 'write_packets'):
+            self.t.write_packets(template.fill(heap_cnt, values))
+            return
+        for p in template.fill(heap_cnt, values):
+            self.t.write(p)
+
     def send_halt(self):
         """Send a halt packet without stopping the transmitter."""
         heap = {_spead.HEAP_CNT_ID: (_spead.IMMEDIATEADDR, '\xff\xff\xff\xff\xff\xff'),
@@ -831,8 +1752,58 @@ class Transmitter:
     def end(self):
         """Send a packet signalling the end of this stream."""
         self.send_halt()
+        # Wait for buffering transports (e.g. TransportUDPtxAsync) to send the terminator
+        if hasattr(self.t, 'flush'):
+            self.t.flush()
         del self.t  # Prevents any further activity
 
+
+def _sleep_until(t):
+    """Sleep until time.time() reaches t, spinning for the last millisecond for accuracy."""
+    while True:
+        dt = t - time.time()
+        if dt <= 0:
+            return
+        if dt > 2e-3:
+            time.sleep(dt - 1e-3)
+
+
+def replay(capture, tport, speed=1.0, rate=None):
+    """Write the packets of a capture (a TransportMmap) to a transport (e.g. TransportUDPtx) with
+    controlled timing.  If rate (bits per second) is given, packets are paced to that rate.  Otherwise,
+    if speed is given, the recorded inter-packet timing is reproduced, scaled so that the stream plays
+    speed times faster; this needs a capture with timestamps (as written by
+    BufferSocket.start_recording).  With speed=None and no rate, packets are sent as fast as possible.
+    Returns a dictionary with the packets and bytes sent, the elapsed time, and the requested and
+    achieved rates in bits per second (requested_rate is None when sending flat out)."""
+    n = len(capture.index)
+    if rate is None and speed is not None and n > 0 and not capture.has_timestamps():
+        raise ValueError('%s has no packet timestamps: replay it at a fixed rate instead' % capture.filename)
+    nbytes = int(numpy.sum(capture.index['length']))
+    if rate is not None:
+        offsets = numpy.cumsum(capture.index['length']) * 8.0 / rate
+        offsets[1:] = offsets[:-1].copy()
+        offsets[:1] = 0
+        requested = float(rate)
+    elif speed is not None and n > 0:
+        ts = capture.index['timestamp']
+        offsets = (ts - ts[0]) * 1e-9 / speed
+        requested = nbytes * 8.0 / offsets[-1] if offsets[-1] > 0 else None
+    else:
+        offsets, requested = None, None
+    logger.info('replay: Sending %d packets (%d bytes) from %s' % (n, nbytes, capture.filename))
+    t0 = time.time()
+    for i in xrange(n):
+        if offsets is not None:
+            _sleep_until(t0 + offsets[i])
+        tport.write(capture.packet_string(i))
+    elapsed = time.time() - t0
+    stats = {'packets': n, 'bytes': nbytes, 'elapsed': elapsed, 'requested_rate': requested,
+             'achieved_rate': nbytes * 8.0 / elapsed if elapsed > 0 else None}
+    logger.info('replay: Sent %d bytes in %.6fs: achieved %s bits/s, requested %s bits/s' %
+                (nbytes, elapsed, stats['achieved_rate'], requested))
+    return stats
+
 #  ____               _
 # |  _ \ ___  ___ ___(_)_   _____ _ __ 
 # | |_) / _ \/ __/ _ \ \ \ / / _ \ '__|
@@ -840,42 +1811,109 @@ class Transmitter:
 # |_| \_\___|\___\___|_| \_/ \___|_|   
 
 
-def iterheaps(tport):
+def iterheaps(tport, lossy=False, on_item=None, ids=None, demux=None, stats=None):
     """Iterate over all valid heaps received through the Transport tport.iterheaps(), assembling heaps
     from contiguous packets from iterpackets() that have the same HEAP_CNT.  Set heap's ID/values
     from constituent packets, with packets having higher PAYLOAD_CNTs taking precedence.  Assemble heap's
     heap from the _PAYLOAD of each packet, ordered by PAYLOAD_CNT.  Finally, resolve all IDs with
-    extension clauses, replacing them with binary strings from the heap."""
-    heap = _spead.SpeadHeap()
-    heaps = {}
-     # keep track of our currently active heaps
-    heap_times = {}
-     # keep track of when the first packet arrived for this heap in order to age things.
+    extension clauses, replacing them with binary strings from the heap.  Heap-level transports
+    (e.g. TransportShm) provide their own iterheaps(), which is used instead.
+
+    With lossy, heaps that are missing packets are yielded too, rather than dropped: their is_valid
+    is false, SpeadHeap.get_invalid_ids() lists the incomplete items and SpeadHeap.get_received(id)
+    tells which bytes of them arrived (see also ItemGroup.update(heap, lossy=True)).
+
+    With on_item, on_item(heap_cnt, id, value) is called for each item of a heap as soon as its
+    value has been completely received (see SpeadHeap.get_ready_items()), so that the first items of
+    a large heap can be used while the rest is still arriving; the heap is yielded as usual once it
+    is complete.  Each DESCRIPTOR is passed separately, with id DESCRIPTOR_ID.  Heap-level transports
+    deliver whole heaps, so there on_item sees all of a heap's items just before it is yielded.
+
+    With ids, only the items with those ids (and DESCRIPTORs) are assembled: the others are never
+    copied out of the packets, and packets holding nothing but them are let go as they arrive (see
+    SpeadHeap.set_item_filter()).  Heap-level transports ignore ids.
+
+    With demux, packets are split into streams, each assembled on its own so that senders cannot
+    collide on HEAP_CNTs: demux=True keys streams by the (ip, port) that sent them (SpeadPacket.src_addr,
+    from a TransportUDPrx), or demux may be a function of a SpeadPacket returning the key.  Then
+    (key, heap) pairs are yielded, on_item is passed (key, heap_cnt) in place of heap_cnt, and a
+    STREAM_CTRL TERM packet (see TransportUDPrx(streams=n)) ends only its own stream, whose
+    remaining heaps are yielded straight away.  Heap-level transports ignore demux.
+
+    With stats (a dict), stats[key] is kept up to date for each stream (key None without demux)
+    with counts of 'packets', payload 'bytes', complete 'heaps', 'incomplete_heaps' (dropped, or
+    yielded if lossy), and whether it has 'terminated'."""
+    if hasattr(tport, 'iterheaps'):
+        for heap in tport.iterheaps():
+            if on_item is not None:
+                for id, value in heap.get_items().iteritems():
+                    for v in (value if id == _spead.DESCRIPTOR_ID else [value]):
+                        on_item(heap.heap_cnt, id, v)
+            yield heap
+        return
+    if demux is True:
+        demux = lambda pkt: pkt.src_addr
+    streams = {}
+     # the heaps being assembled for each stream, as [heaps, heap_times, ready]
+
+    def finish(key, heap):
+        """Finalize a heap of stream key, returning what to yield for it, or None to drop it."""
+        heap.finalize()
+        logger.info('iterheaps: _spead.SpeadHeap.is_valid=%d' % heap.is_valid)
+        if stats is not None:
+            stats[key]['heaps' if heap.is_valid else 'incomplete_heaps'] += 1
+        if not (heap.is_valid or lossy):
+            logger.warning('iterheaps: Invalid spead heap %d found (_spead.SpeadHeap.has_all_packets=%d)' %
+                           (heap.heap_cnt, heap.has_all_packets))
+            return None
+        heap.stamp_handoff()
+        return heap if demux is None else (key, heap)
     logger.info('iterheaps: Getting packets')
     for pkt in tport.iterpackets():
         logger.debug('iterheaps: Packet with HEAP_CNT=%d, HEAP_LEN=%d, PAYLOAD_LEN=%d, PAYLOAD_OFF=%d' %
                      (pkt.heap_cnt, pkt.heap_len, pkt.payload_len, pkt.payload_off))
         if DEBUG:
             logger.debug(readable_speadpacket(pkt, show_payload=False, prepend='iterheaps:'))
+        key = None if demux is None else demux(pkt)
+        if key not in streams:
+            logger.info('iterheaps: New stream %s' % (key,))
+            streams[key] = [{}, {}, {}]
+            if stats is not None:
+                stats[key] = {'packets': 0, 'bytes': 0, 'heaps': 0, 'incomplete_heaps': 0, 'terminated': False}
+        heaps, heap_times, ready = streams[key]
+         # heaps: our currently active heaps; heap_times: when the first packet arrived for each heap
+         # (in order to age things); ready: keys of the items of each heap already passed to on_item
+        if stats is not None:
+            stats[key]['packets'] += 1
+            stats[key]['bytes'] += pkt.payload_len
+        if demux is not None and pkt.is_stream_ctrl_term:
+            logger.info('iterheaps: Stream %s was shut down, processing its remaining heaps' % (key,))
+            del streams[key]
+            if stats is not None:
+                stats[key]['terminated'] = True
+            for heap_cnt in sorted(heaps):
+                rv = finish(key, heaps[heap_cnt])
+                if rv is not None:
+                    yield rv
+            continue
          # get the heap for this packet
         heap_cnt = pkt.heap_cnt
-        if heap_cnt not in heaps.keys():
+        if heap_cnt not in heaps:
              # check if we have space...
             while len(heaps) >= MAX_CONCURRENT_HEAPS:
                 # choose the oldest stale heap to replace
                 pop_idx = [x for x in heap_times.items() if x[1] == min(heap_times.values())][0][0]
                 partial_heap = heaps.pop(pop_idx)
+                ready.pop(pop_idx, None)
                 logger.info('iterheaps: Removing stale heap (and attempting unpack) '
                             'with HEAP_CNT=%d (created at %s) to make space for new heaps.' %
                             (pop_idx, time.ctime(heap_times.pop(pop_idx))))
-                partial_heap.finalize()
-                if partial_heap.is_valid:
-                    yield partial_heap
-                else:
-                    logger.warning('iterheaps: Invalid spead heap %d found '
-                                   '(_spead.SpeadHeap.has_all_packets=%d)' %
-                                   (pop_idx, partial_heap.has_all_packets))
+                rv = finish(key, partial_heap)
+                if rv is not None:
+                    yield rv
             heaps[heap_cnt] = _spead.SpeadHeap()
+            if ids is not None:
+                heaps[heap_cnt].set_item_filter(ids)
             heap_times[heap_cnt] = time.time()
             logger.info('iterheaps: Creating new heap for HEAP_CNT=%d. Currently %d active heaps.' %
                         (heap_cnt, heaps.__len__()))
@@ -886,27 +1924,305 @@ def iterheaps(tport):
             pkt = None  # If no error was raised, we're done with this packet
         except ValueError:
             heapdone = True
+        if on_item is not None and pkt is None:
+            done = ready.setdefault(heap_cnt, set())
+            for item_key, id, value in heap.get_ready_items(done):
+                done.add(item_key)
+                on_item(heap_cnt if demux is None else (key, heap_cnt), id, value)
         if heapdone:
             logger.info('iterheaps: Heap %d completed, attempting to unpack heap' % heap.heap_cnt)
-            heap.finalize()
-            logger.info('iterheaps: _spead.SpeadHeap.is_valid=%d' % heap.is_valid)
-            if heap.is_valid:
-                yield heap
-            else:
-                logger.warning('iterheaps: Invalid spead heap %d found (_spead.SpeadHeap.has_all_packets=%d)' %
-                               (heap.heap_cnt, heap.has_all_packets))
-            logger.info('iterheaps: Starting new heap')
             heaps.pop(heap_cnt)
             heap_times.pop(heap_cnt)
+            ready.pop(heap_cnt, None)
+            rv = finish(key, heap)
+            if rv is not None:
+                yield rv
+            logger.info('iterheaps: Starting new heap')
              # we are done with this heap...
             #if not pkt is None: heap.add_packet(pkt) # If pkt was rejected, add it to the next heap
              # packets should not be rejected as they are added to the heap identified by their internal count
     logger.info('iterheaps: Last packet in stream received, processing any stale heaps.')
-    for heap in heaps.itervalues():
-        logger.info('iterheaps: Attempting to unpack stale heap %d' % heap.heap_cnt)
-        heap.finalize()
-        logger.info('iterheaps: _spead.SpeadHeap.is_valid=%d' % heap.is_valid)
-        if heap.is_valid:
-            yield heap
+    for key, (heaps, heap_times, ready) in streams.items():
+        for heap in heaps.itervalues():
+            logger.info('iterheaps: Attempting to unpack stale heap %d' % heap.heap_cnt)
+            rv = finish(key, heap)
+            if rv is not None:
+                yield rv
     logger.info('iterheaps: Finished all heaps')
     return
+
+# Stages of a received heap's life timed by LatencyHistogram, as (name, start stamp, end stamp),
+# where the stamps are SpeadHeap attributes and None means the time of LatencyHistogram.add()
+LATENCY_STAGES = (
+    ('assemble', 'first_pkt_ns', 'last_pkt_ns'),        # First packet to last packet of the heap
+    ('queue', 'last_pkt_ns', 'finalize_start_ns'),      # Last packet until finalize() started
+    ('finalize', 'finalize_start_ns', 'finalize_end_ns'),
+    ('handoff', 'finalize_end_ns', 'handoff_ns'),       # finalize() until iterheaps() yielded the heap
+    ('consume', 'handoff_ns', None),                    # e.g. ItemGroup.update(), if add() follows it
+    ('total', 'first_pkt_ns', None),
+)
+
+
+class LatencyHistogram:
+    """Aggregate where the time goes between the arrival of a heap's packets and its use, from the
+    stamps on the SpeadHeaps yielded by iterheaps().  Call add(heap) once the heap has been used
+    (e.g. after ItemGroup.update(heap)).  Latencies are binned by powers of two of nanoseconds."""
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Forget all heaps added so far."""
+        self.counts = dict((name, [0] * 64) for name, start, end in LATENCY_STAGES)
+        self.n = dict((name, 0) for name, start, end in LATENCY_STAGES)
+        self.sum_ns = dict((name, 0) for name, start, end in LATENCY_STAGES)
+        self.min_ns = dict((name, None) for name, start, end in LATENCY_STAGES)
+        self.max_ns = dict((name, None) for name, start, end in LATENCY_STAGES)
+
+    def add(self, heap, now_ns=None):
+        """Add the stage latencies of heap, taking now_ns (default: now) as the end of its use.
+        Stages whose stamps are missing (e.g. for heaps from a TransportString, which carry no
+        receive times, or from heap-level transports) are skipped."""
+        if now_ns is None:
+            now_ns = int(time.time() * 1e9)
+        for name, start, end in LATENCY_STAGES:
+            t0 = getattr(heap, start, 0)
+            t1 = now_ns if end is None else getattr(heap, end, 0)
+            if t0 <= 0 or t1 <= 0:
+                continue
+            dt = max(t1 - t0, 0)
+            self.counts[name][min(int(dt).bit_length(), 63)] += 1
+            self.n[name] += 1
+            self.sum_ns[name] += dt
+            if self.min_ns[name] is None or dt < self.min_ns[name]:
+                self.min_ns[name] = dt
+            if self.max_ns[name] is None or dt > self.max_ns[name]:
+                self.max_ns[name] = dt
+
+    def histogram(self, stage):
+        """Return [(upper bound in seconds, count), ...] for the non-empty bins of stage."""
+        return [((1 << b) * 1e-9, c) for b, c in enumerate(self.counts[stage]) if c]
+
+    def percentile(self, stage, q):
+        """Return the upper bound (in seconds) of the bin holding the q-th percentile of stage, or
+        None if no heaps were timed for it."""
+        n = self.n[stage]
+        if n == 0:
+            return None
+        target, seen = q / 100. * n, 0
+        for b, c in enumerate(self.counts[stage]):
+            seen += c
+            if c and seen >= target:
+                return min((1 << b), self.max_ns[stage]) * 1e-9
+        return self.max_ns[stage] * 1e-9
+
+    def summary(self):
+        """Return {stage: {'count', 'mean', 'min', 'max', 'p50', 'p90', 'p99'}}, in seconds."""
+        rv = {}
+        for name, start, end in LATENCY_STAGES:
+            n = self.n[name]
+            if n == 0:
+                rv[name] = {'count': 0}
+                continue
+            rv[name] = {'count': n, 'mean': self.sum_ns[name] * 1e-9 / n,
+                        'min': self.min_ns[name] * 1e-9, 'max': self.max_ns[name] * 1e-9,
+                        'p50': self.percentile(name, 50), 'p90': self.percentile(name, 90),
+                        'p99': self.percentile(name, 99)}
+        return rv
+
+#  _   _                    ____  _
+# | | | | ___  __ _ _ __   |  _ \(_)_ __   __ _
+# | |_| |/ _ \/ _` | '_ \  | |_) | | '_ \ / _` |
+# |  _  |  __/ (_| | |_) | |  _ <| | | | | (_| |
+# |_| |_|\___|\__,_| .__/  |_| \_\_|_| |_|\__, |
+#                  |_|                    |___/
+
+HEAP_RING_MAGIC = 'SPEADRNG'
+HEAP_RING_HDR_FMT = '>8sQQ'             # magic, n_slots, slot_size
+HEAP_RING_SLOT_FMT = '>QQqQ'            # state, generation, heap_cnt, n_items
+HEAP_RING_SLOT_HDRLEN = struct.calcsize(HEAP_RING_SLOT_FMT)
+HEAP_RING_ITEM_FMT = '>qQQ'             # id, offset in slot, length
+HEAP_RING_ITEM_LEN = struct.calcsize(HEAP_RING_ITEM_FMT)
+HEAP_RING_FREE, HEAP_RING_FULL = 0, 1
+
+
+class BufferHeap:
+    """A heap whose item values are buffers (into a HeapRing slot, or a frame read from a stream
+    transport), usable in place of a SpeadHeap (e.g. by ItemGroup.update)."""
+    def __init__(self, heap_cnt, items, is_stream_ctrl_term=False):
+        self.heap_cnt = heap_cnt
+        self.is_valid = True
+        self.is_stream_ctrl_term = is_stream_ctrl_term
+        self._items = items
+
+    def get_items(self):
+        return self._items
+
+
+class HeapRing:
+    """A ring of heap buffers in a shared memory file (by default in /dev/shm), through which one
+    receiving process hands finalized heaps to consumer processes without pickling their values.
+    The producer calls put(heap), which copies the heap's items into the next free slot and returns
+    a small handle (slot, generation) to pass to a consumer, e.g. through a multiprocessing.Queue.
+    The consumer calls get(handle) for a BufferHeap whose values are buffers into the shared memory
+    (ItemGroup.update(heap, copy=False) then gives numpy views of them), and release(handle) once
+    it is done with them.  Create the ring by giving n_slots and slot_size; attach to an existing
+    one by filename alone.  A HeapRing pickles as its filename, so it can be passed to workers."""
+    def __init__(self, filename=None, n_slots=None, slot_size=16 << 20):
+        if n_slots is not None:
+            if filename is None:
+                shm = '/dev/shm' if os.path.isdir('/dev/shm') else None
+                fd, filename = tempfile.mkstemp(prefix='spead_ring_', dir=shm)
+                os.close(fd)
+            slot_size = (slot_size + mmap.PAGESIZE - 1) // mmap.PAGESIZE * mmap.PAGESIZE
+            f = open(filename, 'w+b')
+            f.truncate(mmap.PAGESIZE + n_slots * slot_size)
+            f.write(struct.pack(HEAP_RING_HDR_FMT, HEAP_RING_MAGIC, n_slots, slot_size))
+            f.close()
+        self.filename = filename
+        self._f = open(filename, 'r+b')
+        magic, self.n_slots, self.slot_size = struct.unpack(HEAP_RING_HDR_FMT,
+                                                            self._f.read(struct.calcsize(HEAP_RING_HDR_FMT)))
+        if magic != HEAP_RING_MAGIC:
+            raise ValueError('%s is not a HeapRing' % filename)
+        self.data = mmap.mmap(self._f.fileno(), mmap.PAGESIZE + self.n_slots * self.slot_size)
+        self._next = 0
+
+    def __getinitargs__(self):
+        return (self.filename,)
+
+    def __getstate__(self):
+        return {}
+
+    def _slot_off(self, slot):
+        return mmap.PAGESIZE + slot * self.slot_size
+
+    def _slot_hdr(self, slot):
+        return struct.unpack_from(HEAP_RING_SLOT_FMT, self.data, self._slot_off(slot))
+
+    def put(self, heap, block=True, timeout=None):
+        """Copy the items of a finalized heap into the next slot, waiting for the consumer to release it
+        if necessary (unless block is False, or for at most timeout seconds).  Returns the handle of the
+        heap, or None if no slot became free.  Only one process may put() into a ring."""
+        items = heap.get_items()
+        entries = [(_spead.DESCRIPTOR_ID, d) for d in items[_spead.DESCRIPTOR_ID]]
+        entries += [(id, v) for id, v in items.iteritems() if id != _spead.DESCRIPTOR_ID]
+        off = HEAP_RING_SLOT_HDRLEN + len(entries) * HEAP_RING_ITEM_LEN
+        if off + sum([len(v) for id, v in entries]) > self.slot_size:
+            raise ValueError('Heap %d does not fit in a %d-byte HeapRing slot' % (heap.heap_cnt, self.slot_size))
+        slot, deadline = self._next, None if timeout is None else time.time() + timeout
+        while self._slot_hdr(slot)[0] != HEAP_RING_FREE:
+            if not block or (deadline is not None and time.time() >= deadline):
+                return None
+            time.sleep(1e-4)
+        base = self._slot_off(slot)
+        for i, (id, v) in enumerate(entries):
+            struct.pack_into(HEAP_RING_ITEM_FMT, self.data, base + HEAP_RING_SLOT_HDRLEN + i * HEAP_RING_ITEM_LEN,
+                             id, off, len(v))
+            self.data[base+off:base+off+len(v)] = v
+            off += len(v)
+        generation = self._slot_hdr(slot)[1] + 1
+        # The state is written last, marking the slot as ready for the consumer
+        struct.pack_into(HEAP_RING_SLOT_FMT, self.data, base, HEAP_RING_FULL, generation, heap.heap_cnt, len(entries))
+        self._next = (slot + 1) % self.n_slots
+        return slot, generation
+
+    def get(self, handle):
+        """Return the BufferHeap for a handle returned by put()."""
+        slot, generation = handle
+        state, gen, heap_cnt, n_items = self._slot_hdr(slot)
+        if state != HEAP_RING_FULL or gen != generation:
+            raise KeyError('HeapRing slot %d no longer holds the heap of handle %s' % (slot, handle))
+        base = self._slot_off(slot)
+        items = {_spead.DESCRIPTOR_ID: []}
+        for i in xrange(n_items):
+            id, off, length = struct.unpack_from(HEAP_RING_ITEM_FMT, self.data,
+                                                 base + HEAP_RING_SLOT_HDRLEN + i * HEAP_RING_ITEM_LEN)
+            val = buffer(self.data, base + off, length)
+            if id == _spead.DESCRIPTOR_ID:
+                items[id].append(str(val))
+            else:
+                items[id] = val
+        return BufferHeap(heap_cnt, items)
+
+    def release(self, handle):
+        """Hand the slot of a heap back to the producer.  Values obtained through it must no longer be used."""
+        slot, generation = handle
+        state, gen, heap_cnt, n_items = self._slot_hdr(slot)
+        if gen == generation:
+            struct.pack_into(HEAP_RING_SLOT_FMT, self.data, self._slot_off(slot), HEAP_RING_FREE, gen, heap_cnt, 0)
+
+    def close(self):
+        self.data.close()
+        self._f.close()
+
+    def unlink(self):
+        """Remove the shared memory file (attached processes keep their mapping until they close it)."""
+        os.remove(self.filename)
+
+
+class TransportShm:
+    """A heap-level transport between a Transmitter and a receiver on the same host, through a
+    HeapRing: heaps are neither split into packets nor reassembled.  Open with mode 'w' to create
+    the ring and send (Transmitter(TransportShm(filename, 'w')).send_heap(...)), and with mode 'r'
+    to attach and receive (iterheaps(TransportShm(filename))).  There may be one sender and one
+    receiver.  A full ring makes the sender wait (for at most timeout seconds, if given, after which
+    IOError is raised).  The values of a received heap live in the ring until the next heap is
+    requested, so use ItemGroup.update(heap, copy=False) only if the views are not kept beyond that."""
+    def __init__(self, filename=None, mode='r', n_slots=16, slot_size=16 << 20, timeout=None):
+        if mode == 'w':
+            self.ring = HeapRing(filename, n_slots=n_slots, slot_size=slot_size)
+        else:
+            self.ring = HeapRing(filename)
+        self.filename = self.ring.filename
+        self.timeout = timeout
+        self.got_term_sig = False
+        self._next, self._generation = 0, 1
+
+    def write_heap(self, heap):
+        """Put a heap (as made by ItemGroup.get_heap) into the ring, with the same item values a
+        receiver of its packets would get."""
+        items = {_spead.DESCRIPTOR_ID: list(heap.get(_spead.DESCRIPTOR_ID, []))}
+        heap_cnt = _spead.ERR
+        for id, entry in heap.iteritems():
+            if id == _spead.DESCRIPTOR_ID:
+                continue
+            mode, val = entry
+            if mode == _spead.IMMEDIATEADDR:
+                val = (ADDRNULL + val)[-_spead.ADDRLEN:]
+            if id == _spead.HEAP_CNT_ID:
+                heap_cnt = _spead.unpack(DEFAULT_FMT, val)[0][0]
+            else:
+                items[id] = val
+        if self.ring.put(BufferHeap(heap_cnt, items), timeout=self.timeout) is None:
+            raise IOError('TransportShm: receiver did not free a slot of %s within %s s' %
+                          (self.filename, self.timeout))
+
+    def iterheaps(self):
+        """Iterate over heaps until STREAM_CTRL = TERM is received."""
+        handle = None
+        try:
+            while True:
+                state, generation = self.ring._slot_hdr(self._next)[:2]
+                if state != HEAP_RING_FULL or generation != self._generation:
+                    time.sleep(1e-5)
+                    continue
+                handle = (self._next, self._generation)
+                self._next += 1
+                if self._next == self.ring.n_slots:
+                    self._next, self._generation = 0, self._generation + 1
+                heap = self.ring.get(handle)
+                term = heap.get_items().pop(_spead.STREAM_CTRL_ID, None)
+                if term is not None and \
+                        _spead.unpack(DEFAULT_FMT, term)[0][0] == _spead.STREAM_CTRL_TERM_VAL:
+                    logger.info('TRANSPORTSHM: Stream was shut down')
+                    self.got_term_sig = True
+                    return
+                yield heap
+                self.ring.release(handle)
+                handle = None
+        finally:
+            if handle is not None:
+                self.ring.release(handle)
+
+    def close(self):
+        self.ring.close()
@@ -0,0 +1,240 @@
+#! /usr/bin/env python
+"""Time the pack, assemble, finalize and transport paths of SPEAD, writing the results as JSON and
+optionally comparing them against a baseline saved by an earlier run.  Exits with status 1 if any
+benchmark got slower than the baseline by more than the tolerance."""
+import optparse
+import json
+import random
+import socket
+import sys
+import threading
+import time
+import numpy
+import spead64_48 as spead
+import spead64_48._spead as _spead
+
+PORT = 8888
+N_ROWS = 4096
+
+FORMATS = [
+    ('u8', spead.mkfmt(('u', 8))),
+    ('u32', spead.mkfmt(('u', 32))),
+    ('u48', spead.DEFAULT_FMT),
+    ('i12', spead.mkfmt(('i', 12))),
+    ('f64', spead.mkfmt(('f', 64))),
+    ('u16_u16', spead.mkfmt(('u', 16), ('u', 16))),
+]
+
+
+def example_heap(shape=(512, 256), dtype=numpy.float32):
+    """Return a heap carrying one array of the given shape and a couple of scalars."""
+    ig = spead.ItemGroup()
+    data = numpy.ones(shape, dtype=dtype)
+    ig.add_item(name='data', description='benchmark data', ndarray=data)
+    ig['data'] = data
+    ig.add_item(name='timestamp', description='benchmark timestamp', init_val=12345)
+    ig.add_item(name='scale', description='benchmark scale', fmt=spead.mkfmt(('f', 64)), init_val=1.5)
+    return ig.get_heap()
+
+
+def bench_pack():
+    for name, fmt in FORMATS:
+        rows = [tuple([i % 100] * spead.calcdim(fmt)) for i in range(N_ROWS)]
+        nbytes = len(_spead.pack(fmt, rows))
+        yield 'pack/' + name, (lambda fmt=fmt, rows=rows: _spead.pack(fmt, rows)), nbytes
+
+
+def bench_unpack():
+    for name, fmt in FORMATS:
+        s = _spead.pack(fmt, [tuple([i % 100] * spead.calcdim(fmt)) for i in range(N_ROWS)])
+        yield 'unpack/' + name, (lambda fmt=fmt, s=s: _spead.unpack(fmt, s, cnt=N_ROWS)), len(s)
+
+
+def bench_pack_numpy():
+    for dtype in (numpy.uint8, numpy.int32, numpy.float64):
+        a = numpy.ones((512, 256), dtype=dtype)
+        d = spead.Descriptor(name='a', ndarray=a)
+        yield 'pack_numpy/' + numpy.dtype(dtype).name, (lambda d=d, a=a: d.pack_numpy(a)), a.nbytes
+
+
+def bench_genpackets():
+    heap = example_heap()
+    nbytes = sum(len(v[1]) for k, v in heap.iteritems() if k != _spead.DESCRIPTOR_ID)
+    yield 'iter_genpackets', (lambda: list(spead.iter_genpackets(dict(heap)))), nbytes
+
+
+def bench_assemble():
+    pkt_strs = list(spead.iter_genpackets(example_heap()))
+    nbytes = sum(len(p) for p in pkt_strs)
+    orders = [('in_order', pkt_strs), ('reversed', pkt_strs[::-1])]
+    shuffled = pkt_strs[:]
+    random.Random(0).shuffle(shuffled)
+    orders.append(('shuffled', shuffled))
+    for name, strs in orders:
+        pkts = []
+        for s in strs:
+            pkt = _spead.SpeadPacket()
+            pkt.unpack(s)
+            pkts.append(pkt)
+        heap = _spead.SpeadHeap()
+
+        def add_packets(pkts=pkts, heap=heap):
+            heap.reset()
+            for pkt in pkts:
+                heap.add_packet(pkt)
+
+        def finalize(heap=heap, add_packets=add_packets):
+            add_packets()
+            heap.finalize()
+            heap.get_items()
+        yield 'add_packet/' + name, add_packets, nbytes
+        yield 'finalize/' + name, finalize, nbytes
+
+
+def bench_iterheaps():
+    pkt_strs = []
+    for i in range(20):
+        heap = example_heap((128, 256))
+        heap[_spead.HEAP_CNT_ID] = (_spead.IMMEDIATEADDR, _spead.pack(spead.DEFAULT_FMT, ((i + 1,),)))
+        pkt_strs.extend(spead.iter_genpackets(heap))
+    capture = ''.join(pkt_strs)
+
+    def iterheaps():
+        for heap in spead.iterheaps(spead.TransportString(capture)):
+            heap.get_items()
+    yield 'iterheaps/TransportString', iterheaps, len(capture)
+
+
+UDP_HEAPS = 50
+
+
+def udp_round_trip(rate, n_heaps=UDP_HEAPS):
+    """Send n_heaps heaps over loopback UDP at rate (bits per second), returning the seconds from the
+    first send until the receiver saw the end of the stream, and the number of heaps received."""
+    heaps = []
+    for i in range(n_heaps):
+        heap = example_heap((128, 256))
+        heap[_spead.HEAP_CNT_ID] = (_spead.IMMEDIATEADDR, _spead.pack(spead.DEFAULT_FMT, ((i + 1,),)))
+        heaps.append(heap)
+    rx = spead.TransportUDPrx(PORT, pkt_count=4096, buffer_size=16 << 20)
+    time.sleep(.1)  # the socket is bound by the net thread, after start() returns
+    received = []
+
+    def receive():
+        for heap in spead.iterheaps(rx):
+            received.append(heap)
+        received.append(time.time())
+    t = threading.Thread(target=receive)
+    t.start()
+    tx = spead.Transmitter(spead.TransportUDPtx('127.0.0.1', PORT, rate=rate))
+    t0 = time.time()
+    for heap in heaps:
+        tx.send_heap(heap)
+    tx.end()
+    t.join(10)
+    rx.stop()
+    time.sleep(.1)  # after a TERM the net thread closes the socket in its own time
+    if t.isAlive() or not received:
+        return None, 0
+    return received[-1] - t0, len(received) - 1
+
+
+def bench_udp(rates):
+    nbytes = sum(len(p) for p in spead.iter_genpackets(example_heap((128, 256)))) * UDP_HEAPS
+    for rate in rates:
+        yield 'udp/%gGbps' % rate, (lambda rate=rate: udp_round_trip(rate * 1e9)), nbytes
+
+
+def run(func, min_time, repeat):
+    """Return the best time per call of func over repeat runs of at least min_time seconds each, and
+    the number of calls timed in each run."""
+    calls, t = 1, 0
+    while True:
+        t0 = time.time()
+        for i in xrange(calls):
+            func()
+        t = time.time() - t0
+        if t >= min_time:
+            break
+        calls *= 2
+    best = t / calls
+    for r in range(repeat - 1):
+        t0 = time.time()
+        for i in xrange(calls):
+            func()
+        best = min(best, (time.time() - t0) / calls)
+    return best, calls
+
+
+def compare(results, baseline, tolerance, out=sys.stdout):
+    """Print how results compare with baseline to out, returning the names of the benchmarks that
+    regressed."""
+    regressed = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        ratio = results[name]['seconds'] / baseline[name]['seconds']
+        flag = ''
+        if ratio > 1 + tolerance:
+            flag = '  REGRESSION'
+            regressed.append(name)
+        print >> out, '%-32s %10.3f us -> %10.3f us  x%.2f%s' % (name, baseline[name]['seconds'] * 1e6,
+                                                               results[name]['seconds'] * 1e6, ratio, flag)
+    return regressed
+
+
+if __name__ == '__main__':
+    o = optparse.OptionParser(usage='%prog [options]', description=__doc__)
+    o.add_option('-o', '--output', help='Write the results as JSON to this file ("-" for stdout)')
+    o.add_option('-b', '--baseline', help='Compare against the JSON results in this file')
+    o.add_option('-t', '--tolerance', type='float', default=0.1,
+                 help='Fractional slowdown against the baseline counted as a regression (default %default)')
+    o.add_option('-k', '--match', default='', help='Only run benchmarks whose name contains this string')
+    o.add_option('-m', '--min-time', type='float', default=0.2,
+                 help='Minimum seconds per timed run (default %default)')
+    o.add_option('-r', '--repeat', type='int', default=3, help='Timed runs per benchmark (default %default)')
+    o.add_option('-u', '--udp-rates', default='0.5,1',
+                 help='Comma-separated rates in Gb/s for the loopback UDP round trip, or "" to skip '
+                      '(default %default)')
+    o.add_option('-l', '--list', action='store_true', help='List the benchmarks and exit')
+    opts, args = o.parse_args(sys.argv[1:])
+
+    rates = [float(r) for r in opts.udp_rates.split(',') if r]
+    benchmarks = []
+    for gen in (bench_pack(), bench_unpack(), bench_pack_numpy(), bench_genpackets(), bench_assemble(),
+                bench_iterheaps(), bench_udp(rates)):
+        benchmarks.extend(b for b in gen if opts.match in b[0])
+    if opts.list:
+        for name, func, nbytes in benchmarks:
+            print name
+        sys.exit(0)
+
+    results = {}
+    for name, func, nbytes in benchmarks:
+        if name.startswith('udp/'):
+            # The UDP round trip times itself, and also reports how many heaps made it through
+            runs = [func() for r in range(opts.repeat)]
+            seconds = min(t for t, n in runs if t is not None) if any(t for t, n in runs) else float('inf')
+            results[name] = {'seconds': seconds, 'calls': 1, 'bytes': nbytes, 'MBps': nbytes / seconds / 1e6,
+                             'heaps_lost': max(UDP_HEAPS - n for t, n in runs)}
+        else:
+            seconds, calls = run(func, opts.min_time, opts.repeat)
+            results[name] = {'seconds': seconds, 'calls': calls, 'bytes': nbytes,
+                             'MBps': nbytes / seconds / 1e6}
+        if opts.output != '-':
+            print '%-32s %10.3f us  %9.1f MB/s' % (name, seconds * 1e6, results[name]['MBps'])
+    report = {'python': sys.version.split()[0], 'host': socket.gethostname(), 'time': time.time(),
+              'results': results}
+    if opts.output == '-':
+        json.dump(report, sys.stdout, indent=1, sort_keys=True)
+        print
+    elif opts.output:
+        f = open(opts.output, 'w')
+        json.dump(report, f, indent=1, sort_keys=True)
+        f.close()
+    if opts.baseline:
+        out = sys.stderr if opts.output == '-' else sys.stdout
+        regressed = compare(results, json.load(open(opts.baseline))['results'], opts.tolerance, out)
+        if regressed:
+            print >> sys.stderr, '%d benchmarks regressed: %s' % (len(regressed), ', '.join(regressed))
+            sys.exit(1)
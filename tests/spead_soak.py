@@ -0,0 +1,136 @@
+#! /usr/bin/env python
+"""Soak test: send heaps from an ItemGroup over loopback UDP, receive them with iterheaps() and apply
+them to another ItemGroup, for as long as asked.  At intervals, sample the process's RSS, the live
+SpeadPacket/SpeadHeap objects and packet buffers (from _spead.alloc_stats()) and the number of
+objects tracked by the garbage collector.  At the end, fit a line to the samples taken after the
+warm-up and exit with status 1 if RSS or any of the counts grew faster than allowed."""
+import optparse
+import gc
+import json
+import resource
+import sys
+import threading
+import time
+import numpy
+import spead64_48 as spead
+import spead64_48._spead as _spead
+
+
+def rss_kb():
+    """Return the resident set size of this process in kB (the peak, where /proc is unavailable)."""
+    try:
+        f = open('/proc/self/statm')
+        pages = int(f.read().split()[1])
+        f.close()
+        return pages * (resource.getpagesize() / 1024)
+    except IOError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def sample(t0, stats):
+    s = {'t': time.time() - t0, 'rss_kb': rss_kb(), 'gc_objects': len(gc.get_objects())}
+    s.update(_spead.alloc_stats())
+    s.update(stats)
+    return s
+
+
+def slope(samples, key):
+    """Return the least-squares slope of samples[key] against time, per minute."""
+    t = numpy.array([s['t'] for s in samples])
+    y = numpy.array([s[key] for s in samples], dtype=numpy.float64)
+    if len(t) < 2 or numpy.ptp(t) == 0:
+        return 0.
+    return numpy.polyfit(t, y, 1)[0] * 60
+
+
+class Receiver(threading.Thread):
+    """Apply the heaps arriving on port to an ItemGroup, counting them."""
+    def __init__(self, port, buffer_size):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.rx = spead.TransportUDPrx(port, pkt_count=4096, buffer_size=buffer_size)
+        self.ig = spead.ItemGroup()
+        self.heaps = 0
+
+    def run(self):
+        for heap in spead.iterheaps(self.rx):
+            self.ig.update(heap)
+            self.heaps += 1
+
+
+if __name__ == '__main__':
+    o = optparse.OptionParser(usage='%prog [options]', description=__doc__)
+    o.add_option('-d', '--duration', type='float', default=3600.,
+                 help='Seconds to run for (default %default)')
+    o.add_option('-i', '--interval', type='float', default=10.,
+                 help='Seconds between samples (default %default)')
+    o.add_option('-w', '--warmup', type='float', default=60.,
+                 help='Seconds to run before the samples used for the fit (default %default)')
+    o.add_option('--rss-slope', type='float', default=64.,
+                 help='Most RSS growth allowed, in kB per minute (default %default)')
+    o.add_option('--obj-slope', type='float', default=16.,
+                 help='Most growth allowed in live SpeadPackets, SpeadHeaps, packet buffers and '
+                      'gc-tracked objects, per minute (default %default)')
+    o.add_option('-p', '--port', type='int', default=8888, help='Loopback UDP port (default %default)')
+    o.add_option('-g', '--gbps', type='float', default=0.5, help='Transmit rate in Gb/s (default %default)')
+    o.add_option('-s', '--shape', default='256,256', help='Shape of the uint8 array sent (default %default)')
+    o.add_option('--descriptor-interval', type='int', default=100,
+                 help='Re-send the descriptors every this many heaps (default %default)')
+    o.add_option('-o', '--output', help='Also write the samples as JSON to this file')
+    opts, args = o.parse_args(sys.argv[1:])
+
+    shape = tuple(int(s) for s in opts.shape.split(','))
+    rx = Receiver(opts.port, 16 << 20)
+    time.sleep(.1)  # the socket is bound by the net thread, after start() returns
+    rx.start()
+    tx = spead.Transmitter(spead.TransportUDPtx('127.0.0.1', opts.port, rate=opts.gbps * 1e9))
+    ig = spead.ItemGroup()
+    ig.add_item(name='cnt', description='heap counter', init_val=0)
+    ig.add_item(name='data', description='soak data', ndarray=(numpy.dtype(numpy.uint8), shape))
+    ig.set_descriptor_interval(opts.descriptor_interval)
+
+    keys = ('rss_kb', 'SpeadPacket', 'SpeadHeap', 'pkt_buffers_in_use', 'gc_objects')
+    samples, sent, t0 = [], 0, time.time()
+    next_sample = t0 + opts.warmup
+    try:
+        while time.time() - t0 < opts.duration:
+            ig['cnt'] = sent
+            data = numpy.empty(shape, dtype=numpy.uint8)
+            data.fill(sent % 256)
+            ig['data'] = data
+            tx.send_heap(ig.get_heap())
+            sent += 1
+            if time.time() >= next_sample:
+                # Let the receiver catch up, so that packets in flight do not count as growth
+                deadline = time.time() + 1
+                while rx.heaps < sent and time.time() < deadline:
+                    time.sleep(.001)
+                s = sample(t0, {'sent': sent, 'received': rx.heaps})
+                samples.append(s)
+                print ' '.join('%s=%d' % (k, s[k]) for k in ('t',) + keys + ('sent', 'received'))
+                sys.stdout.flush()
+                next_sample += opts.interval
+    except KeyboardInterrupt:
+        print 'Interrupted'
+    tx.end()
+    rx.join(5)
+    rx.rx.stop()
+
+    if opts.output:
+        f = open(opts.output, 'w')
+        json.dump(samples, f, indent=1)
+        f.close()
+    failed = []
+    for k in keys:
+        limit = opts.rss_slope if k == 'rss_kb' else opts.obj_slope
+        m = slope(samples, k)
+        print '%-20s %+10.2f per minute (limit %g)' % (k, m, limit)
+        if m > limit:
+            failed.append(k)
+    if len(samples) < 3:
+        print 'Too few samples to judge: run for longer than the warm-up'
+        sys.exit(2)
+    if failed:
+        print 'FAILED:', ', '.join(failed)
+        sys.exit(1)
+    print 'OK'
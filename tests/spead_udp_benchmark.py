@@ -13,23 +13,16 @@ def receive():
     print 'RX: initializing'
     tport = spead.TransportUDPrx(PORT)
     ig = spead.ItemGroup()
+    hist = spead.LatencyHistogram()
     print 'RX: listening'
-    pv_t1, pv_tx_time = 0, 0
     for heap in spead.iterheaps(tport):
-        t1 = time.time()
         ig.update(heap)
-        t2 = time.time()
-        t_total = t2 - ig['tx_time'] 
-        t_update = t2 - t1
-        t_rx_heap = pv_t1 - ig['pv_time']
-        print 't_total:', t_total
-        print 't_update:', t_update
-        print 't_rx_heap (prev):', t_rx_heap
-        print 't_tx (prev):', ig['pv_time'] - pv_tx_time
-        print '-' * 60
-        pv_t1 = t1
-        pv_tx_time = ig['tx_time']
+        hist.add(heap)
     print 'RX: stop'
+    for stage, s in sorted(hist.summary().items()):
+        if s['count']:
+            print '%-10s n=%-5d mean=%9.1f us  p50<=%9.1f us  p99<=%9.1f us  max=%9.1f us' % (
+                stage, s['count'], s['mean'] * 1e6, s['p50'] * 1e6, s['p99'] * 1e6, s['max'] * 1e6)
 
 
 def transmit():
@@ -41,24 +34,19 @@ def transmit():
         ig.add_item(name='var%d' % i,
                     description='Description for var%d' % i,
                     init_val=0)
-    ig.add_item(name='tx_time', description='Description', fmt='f\x00\x00\x40')
-    ig.add_item(name='pv_time', description='Description', fmt='f\x00\x00\x40')
     ig.add_item(name='data', description='Description for data',
         shape=SHAPE, fmt='i\x00\x00\x20')
     data0 = numpy.zeros(SHAPE)
     data1 = numpy.ones(SHAPE)
-    ig['pv_time'] = time.time()
     for i in range(20):
         ig['var%d' % i] = 1
         if i % 2 == 0:
             ig['data'] = data0
         else:
             ig['data'] = data1
-        ig['tx_time'] = time.time()
+        t0 = time.time()
         tx.send_heap(ig.get_heap())
-        ig['pv_time'] = time.time()
-        t_tx = ig['pv_time'] - ig['tx_time']
-        print 't_tx:', t_tx
+        print 't_tx:', time.time() - t0
     tx.end()
     print 'TX stop'
 
@@ -4,6 +4,9 @@ import spead64_48 as S
 import socket
 import time
 import struct
+import os
+import shutil
+import tempfile
 
 example_pkt = ''.join([
     S.pack(S.HDR_FMT, ((S.MAGIC, S.VERSION, S.ITEMSIZE, S.ADDRSIZE, 0, 3),)),
@@ -34,6 +37,13 @@ data_in_readout = False
 class TestBufferSocket(unittest.TestCase):
     def setUp(self):
         self.bs = _S.BufferSocket()
+        self.tmpdir = None
+
+    def tearDown(self):
+        if self.bs.is_running():
+            self.bs.stop()
+        if self.tmpdir is not None:
+            shutil.rmtree(self.tmpdir, ignore_errors=True)
 
     def test_start_stop(self):
         for i in range(10):
@@ -101,5 +111,35 @@ class TestBufferSocket(unittest.TestCase):
         self.assertFalse(self.bs.is_running())
         self.bs.unset_callback()
 
+    def test_recording(self):
+        self.tmpdir = tempfile.mkdtemp()
+        prefix = os.path.join(self.tmpdir, 'rec')
+        self.bs.start_recording(prefix, max_file_bytes=len(example_pkt) * 4)
+        self.assertRaises(RuntimeError, self.bs.start_recording, prefix)
+        self.assertRaises(RuntimeError, self.bs.set_callback, lambda pkt: None)
+        self.assertRaises(RuntimeError, self.bs.unset_callback)
+        self.bs.start(PORT, 0)
+        time.sleep(.1)  # the socket is bound by the net thread, after start() returns
+        for i in range(10):
+            loopback(example_pkt, port=PORT)
+        loopback(term_pkt, port=PORT)
+        deadline = time.time() + 5
+        while self.bs.is_running() and time.time() < deadline:
+            time.sleep(.01)
+        self.assertFalse(self.bs.is_running())
+        stats = self.bs.get_stats()
+        self.assertEqual(stats['pkts_received'], 11)
+        self.assertEqual(stats['pkts_written'], 11)
+        self.assertEqual(stats['files_written'], 3)
+        self.bs.stop_recording()
+        self.assertRaises(RuntimeError, self.bs.stop_recording)
+        filenames = ['%s.%05d.spead' % (prefix, i) for i in range(3)]
+        data = ''.join([open(f, 'rb').read() for f in filenames])
+        self.assertEqual(data, example_pkt * 10 + term_pkt)
+        t = S.TransportMmap(filenames[-1], save_index=False)
+        self.assertEqual(list(t.index['heap_cnt']), [3, 3, 0])
+        self.assertEqual(list(t.index['flags']), [0, 0, S.HEAP_INDEX_TERM])
+        self.assertEqual(t.heap_cnts(), [3])
+
 if __name__ == '__main__':
     unittest.main()
@@ -5,6 +5,11 @@ import struct
 import os
 import time
 import socket
+import numpy
+import tempfile
+import shutil
+import multiprocessing
+import threading
 #import logging; logging.basicConfig(level=logging.DEBUG)
 
 example_pkt = ''.join([
@@ -44,6 +49,18 @@ class TestMethods(unittest.TestCase):
         self.assertEqual(S.calcsize(S.ITEM_FMT), S.ITEMSIZE)
         self.assertEqual(S.calcsize(S.FORMAT_FMT), 32)
 
+    def test_pack_item_table(self):
+        items = [(S.IMMEDIATEADDR, S.HEAP_CNT_ID, '\x00\x00\x00\x00\x00\x05'),
+                 (S.IMMEDIATEADDR, 0x1000, '\x01\x02'),
+                 (S.DIRECTADDR, 0x1001, 2**40 + 3)]
+        self.assertEqual(S.pack_item_table(items),
+                         S.pack(S.ITEM_FMT, [(m, i, v if isinstance(v, (int, long)) else int(v.encode('hex'), 16))
+                                             for m, i, v in items]))
+        self.assertEqual(S.pack_item_table([]), '')
+        self.assertRaises(ValueError, S.pack_item_table, [(S.IMMEDIATEADDR, 0x1000, 'x' * (S.ADDRLEN + 1))])
+        self.assertRaises(ValueError, S.pack_item_table, [(S.IMMEDIATEADDR, 0x1000)])
+        self.assertRaises(TypeError, S.pack_item_table, [(S.IMMEDIATEADDR, 0x1000, 1.5)])
+
     def test_pack(self):
         self.assertEqual(S.pack(S.DEFAULT_FMT, ((2**32+2**8,),)), '\x01\x00\x00\x01\x00')
         self.assertEqual(S.pack(S.ITEM_FMT, ((0, 4, 8),)), '\x00\x00\x04\x00\x00\x00\x00\x08')
@@ -198,6 +215,13 @@ class TestDescriptor(unittest.TestCase):
         self.assertEqual(d.format, 'u\x00\x00\x28')
         self.assertEqual(d.nbits, 40)
         self.assertEqual(d.size, 1)
+        self.assertEqual(d.compression, None)
+
+    def test_compression(self):
+        self.assertRaises(ValueError, S.Descriptor, id=33001, name='var', compression='bogus')
+        d = S.Descriptor(id=33001, name='var', compression='zlib')
+        d = S.Descriptor(from_string=d.to_descriptor_string())
+        self.assertEqual(d.compression, 'zlib')
 
 
 class TestItem(unittest.TestCase):
@@ -209,18 +233,30 @@ class TestItem(unittest.TestCase):
 
     def test_get_set_value(self):
         self.i32.set_value(53)
-        self.assertEqual(self.i32._value[0][0], 53)
+        self.assertEqual(self.i32._value, 53)
         self.assertEqual(self.i32.get_value(), 53)
         self.i40.set_value(53)
-        self.assertEqual(self.i40._value[0][0], 53)
+        self.assertEqual(self.i40._value, 53)
         self.assertEqual(self.i40.get_value(), 53)
         self.i64.set_value(3.1415)
-        self.assertEqual(self.i64._value[0][0], 3.1415)
+        self.assertEqual(self.i64._value, 3.1415)
         self.assertEqual(self.i64.get_value(), 3.1415)
         #v = n.array([1, 0, 0, 1, 0, 1, 0, 1], dtype=n.bool)
         #self.u1.set_value(v)
         #self.assertTrue(n.all(self.u1.get_value() == v))
 
+    def test_scalar_storage(self):
+        self.assertRaises(AttributeError, setattr, self.i40, 'bogus', 1)
+        pair = S.Item(id=2**15+2**14, name='pair', fmt=S.mkfmt(('u', 16), ('u', 16)))
+        for i, v in ((self.i32, 53), (self.i40, 2**39), (self.i64, 3.1415), (pair, (3, 4))):
+            i.set_value(v)
+            s = i.to_value_string()
+            i.set_value(0)
+            i.from_value_string((S.ADDRNULL + s)[-max(S.ADDRLEN, len(s)):])
+            self.assertEqual(i._value, v)
+            self.assertEqual(i.get_value(), v)
+        self.assertEqual(pair.to_value_string(), '\x00\x03\x00\x04')
+
     def test_has_changed(self):
         self.i40._changed = False
         self.assertEqual(self.i40.has_changed(), False)
@@ -250,7 +286,28 @@ class TestItem(unittest.TestCase):
         #self.assertEqual(self.u1.to_value_string(), '\x95')
         #self.u1.from_value_string('\xf0')
         #self.assertTrue(n.all(self.u1.get_value() == n.array([1,1,1,1,0,0,0,0], dtype=n.bool)))
-        
+
+    def test_compressed_value_string(self):
+        i = S.Item(id=2**15+2**14, name='var', init_val=numpy.zeros(4096, dtype=numpy.uint8), compression='zlib')
+        s = i.to_value_string()
+        self.assertTrue(len(s) < 4096)
+        rx = S.Item(from_string=i.to_descriptor_string())
+        rx.from_value_string(s)
+        self.assertTrue(numpy.all(rx.get_value() == 0))
+
+    def test_compressed_scalar(self):
+        i = S.Item(id=2**15+2**14, name='var', fmt=S.mkfmt(('u', 32)), init_val=7, compression='zlib')
+        rx = S.Item(from_string=i.to_descriptor_string())
+        rx.from_value_string(i.to_value_string())
+        self.assertEqual(rx.get_value(), 7)
+        rx.compression = 'bogus'
+        self.assertRaises(ValueError, rx.from_value_string, i.to_value_string())
+
+    def test_pick_compression(self):
+        self.assertNotEqual(S.pick_compression('\x00' * 2**20, 1e6), None)
+        self.assertEqual(S.pick_compression(os.urandom(2**16), 1e12), None)
+        self.assertEqual(S.pick_compression('\x00' * 2**20, 1e6, codecs=[]), None)
+
 
 class TestItemGroup(unittest.TestCase):
     def setUp(self):
@@ -337,6 +394,149 @@ class TestItemGroup(unittest.TestCase):
         self.assertEqual(ig2['var2'], 10)
         #self.assertEqual(ig2['var3'], 15.15)
 
+    def test_compressed_round_trip(self):
+        self.ig.add_item(name='arr', init_val=numpy.arange(1024, dtype=numpy.int32), compression='zlib')
+        self.ig.add_item(name='scalar', fmt=S.mkfmt(('u', 32)), init_val=12345, compression='zlib')
+        ig2 = S.ItemGroup()
+        s = ''.join(S.iter_genpackets(self.ig.get_heap()))
+        for heap in S.iterheaps(S.TransportString(s)):
+            ig2.update(heap)
+        self.assertTrue(numpy.all(ig2['arr'] == self.ig['arr']))
+        self.assertEqual(ig2['scalar'], 12345)
+
+    def test_scalar_round_trip(self):
+        self.ig.add_item(name='u32a', fmt=S.mkfmt(('u', 32)), init_val=7)
+        self.ig.add_item(name='u32b', fmt=S.mkfmt(('u', 32)), init_val=2**32 - 1)
+        self.ig.add_item(name='i16', fmt=S.mkfmt(('i', 16)), init_val=-5)
+        self.ig.add_item(name='pair', fmt=S.mkfmt(('u', 16), ('u', 16)), init_val=(3, 4))
+        self.ig.add_item(name='f64', fmt=S.mkfmt(('f', 64)), init_val=3.1415)
+        self.ig['var1'] = 2**40
+        heap = self.ig.get_heap()
+        self.assertEqual(heap[self.ig.get_item('u32b').id], (S.IMMEDIATEADDR, '\xff\xff\xff\xff'))
+        self.assertEqual(heap[self.ig.get_item('pair').id], (S.IMMEDIATEADDR, '\x00\x03\x00\x04'))
+        self.assertEqual(heap[self.ig.get_item('f64').id][0], S.DIRECTADDR)
+        ig2 = S.ItemGroup()
+        for heap in S.iterheaps(S.TransportString(''.join(S.iter_genpackets(heap)))):
+            ig2.update(heap)
+        for name in self.ig.keys():
+            self.assertEqual(ig2[name], self.ig[name])
+        self.ig['u32a'] = 'bogus'
+        self.assertRaises(TypeError, self.ig.get_heap)
+
+    def test_lazy_update(self):
+        data = numpy.arange(1000, dtype=numpy.float32)
+        self.ig.add_item(name='arr', ndarray=data)
+        heaps = []
+        for i in range(3):
+            self.ig['arr'] = data + i
+            self.ig['var1'] = i
+            heaps.extend(S.iterheaps(S.TransportString(''.join(S.iter_genpackets(self.ig.get_heap())))))
+        decoded = []
+        decode = S.Item._decode_value
+        S.Item._decode_value = lambda item, s, copy=True: decoded.append(item.name) or decode(item, s, copy)
+        try:
+            ig2 = S.ItemGroup()
+            ig2.update(heaps[0])
+            self.assertEqual(decoded, [])
+            self.assertTrue(ig2.get_item('arr').has_changed())
+            self.assertTrue((ig2['arr'] == data).all())
+            self.assertTrue((ig2['arr'] == data).all())
+            self.assertEqual(decoded, ['arr'])
+            ig2.update(heaps[1])
+            ig2.update(heaps[2])
+            self.assertEqual(ig2['var1'], 2)
+            self.assertEqual(decoded, ['arr', 'var1'])
+            self.assertTrue((ig2['arr'] == data + 2).all())
+            self.assertEqual(decoded, ['arr', 'var1', 'arr'])
+            ig2.update(heaps[0], lazy=False)
+            self.assertEqual(sorted(decoded[3:]), ['arr', 'var1'])
+        finally:
+            S.Item._decode_value = decode
+
+    def test_descriptor_cache(self):
+        d1 = self.ig.get_descriptors()
+        d2 = self.ig.get_descriptors()
+        self.assertEqual(len(d1), 3)
+        self.assertTrue(all(a is b for a, b in zip(d1, d2)))
+        self.ig.get_item('var1').description = 'changed'
+        d3 = dict(zip(self.ig.ids(), self.ig.get_descriptors()))
+        self.assertEqual(d3[self.id1], self.ig.get_item('var1').to_descriptor_string())
+        self.assertTrue(d3[self.id2] is dict(zip(self.ig.ids(), d1))[self.id2])
+        self.assertRaises(ValueError, self.ig.set_descriptor_interval, 0)
+        self.ig.set_descriptor_interval(3)
+        n_desc = [len(self.ig.get_heap()[S.DESCRIPTOR_ID]) for i in range(7)]
+        self.assertEqual(n_desc, [3, 0, 3, 0, 0, 3, 0])
+        self.ig.set_descriptor_interval(None)
+        self.assertEqual(self.ig.get_heap()[S.DESCRIPTOR_ID], [])
+
+    def test_template(self):
+        self.ig.add_item(name='arr', init_val=numpy.zeros((64, 64), dtype=numpy.uint32))
+        self.ig['var1'] = 5
+        ig2 = S.ItemGroup()
+        for heap in S.iterheaps(S.TransportString(''.join(S.iter_genpackets(self.ig.get_heap())))):
+            ig2.update(heap)
+        tmpl = self.ig.get_template(['var1', 'arr'])
+        self.assertTrue(len(tmpl.packets) > 1)
+        s = []
+        for i in range(3):
+            self.ig['var1'] = i
+            self.ig['arr'] = numpy.ones((64, 64), dtype=numpy.uint32) * i
+            pkts = self.ig.fill_template(tmpl)
+            self.assertTrue(pkts is tmpl.packets)
+            s.append(''.join(str(p) for p in pkts))
+        for heap_cnt, heap in enumerate(S.iterheaps(S.TransportString(''.join(s)))):
+            self.assertEqual(heap.heap_cnt, heap_cnt + 2)
+            ig2.update(heap)
+            self.assertEqual(ig2['var1'], heap_cnt)
+            self.assertTrue(numpy.all(ig2['arr'] == heap_cnt))
+        self.assertRaises(ValueError, tmpl.fill, 9, {self.ig.get_item('arr').id: 'short'})
+        self.assertRaises(KeyError, tmpl.fill, 9, {0x7777: 'x'})
+
+    def test_iter_update(self):
+        self.ig.add_item(name='arr', init_val=numpy.zeros((16, 4), dtype=numpy.int32), compression='zlib')
+        s = []
+        for i in range(10):
+            self.ig['var1'] = i
+            if i % 3 == 0:
+                self.ig['arr'] = numpy.ones((16, 4), dtype=numpy.int32) * i
+            else:
+                self.ig.set_slice('arr', i, -i)
+            s.append(''.join(S.iter_genpackets(self.ig.get_heap())))
+        # Deliver two heaps out of order, to be put back in order
+        s[4], s[5] = s[5], s[4]
+        for processes in (False, True):
+            ig2 = S.ItemGroup()
+            heaps = S.iterheaps(S.TransportString(''.join(s)))
+            rv = list(ig2.iter_update(heaps, workers=3, processes=processes, max_reorder=2))
+            self.assertEqual([heap_cnt for heap_cnt, values in rv], range(1, 11))
+            self.assertEqual(rv[7][1]['var1'], 7)
+            self.assertTrue(numpy.all(rv[7][1]['arr'][7] == -7))
+            self.assertTrue(numpy.all(ig2['arr'] == self.ig['arr']))
+
+    def test_set_slice(self):
+        self.ig.add_item(name='arr', init_val=numpy.zeros((64, 8), dtype=numpy.float32))
+        ig2 = S.ItemGroup()
+        s = ''.join(S.iter_genpackets(self.ig.get_heap()))
+        for heap in S.iterheaps(S.TransportString(s)):
+            ig2.update(heap)
+        self.ig.set_slice('arr', slice(3, 5), 2.5)
+        self.ig.set_slice('arr', (40, 1), 1.5)
+        heap = self.ig.get_heap()
+        self.assertFalse(self.ig.get_item('arr').id in heap)
+        self.assertEqual(len(heap[S.DELTA_ID][1]), 2 * S.DELTA_HDRLEN + 3 * 8 * 4)
+        s = ''.join(S.iter_genpackets(heap))
+        for heap in S.iterheaps(S.TransportString(s)):
+            ig2.update(heap)
+        self.assertTrue(numpy.all(ig2['arr'] == self.ig['arr']))
+        self.assertEqual(ig2['arr'][40, 1], 1.5)
+        mask = numpy.zeros((64, 8), dtype=bool)
+        mask[7, 2] = mask[9, 0] = True
+        self.ig.set_slice('arr', mask, 4.0)
+        self.assertEqual(self.ig.get_item('arr')._dirty, [(7 * 32, 8 * 32), (9 * 32, 10 * 32)])
+        i = ig2.get_item('arr')
+        self.assertRaises(ValueError, i.from_delta_string,
+                          S._spead.pack(S.DELTA_FMT, ((i.id, 63 * 32, 64),)) + '\x00' * 64)
+
 
 class TestTransportString(unittest.TestCase):
     def setUp(self):
@@ -346,6 +546,26 @@ class TestTransportString(unittest.TestCase):
         pkts = [pkt for pkt in self.t_str.iterpackets()]
         self.assertEqual(len(pkts), 10)
 
+    def test_scan_packets(self):
+        ig = S.ItemGroup()
+        ig.add_item(name='var1', init_val=numpy.arange(4096, dtype=numpy.int32))
+        heap = ig.get_heap()
+        id = ig.get_item('data').id
+        sent = numpy.fromstring(heap[id][1], dtype=numpy.uint8)
+        pkts = list(S.iter_genpackets(heap))
+        data = 'junk' + pkts[0] + 'S' + ''.join(pkts[1:]) + pkts[0][:20]
+        found, offset = S.scan_packets(data, allow_junk=True, max_pkts=2)
+        self.assertEqual([f[:2] for f in found], [(4, len(pkts[0])), (5 + len(pkts[0]), len(pkts[1]))])
+        self.assertEqual(offset, 5 + len(pkts[0]) + len(pkts[1]))
+        self.assertEqual(found[0][2], found[1][2])
+        self.assertEqual(found[0][3], 0)
+        offsets = list(S.iter_packet_offsets(bytearray(data), allow_junk=True))
+        self.assertEqual(len(offsets), len(pkts))
+        self.assertEqual(S.scan_packets(data), ([], 0))
+        t_str = S.TransportString(data, allow_junk=True)
+        self.assertEqual([p.pack() for p in t_str.iterpackets()], pkts)
+        self.assertEqual(t_str.offset, len(data) - 20)
+
 
 class TestTransportFile(unittest.TestCase):
     def setUp(self):
@@ -381,6 +601,253 @@ class TestTransportFile(unittest.TestCase):
             pass
 
 
+class TestTransportMmap(unittest.TestCase):
+    def setUp(self):
+        self.filename = 'junkspeadtestfile'
+        ig = S.ItemGroup()
+        ig.add_item(name='var1')
+        tx = S.Transmitter(S.TransportFile(self.filename, 'w'))
+        for i in range(5):
+            ig['var1'] = i
+            tx.send_heap(ig.get_heap())
+        tx.end()
+        # A restarted sender repeats HEAP_CNT 1 without a TERM in between
+        ig.heap_cnt = 1
+        ig['var1'] = 10
+        f = open(self.filename, 'ab')
+        f.write(''.join(S.iter_genpackets(ig.get_heap())))
+        f.close()
+
+    def tearDown(self):
+        for f in (self.filename, self.filename + S.HEAP_INDEX_SUFFIX):
+            try:
+                os.remove(f)
+            except OSError:
+                pass
+
+    def test_iterpackets(self):
+        t = S.TransportMmap(self.filename)
+        self.assertEqual(len([pkt for pkt in t.iterpackets()]), 5)
+        self.assertTrue(t.got_term_sig)
+        self.assertTrue(os.path.exists(self.filename + S.HEAP_INDEX_SUFFIX))
+
+    def test_read_heap(self):
+        t = S.TransportMmap(self.filename)
+        self.assertEqual(t.heap_cnts(), [1, 2, 3, 4, 5])
+        self.assertEqual(t.occurrences(1), 2)
+        ig = S.ItemGroup()
+        ig.update(t.read_heap(1))
+        ig.update(t.read_heap(4))
+        self.assertEqual(ig['var1'], 3)
+        ig.update(t.read_heap(1, 1))
+        self.assertEqual(ig['var1'], 10)
+        self.assertRaises(KeyError, t.read_heap, 6)
+        self.assertRaises(IndexError, t.read_heap, 2, 1)
+
+    def test_index_validation(self):
+        S.TransportMmap(self.filename).close()
+        idx_name = self.filename + S.HEAP_INDEX_SUFFIX
+        self.assertEqual(open(idx_name, 'rb').read(8), S.HEAP_INDEX_MAGIC)
+        # An index built in a different scan mode is not reused
+        t = S.TransportMmap(self.filename, allow_junk=True, save_index=False)
+        self.assertEqual(len(t.index), len(S.TransportMmap(self.filename).index))
+        # Nor is one that no longer matches the file
+        f = open(self.filename, 'ab')
+        f.write('junk')
+        f.close()
+        os.utime(idx_name, None)
+        t = S.TransportMmap(self.filename, allow_junk=True)
+        self.assertEqual(t.heap_cnts(), [1, 2, 3, 4, 5])
+
+    def test_replay(self):
+        t = S.TransportMmap(self.filename)
+        rx = RawUDPrx(port=50002, rx_buflen=2**20)
+        tx = S.TransportUDPtx(ip='127.0.0.1', port=50002)
+        self.assertRaises(ValueError, S.replay, t, tx)
+        nbytes = int(t.index['length'].sum())
+        stats = S.replay(t, tx, rate=nbytes * 8 / 0.05)
+        self.assertEqual(stats['packets'], len(t.index))
+        self.assertEqual(''.join([rx.read() for i in range(len(t.index))]), open(self.filename, 'rb').read())
+        # The last packet is sent once all earlier ones would have left at the requested rate
+        expected = (nbytes - t.index['length'][-1]) * 8 / stats['requested_rate']
+        self.assertTrue(stats['elapsed'] >= expected * 0.99)
+        # Recorded timing, 10 ms apart, played back twice as fast
+        t.index['timestamp'] = 10**9 + numpy.arange(len(t.index)) * 10**7
+        stats = S.replay(t, tx, speed=2.0)
+        self.assertTrue(stats['elapsed'] >= (len(t.index) - 1) * 0.005 * 0.99)
+
+    def test_junk(self):
+        data = 'junk' + S.PKT_MAGIC + '\x00\x00\xff\xff' + open(self.filename, 'rb').read()
+        offsets = list(S.iter_packet_offsets(data, allow_junk=True))
+        self.assertEqual(offsets[0][0], 12)
+        self.assertEqual(list(S.iter_packet_offsets(data)), [])
+
+
+def _ring_consumer(ring, handles, results):
+    ig = S.ItemGroup()
+    for h in iter(handles.get, None):
+        ig.update(ring.get(h), copy=False)
+        results.put((ig['var1'], int(ig['arr'].sum()), ig['arr'].flags.owndata))
+        ring.release(h)
+
+
+class TestHeapRing(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.ring = S.HeapRing(os.path.join(self.tmpdir, 'ring'), n_slots=2, slot_size=2**16)
+        self.ig = S.ItemGroup()
+        self.ig.add_item(name='var1')
+        self.ig.add_item(name='arr', init_val=numpy.zeros(1024, dtype=numpy.float32))
+
+    def tearDown(self):
+        self.ring.close()
+        shutil.rmtree(self.tmpdir)
+
+    def heaps(self, n):
+        s = ''
+        for i in range(n):
+            self.ig['var1'] = i
+            self.ig['arr'] = numpy.ones(1024, dtype=numpy.float32) * i
+            s += ''.join(S.iter_genpackets(self.ig.get_heap()))
+        return S.iterheaps(S.TransportString(s))
+
+    def test_put_get(self):
+        heaps = list(self.heaps(3))
+        h1 = self.ring.put(heaps[0])
+        h2 = self.ring.put(heaps[1])
+        self.assertEqual(self.ring.put(heaps[2], block=False), None)
+        ig = S.ItemGroup()
+        ig.update(self.ring.get(h1), copy=False)
+        self.assertEqual(ig['var1'], 0)
+        self.assertFalse(ig['arr'].flags.owndata)
+        self.ring.release(h1)
+        self.assertRaises(KeyError, self.ring.get, h1)
+        h3 = self.ring.put(heaps[2], timeout=1)
+        self.assertEqual(h3[0], h1[0])
+        ig.update(self.ring.get(h2))
+        self.assertTrue(numpy.all(ig['arr'] == 1))
+        ig.update(self.ring.get(h3))
+        self.assertTrue(numpy.all(ig['arr'] == 2))
+
+    def test_worker_process(self):
+        handles, results = multiprocessing.Queue(), multiprocessing.Queue()
+        p = multiprocessing.Process(target=_ring_consumer, args=(self.ring, handles, results))
+        p.start()
+        for heap in self.heaps(5):
+            handles.put(self.ring.put(heap, timeout=5))
+        handles.put(None)
+        rv = [results.get(timeout=5) for i in range(5)]
+        p.join()
+        self.assertEqual(rv, [(i, 1024 * i, False) for i in range(5)])
+
+
+class TestTransportShm(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'shm')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_send_receive(self):
+        tx_tport = S.TransportShm(self.filename, 'w', n_slots=4, slot_size=2**16)
+        def send():
+            ig = S.ItemGroup()
+            ig.add_item(name='var1')
+            ig.add_item(name='arr', init_val=numpy.zeros((16, 4), dtype=numpy.int32), compression='zlib')
+            tx = S.Transmitter(tx_tport)
+            for i in range(10):
+                ig['var1'] = i
+                ig.set_slice('arr', i, i)
+                tx.send_heap(ig.get_heap())
+            tx.end()
+        p = multiprocessing.Process(target=send)
+        p.start()
+        rx_tport = S.TransportShm(self.filename)
+        ig = S.ItemGroup()
+        heap_cnts = []
+        for heap in S.iterheaps(rx_tport):
+            ig.update(heap)
+            heap_cnts.append(heap.heap_cnt)
+        p.join()
+        self.assertTrue(rx_tport.got_term_sig)
+        self.assertEqual(heap_cnts, range(1, 11))
+        self.assertEqual(ig['var1'], 9)
+        self.assertEqual(list(ig['arr'][:, 0]), range(10) + [0] * 6)
+
+
+class TestTransportStream(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def send(self, tx_tport):
+        ig = S.ItemGroup()
+        ig.add_item(name='var1')
+        ig.add_item(name='arr', init_val=numpy.zeros((1024, 64), dtype=numpy.int32))
+        tx = S.Transmitter(tx_tport)
+        for i in range(10):
+            ig['var1'] = i
+            ig.set_slice('arr', i, i)
+            tx.send_heap(ig.get_heap())
+        tx.end()
+
+    def receive(self, rx_tport, results):
+        ig = S.ItemGroup()
+        heap_cnts = []
+        for heap in S.iterheaps(rx_tport):
+            ig.update(heap)
+            heap_cnts.append(heap.heap_cnt)
+        results.append((rx_tport.got_term_sig, heap_cnts, ig['var1'], list(ig['arr'][:12, 0])))
+        rx_tport.close()
+
+    def check(self, results):
+        self.assertEqual(results, [(True, range(1, 11), 9, range(10) + [0, 0])] * len(results))
+
+    def test_tcp(self):
+        rx_tports = [S.TransportTCPrx(50010), S.TransportTCPrx(50011)]
+        results = []
+        threads = [threading.Thread(target=self.receive, args=(t, results)) for t in rx_tports]
+        for t in threads:
+            t.start()
+        tx_tport = S.TransportTCPtx('127.0.0.1', 50010)
+        tx_tport.connect('127.0.0.1', 50011)
+        self.send(tx_tport)
+        for t in threads:
+            t.join()
+        self.assertEqual(len(results), 2)
+        self.check(results)
+
+    def test_unix(self):
+        path = os.path.join(self.tmpdir, 'sock')
+        rx_tport = S.TransportUnixrx(path)
+        results = []
+        thread = threading.Thread(target=self.receive, args=(rx_tport, results))
+        thread.start()
+        self.send(S.TransportUnixtx(path))
+        thread.join()
+        self.check(results)
+        self.assertFalse(os.path.exists(path))
+
+    def test_frame(self):
+        heap = {S.HEAP_CNT_ID: (S.IMMEDIATEADDR, '\x00\x00\x00\x00\x00\x05'),
+                0x1001: (S.IMMEDIATEADDR, '\x00\x07'),
+                0x1002: (S.DIRECTADDR, 'abc'),
+                0x1003: (S.DIRECTADDR, ''),
+                S.DESCRIPTOR_ID: ['desc']}
+        h = S.frame_to_heap(bytearray(''.join(S.heap_to_frame(heap))))
+        self.assertEqual(h.heap_cnt, 5)
+        self.assertFalse(h.is_stream_ctrl_term)
+        items = h.get_items()
+        self.assertEqual(items[0x1001], '\x00\x00\x00\x00\x00\x07')
+        self.assertEqual(str(items[0x1002]), 'abc')
+        self.assertEqual(str(items[0x1003]), '')
+        self.assertEqual(items[S.DESCRIPTOR_ID], ['desc'])
+        self.assertRaises(ValueError, S.frame_to_heap, 'junk' * 4)
+
+
 class TestTransportUDPtx(unittest.TestCase):
     def setUp(self):
         self.t_tx = S.TransportUDPtx(ip='127.0.0.1', port=50001)
@@ -397,6 +864,77 @@ class TestTransportUDPtx(unittest.TestCase):
         self.assertRaises(AttributeError, f)
 
 
+class TestTransportUDPtxAsync(unittest.TestCase):
+    def setUp(self):
+        self.t_rx = RawUDPrx(port=50003)
+
+    def tearDown(self):
+        self.t_rx._udp_in.close()
+
+    def test_write_packets(self):
+        t_tx = S.TransportUDPtxAsync('127.0.0.1', 50003)
+        self.assertTrue(t_tx.write_packets(['abcd', bytearray('efgh')]))
+        self.assertTrue(t_tx.flush(timeout=5))
+        self.assertEqual(self.t_rx.read(4), 'abcd')
+        self.assertEqual(self.t_rx.read(4), 'efgh')
+        stats = t_tx.get_stats()
+        self.assertEqual(stats['queue_depth'], 0)
+        self.assertEqual(stats['max_queue_depth'], 1)
+        self.assertEqual(stats['heaps_sent'], 1)
+        self.assertEqual(stats['pkts_sent'], 2)
+        self.assertEqual(stats['bytes_sent'], 8)
+        self.assertTrue(0 < stats['latency_last'] <= stats['latency_max'])
+        t_tx.close()
+        self.assertRaises(RuntimeError, t_tx.write, 'abcd')
+        self.assertRaises(ValueError, S.TransportUDPtxAsync, '127.0.0.1', 50003, policy='junk')
+
+    def test_policies(self):
+        # At 80 kb/s each 1000-byte heap holds the sender thread for 0.1 s, so with room for a single
+        # heap on the queue, the third of three heaps written at once finds it full
+        pkt = 'x' * 1000
+        for policy, timeout, queued in [('drop_newest', None, False), ('drop_oldest', None, True),
+                                        ('block', .01, False), ('block', None, True)]:
+            t_tx = S.TransportUDPtxAsync('127.0.0.1', 50003, rate=8e4, max_heaps=1, policy=policy,
+                                         timeout=timeout)
+            self.assertTrue(t_tx.write_packets([pkt]))
+            time.sleep(.02)  # let the thread take the first heap off the queue
+            self.assertTrue(t_tx.write_packets([pkt]))
+            self.assertEqual(t_tx.write_packets([pkt]), queued)
+            self.assertTrue(t_tx.flush(timeout=5))
+            stats = t_tx.get_stats()
+            self.assertEqual(stats['max_queue_depth'], 1)
+            self.assertEqual(stats['heaps_dropped'], 0 if policy == 'block' and queued else 1)
+            self.assertEqual(stats['heaps_sent'], 3 - stats['heaps_dropped'])
+            for i in range(stats['heaps_sent']):
+                self.assertEqual(self.t_rx.read(), pkt)
+            t_tx.close()
+
+    def test_transmitter(self):
+        t_rx = S.TransportUDPrx(50004)
+        time.sleep(.1)  # the socket is bound by the net thread, after start() returns
+        watchdog = threading.Timer(10, t_rx.stop)
+        watchdog.start()
+        t_tx = S.TransportUDPtxAsync('127.0.0.1', 50004, max_heaps=2)
+        tx = S.Transmitter(t_tx)
+        ig = S.ItemGroup()
+        ig.add_item(name='data', description='array', ndarray=(numpy.dtype(numpy.uint32), (64, 64)))
+        for n in range(4):
+            ig['data'] = numpy.ones((64, 64), dtype=numpy.uint32) * n
+            tx.send_heap(ig.get_heap())
+        tx.end()
+        self.assertEqual(t_tx.get_stats()['heaps_sent'], 5)
+        rx_ig, vals = S.ItemGroup(), []
+        for heap in S.iterheaps(t_rx):
+            if heap.heap_cnt == (1 << (8 * S.ADDRLEN)) - 1:
+                continue  # the stream terminator
+            rx_ig.update(heap)
+            vals.append(rx_ig['data'][0, 0])
+        watchdog.cancel()
+        t_rx.stop()
+        time.sleep(.1)  # after a TERM the net thread closes the socket in its own time
+        self.assertEqual(vals, [0, 1, 2, 3])
+
+
 class TestTransportUDPrx(unittest.TestCase):
     def setUp(self):
         self.t_tx = S.TransportUDPtx(ip='127.0.0.1', port=50000)
@@ -416,6 +954,42 @@ class TestTransportUDPrx(unittest.TestCase):
         self.assertEqual(len(pkts), 3)
         self.assertFalse(t_rx.is_running())
 
+    def test_demux(self):
+        t_rx = S.TransportUDPrx(50002, streams=2)
+        time.sleep(.1)  # the socket is bound by the net thread, after start() returns
+        watchdog = threading.Timer(10, t_rx.stop)
+        watchdog.start()
+        txs, igs = [], []
+        for i in range(2):
+            txs.append(S.Transmitter(S.TransportUDPtx('127.0.0.1', 50002)))
+            igs.append(S.ItemGroup())
+            igs[-1].add_item(name='val', init_val=0)
+        # Both senders use the same HEAP_CNTs
+        for n in range(3):
+            for i, (tx, ig) in enumerate(zip(txs, igs)):
+                ig['val'] = 100 * i + n
+                tx.send_heap(ig.get_heap())
+        for tx in txs:
+            tx.end()
+        stats, rx_igs, vals = {}, {}, {}
+        for key, heap in S.iterheaps(t_rx, demux=True, stats=stats):
+            ig = rx_igs.setdefault(key, S.ItemGroup())
+            ig.update(heap)
+            vals.setdefault(key, []).append(ig['val'])
+        watchdog.cancel()
+        t_rx.stop()
+        time.sleep(.1)  # after a TERM the net thread closes the socket in its own time
+        self.assertEqual(len(vals), 2)
+        self.assertEqual(sorted(vals.values()), [[0, 1, 2], [100, 101, 102]])
+        for key in vals:
+            self.assertEqual(key[0], '127.0.0.1')
+            self.assertEqual(stats[key]['heaps'], 3)
+            self.assertEqual(stats[key]['incomplete_heaps'], 0)
+            self.assertEqual(stats[key]['packets'], 4)
+            self.assertTrue(stats[key]['terminated'])
+        self.assertEqual(t_rx.get_stats()['terms_received'], 2)
+
+
 
 class TestTransmitter(unittest.TestCase):
     def setUp(self):
@@ -477,12 +1051,126 @@ class Testiterheaps(unittest.TestCase):
         self.assertEqual(ig['var1'], 1)
         self.assertEqual(ig['var2'], 2)
 
+    def test_lossy(self):
+        ig = S.ItemGroup()
+        ig.add_item(name='cnt', init_val=7)
+        data = numpy.arange(128 * 128, dtype=numpy.uint32).reshape(128, 128)
+        ig.add_item(name='data', ndarray=data)
+        ig['data'] = data
+        heap = ig.get_heap()
+        id = ig.get_item('data').id
+        sent = numpy.fromstring(heap[id][1], dtype=numpy.uint8)
+        pkts = list(S.iter_genpackets(heap))
+        self.assertTrue(len(pkts) > 2)
+        data_str = ''.join(pkts[:1] + pkts[2:]) + term_pkt
+        self.assertEqual(list(S.iterheaps(S.TransportString(data_str))), [])
+        heaps = list(S.iterheaps(S.TransportString(data_str), lossy=True))
+        self.assertEqual(len(heaps), 1)
+        self.assertFalse(heaps[0].is_valid)
+        rx_ig = S.ItemGroup()
+        self.assertEqual(rx_ig.update(heaps[0], lossy=True), ['data'])
+        self.assertEqual(rx_ig['cnt'], 7)
+        got = numpy.fromstring(heaps[0].get_items(include_invalid=True)[id], dtype=numpy.uint8)
+        ok = numpy.unpackbits(numpy.fromstring(heaps[0].get_received(id), dtype=numpy.uint8))
+        ok = ok[:len(sent)].astype(bool)
+        self.assertFalse(ok.all())
+        self.assertTrue((got[ok] == sent[ok]).all())
+        self.assertTrue((got[~ok] == 0).all())
+        whole = ok.reshape(-1, 4).all(axis=1)
+        self.assertTrue((rx_ig['data'].flatten()[whole] == data.flatten()[whole]).all())
+
+    def test_on_item(self):
+        ig = S.ItemGroup()
+        ig.add_item(name='cnt', init_val=7)
+        data = numpy.arange(128 * 128, dtype=numpy.uint32).reshape(128, 128)
+        ig.add_item(name='data', ndarray=data)
+        ig['data'] = data
+        heap = ig.get_heap()
+        sent = dict(heap)
+        pkts = list(S.iter_genpackets(heap))
+        self.assertTrue(len(pkts) > 2)
+        tport = S.TransportString(''.join(pkts) + term_pkt)
+        n_pkts = []
+        iterpackets = tport.iterpackets
+
+        def counting():
+            for pkt in iterpackets():
+                n_pkts.append(pkt)
+                yield pkt
+        tport.iterpackets = counting
+        events = []
+        on_item = lambda heap_cnt, id, value: events.append((len(n_pkts), heap_cnt, id, value))
+        heaps = list(S.iterheaps(tport, on_item=on_item))
+        self.assertEqual(len(heaps), 1)
+        got = dict((id, value) for n, heap_cnt, id, value in events if id != S.DESCRIPTOR_ID)
+        items = heaps[0].get_items()
+        for id, value in got.iteritems():
+            self.assertEqual(value, items[id])
+        self.assertEqual(sorted(got.keys()), sorted(k for k in items if k != S.DESCRIPTOR_ID))
+        self.assertEqual(sorted(v for n, c, id, v in events if id == S.DESCRIPTOR_ID),
+                         sorted(sent[S.DESCRIPTOR_ID]))
+        self.assertTrue(all(c == heaps[0].heap_cnt for n, c, id, v in events))
+        # The descriptors and cnt were delivered with the first packet, the array with the last
+        data_id = ig.get_item('data').id
+        self.assertEqual([n for n, c, id, v in events if id == data_id], [len(pkts)])
+        self.assertTrue(all(n == 1 for n, c, id, v in events if id != data_id))
+
+    def test_item_filter(self):
+        ig = S.ItemGroup()
+        for name in ('a', 'b', 'c'):
+            data = numpy.arange(128 * 128, dtype=numpy.uint32).reshape(128, 128) + ord(name)
+            ig.add_item(name=name, ndarray=data)
+            ig[name] = data
+        pkts = list(S.iter_genpackets(ig.get_heap()))
+        id = ig.get_item('b').id
+        heaps = list(S.iterheaps(S.TransportString(''.join(pkts) + term_pkt), ids=[id]))
+        self.assertEqual(len(heaps), 1)
+        self.assertTrue(heaps[0].is_valid)
+        self.assertTrue(heaps[0].dropped_packets > len(pkts) / 2)
+        items = heaps[0].get_items()
+        self.assertEqual(sorted(items.keys()), [S.DESCRIPTOR_ID, id])
+        self.assertEqual(len(items[S.DESCRIPTOR_ID]), 3)
+        ig2 = S.ItemGroup()
+        ig2.update(heaps[0])
+        self.assertTrue((ig2['b'] == ig['b']).all())
+        self.assertEqual(ig2['a'], None)
+
     def test_heaplen(self):
         data = open(self.filename).read()
         rx_tport = S.TransportString(data)
         for _ in S.iterheaps(rx_tport):
             self.assertFalse(rx_tport.got_term_sig)
         self.assertTrue(rx_tport.got_term_sig)
-    
+
+
+class TestLatencyHistogram(unittest.TestCase):
+    def test_add(self):
+        class Stamped:
+            first_pkt_ns, last_pkt_ns = 1000, 3000
+            finalize_start_ns, finalize_end_ns, handoff_ns = 3500, 4500, 4600
+        hist = S.LatencyHistogram()
+        hist.add(Stamped(), now_ns=5600)
+        s = hist.summary()
+        self.assertEqual(s['assemble']['count'], 1)
+        self.assertAlmostEqual(s['assemble']['mean'], 2e-6)
+        self.assertAlmostEqual(s['queue']['max'], 5e-7)
+        self.assertAlmostEqual(s['total']['min'], 4.6e-6)
+        self.assertEqual(hist.histogram('finalize'), [(1024e-9, 1)])
+        self.assertAlmostEqual(hist.percentile('consume', 99), 1e-6)
+        hist.reset()
+        self.assertEqual(hist.summary()['total'], {'count': 0})
+
+    def test_iterheaps(self):
+        ig = S.ItemGroup()
+        ig.add_item(name='var1', init_val=1)
+        hist = S.LatencyHistogram()
+        for heap in S.iterheaps(S.TransportString(''.join(S.iter_genpackets(ig.get_heap())))):
+            self.assertTrue(0 < heap.finalize_start_ns <= heap.finalize_end_ns <= heap.handoff_ns)
+            self.assertEqual(heap.first_pkt_ns, 0)  # Packets from a string have no receive time
+            ig.update(heap)
+            hist.add(heap)
+        s = hist.summary()
+        self.assertEqual([s[k]['count'] for k in ('assemble', 'finalize', 'handoff', 'consume')], [0, 1, 1, 1])
+
 if __name__ == '__main__':
     unittest.main()
@@ -2,6 +2,7 @@ import unittest
 import spead64_48 as S
 import spead64_48._spead as _S
 import struct
+import threading
 
 ex_pkts = {
     '2-pkt-heap+next-pkt': [
@@ -272,6 +273,132 @@ class TestSpeadHeap(unittest.TestCase):
         heap.finalize()
         self.assertTrue(heap.is_valid)
 
+    def test_lossy(self):
+        heap = _S.SpeadHeap()
+        heap.add_packet(self.pkts[1])  # The first packet, with item 0x3333 and the start of 0x3334, is lost
+        heap.finalize()
+        self.assertFalse(heap.is_valid)
+        self.assertEqual(heap.get_invalid_ids(), [])  # The lost packet held the item pointers
+        heap = _S.SpeadHeap()
+        heap.add_packet(self.pkts[0])
+        heap.finalize()
+        self.assertFalse(heap.is_valid)
+        self.assertEqual(heap.get_items().keys(), [S.DESCRIPTOR_ID])
+        self.assertEqual(sorted(heap.get_invalid_ids()), [0x3333, 0x3334])
+        items = heap.get_items(include_invalid=True)
+        self.assertEqual(items[0x3333], struct.pack('>d', 3.1415) + '\x00' * 8)
+        self.assertEqual(heap.get_received(0x3333), '\xff\x00')
+        self.assertRaises(KeyError, heap.get_received, 0x7777)
+
+    def test_get_ready_items(self):
+        heap = _S.SpeadHeap()
+        self.assertEqual(heap.get_ready_items(), [])
+        heap.add_packet(self.pkts[1])
+        self.assertEqual(heap.get_ready_items(), [])  # The item pointers have not arrived
+        heap.add_packet(self.pkts[0])
+        # 0x3334 is last and the heap has no HEAP_LEN, so its end is not known until finalize()
+        self.assertEqual(heap.get_ready_items(),
+                         [(0, 0x3333, struct.pack('>d', 3.1415) + struct.pack('>d', 2.7182))])
+        self.assertEqual(heap.get_ready_items(set([0])), [])
+        heap = _S.SpeadHeap()
+        heap.add_packet(self.pkts[0])
+        self.assertEqual(heap.get_ready_items(), [])
+
+    def test_item_filter(self):
+        heap = _S.SpeadHeap()
+        heap.set_item_filter([0x3333])
+        heap.add_packet(self.pkts[0])
+        heap.add_packet(self.pkts[1])
+        self.assertEqual(heap.dropped_packets, 0)  # Both packets hold part of 0x3333
+        heap.finalize()
+        self.assertTrue(heap.is_valid)
+        self.assertEqual(heap.get_items(), {S.DESCRIPTOR_ID: [],
+                                            0x3333: struct.pack('>d', 3.1415) + struct.pack('>d', 2.7182)})
+        heap.reset()
+        heap.add_packet(self.pkts[0])
+        heap.add_packet(self.pkts[1])
+        heap.finalize()
+        self.assertEqual(sorted(heap.get_items().keys()), [S.DESCRIPTOR_ID, 0x3333])
+        heap.set_item_filter(None)
+        heap.reset()
+        heap.add_packet(self.pkts[0])
+        heap.add_packet(self.pkts[1])
+        heap.finalize()
+        self.assertEqual(sorted(heap.get_items().keys()), [S.DESCRIPTOR_ID, 0x3333, 0x3334])
+        self.assertRaises(TypeError, heap.set_item_filter, 5)
+
+    def test_reset(self):
+        heap = _S.SpeadHeap()
+        heap.add_packet(self.pkts[0])
+        heap.add_packet(self.pkts[1])
+        heap.finalize()
+        self.assertTrue(heap.is_valid)
+        heap.reset()
+        self.assertEqual(heap.heap_cnt, -1)
+        self.assertFalse(heap.is_valid)
+        self.assertRaises(RuntimeError, heap.get_items)
+        heap.add_packet(self.pkts[2])
+        self.assertEqual(heap.heap_cnt, 4)
+        heap.reset()
+        heap.add_packet(self.pkts[1])
+        heap.add_packet(self.pkts[0])
+        heap.finalize()
+        self.assertTrue(heap.is_valid)
+        self.assertEqual(heap.get_items()[0x3333], struct.pack('>dd', 3.1415, 2.7182))
+
+    def test_recycling(self):
+        heap = _S.SpeadHeap()
+        heap.add_packet(self.pkts[0])
+        addr = id(heap)
+        del heap
+        heap = _S.SpeadHeap()
+        self.assertEqual(id(heap), addr)
+        self.assertEqual(heap.heap_cnt, -1)
+        addr = id(self.pkts[2])
+        self.pkts.pop()
+        pkt = _S.SpeadPacket()
+        self.assertEqual(id(pkt), addr)
+        self.assertEqual(pkt.n_items, 0)
+
+    def test_alloc_stats(self):
+        stats = _S.alloc_stats()
+        heap = _S.SpeadHeap()
+        for pkt in self.pkts[:2]:
+            heap.add_packet(pkt)
+        pkt = _S.SpeadPacket()
+        s = _S.alloc_stats()
+        self.assertEqual(s['SpeadPacket'], stats['SpeadPacket'] + 1)
+        self.assertEqual(s['SpeadHeap'], stats['SpeadHeap'] + 1)
+        self.assertEqual(s['pkt_buffers_in_use'], stats['pkt_buffers_in_use'] + 1)
+        del heap, pkt
+        s = _S.alloc_stats()
+        for k in ('SpeadPacket', 'SpeadHeap', 'pkt_buffers_in_use'):
+            self.assertEqual(s[k], stats[k])
+
+    def test_finalize_in_threads(self):
+        pkts = []
+        for i in range(8):
+            pkts.append([])
+            heap = {S.HEAP_CNT_ID: (S.IMMEDIATEADDR, S.pack(S.DEFAULT_FMT, ((i + 1,),))),
+                    0x1000: (S.DIRECTADDR, chr(i) * 2**18)}
+            for p in S.iter_genpackets(heap):
+                pkts[-1].append(_S.SpeadPacket())
+                pkts[-1][-1].unpack(p)
+        results = [None] * len(pkts)
+        def finalize(i):
+            heap = _S.SpeadHeap()
+            for pkt in pkts[i]:
+                heap.add_packet(pkt)
+            heap.finalize()
+            results[i] = heap.get_items()[0x1000]
+        threads = [threading.Thread(target=finalize, args=(i,)) for i in range(len(pkts))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        for i, val in enumerate(results):
+            self.assertEqual(val, chr(i) * 2**18)
+
     def test_get_items(self):
         heap = _S.SpeadHeap()
         self.assertRaises(RuntimeError, heap.get_items)